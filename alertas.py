@@ -0,0 +1,389 @@
+# Alertas evaluadas sobre las lecturas a medida que llegan
+#
+# AlertEngine revisa cada lote (ReadingBatch) en el camino de ingesta del
+# servidor TCP, antes de la cola, con reglas por dispositivo de cuatro tipos:
+#
+#   max / min  -> la lectura supera (max) o queda debajo (min) del umbral
+#   rate       -> cambio por minuto respecto de una lectura de hace "interval" s
+#   zscore     -> |lectura - promedio| / desviación de las últimas "window"
+#                 lecturas del dispositivo
+#
+# Cada regla tiene histéresis: se activa al pasar el umbral y se desactiva
+# recién cuando vuelve "hysteresis" unidades más atrás, así una lectura que
+# oscila sobre el umbral no genera una alerta por muestra. Solo los cambios de
+# estado (activa / resuelta) salen como alertas, a los suscriptores (el hilo
+# escritor las guarda en la tabla Alerts y el canal de control las reenvía).
+#
+# El costo por lectura es constante: los lotes grandes (tramas binarias) se
+# evalúan por columnas, con el promedio y la desviación de zscore tomados al
+# principio del lote; los chicos (líneas de texto) lectura por lectura en
+# Python, donde NumPy costaría más que la regla. En modo 2 (STATS) se usan los
+# extremos de la ventana para max/min (y es el valor que guarda la alerta) y el
+# promedio para rate y zscore.
+import bisect
+import json
+import math
+import threading
+
+import numpy as np
+
+import lecturas
+import metricas
+
+KINDS = ("max", "min", "rate", "zscore")
+FIELDS = ("temperature", "humidity")
+RATE_INTERVAL_S = 60.0     # Lapso contra el que se mide el cambio por minuto
+RATE_STEPS = 60            # Referencias de rate por lapso (la última lectura de cada tramo)
+ZSCORE_WINDOW = 300        # Lecturas de la ventana de zscore
+ZSCORE_MIN_SAMPLES = 30    # Con menos lecturas en la ventana no se evalúa
+ZSCORE_MIN_STD = 0.1       # Resolución del DHT22: una serie constante no tiene desviación 0
+SCALAR_BATCH = 10           # Lotes de menos lecturas se evalúan sin NumPy
+# Reglas por defecto del daemon; --alert-rules las reemplaza con un JSON de la misma forma
+DEFAULT_RULES = [
+    {"name": "temp_alta", "field": "temperature", "kind": "max", "threshold": 40.0, "hysteresis": 1.0},
+    {"name": "temp_baja", "field": "temperature", "kind": "min", "threshold": 0.0, "hysteresis": 1.0},
+    {"name": "hum_alta", "field": "humidity", "kind": "max", "threshold": 90.0, "hysteresis": 2.0},
+    {"name": "temp_salto", "field": "temperature", "kind": "rate", "threshold": 5.0, "hysteresis": 1.0},
+    {"name": "temp_anomala", "field": "temperature", "kind": "zscore", "threshold": 5.0, "hysteresis": 2.0},
+    {"name": "hum_anomala", "field": "humidity", "kind": "zscore", "threshold": 5.0, "hysteresis": 2.0},
+]
+# Campos de una alerta, en el orden de la tabla Alerts
+ALERT_FIELDS = ("timestamp", "device_id", "rule", "kind", "field", "active", "value", "score", "threshold")
+
+ALERTS_RAISED = metricas.REGISTRY.counter("alerts_total", "Alertas activadas", "rule")
+
+
+class AlertRule:
+    def __init__(self, name, field, kind, threshold, hysteresis=0.0, device_id=None, interval=RATE_INTERVAL_S,
+                 window=ZSCORE_WINDOW, min_samples=ZSCORE_MIN_SAMPLES, min_std=ZSCORE_MIN_STD):
+        if field not in FIELDS:
+            raise ValueError(f"Campo desconocido en la regla {name}: {field}")
+        if kind not in KINDS:
+            raise ValueError(f"Tipo de regla desconocido en {name}: {kind}")
+        if hysteresis < 0:
+            raise ValueError(f"La histéresis de {name} no puede ser negativa")
+        self.name = name
+        self.field = field
+        self.kind = kind
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.device_id = device_id   # None: todos los dispositivos
+        self.interval = interval
+        self.window = window
+        self.min_samples = min_samples
+        self.min_std = min_std
+        # Columna (valor, máximo, mínimo) que se compara con el umbral y se guarda
+        # en la alerta: en modo 2 max y min miran los extremos de la ventana
+        self.column = {"max": 1, "min": 2}.get(kind, 0)
+
+    def __repr__(self):
+        return f"AlertRule({self.name!r}, {self.field!r}, {self.kind!r}, {self.threshold!r})"
+
+    def scores(self, state, timestamps, columns):
+        # Lote -> valor comparado con el umbral por lectura (NaN = no se evalúa)
+        # y cuánto lo supera: > 0 activa, <= -hysteresis resuelve
+        value, high, low = columns
+        if self.kind == "max":
+            return high, high - self.threshold
+        if self.kind == "min":
+            return low, self.threshold - low
+        if self.kind == "rate":
+            score = state.rates(timestamps, value, self.interval)
+        else:
+            window = state.window
+            if window.count >= self.min_samples:
+                mean, std = window.stats()
+                score = (value - mean) / max(std, self.min_std)
+            else:
+                score = np.full(len(value), np.nan)
+            window.extend(value)
+        return score, np.abs(score) - self.threshold
+
+    def score(self, state, timestamp, value, high, low):
+        # Lo mismo para una lectura
+        if self.kind == "max":
+            return high, high - self.threshold
+        if self.kind == "min":
+            return low, self.threshold - low
+        if self.kind == "rate":
+            score = state.rate(timestamp, value, self.interval)
+        else:
+            window = state.window
+            score = math.nan
+            if window.count >= self.min_samples:
+                mean, std = window.stats()
+                score = (value - mean) / max(std, self.min_std)
+            window.add(value)
+        return score, abs(score) - self.threshold
+
+
+# Últimas "size" lecturas en un arreglo circular con su suma y suma de
+# cuadrados: promedio y desviación en O(1), sin los mínimos y máximos de
+# RollingWindow. Los valores se guardan restando el primero para que la suma
+# de cuadrados no pierda precisión y las sumas se recalculan cada size
+# lecturas para que no acumulen error. Los lugares vacíos valen 0, así
+# llenarlos no cambia las sumas
+class _MeanWindow:
+    __slots__ = ("values", "size", "count", "pos", "offset", "total", "squares", "updates")
+
+    def __init__(self, size):
+        self.values = np.zeros(size)
+        self.size = size
+        self.count = 0
+        self.pos = 0
+        self.offset = None
+        self.total = 0.0
+        self.squares = 0.0
+        self.updates = 0
+
+    def stats(self):
+        # (promedio, desviación muestral)
+        n = self.count
+        mean = self.total / n
+        variance = (self.squares - self.total * mean) / (n - 1) if n > 1 else 0.0
+        return self.offset + mean, math.sqrt(max(variance, 0.0))
+
+    def add(self, value):
+        if value != value:
+            return
+        if self.offset is None:
+            self.offset = value
+        value -= self.offset
+        old = float(self.values[self.pos])
+        self.values[self.pos] = value
+        self.total += value - old
+        self.squares += value * value - old * old
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self.updates += 1
+        if self.updates >= self.size:
+            self._recompute()
+
+    def extend(self, values):
+        total = values.sum()
+        if total != total:
+            # Lecturas faltantes (NaN): solo aquí hace falta filtrar
+            values = values[~np.isnan(values)]
+            total = values.sum()
+        n = len(values)
+        if not n:
+            return
+        if self.offset is None:
+            self.offset = float(values[0])
+        if n >= self.size:
+            self.values[:] = values[-self.size:] - self.offset
+            self.pos = 0
+            self.count = self.size
+            self._recompute()
+            return
+        values = values - self.offset
+        end = self.pos + n
+        if end <= self.size:
+            slots = self.values[self.pos:end]
+            self.total += float(total - n * self.offset - slots.sum())
+            self.squares += float(values @ values - slots @ slots)
+            slots[:] = values
+        else:
+            index = np.arange(self.pos, end) % self.size
+            old = self.values[index]
+            self.values[index] = values
+            self.total += float(total - n * self.offset - old.sum())
+            self.squares += float(values @ values - old @ old)
+        self.pos = end % self.size
+        self.count = min(self.count + n, self.size)
+        self.updates += n
+        if self.updates >= self.size:
+            self._recompute()
+
+    def _recompute(self):
+        self.total = float(self.values.sum())
+        self.squares = float(self.values @ self.values)
+        self.updates = 0
+
+
+# Estado de una regla para un dispositivo
+class _RuleState:
+    __slots__ = ("active", "ref_t", "ref_v", "window")
+
+    def __init__(self, rule):
+        self.active = False
+        # Referencias de rate: la última lectura de cada tramo de interval / RATE_STEPS s
+        self.ref_t = []
+        self.ref_v = []
+        self.window = _MeanWindow(rule.window) if rule.kind == "zscore" else None
+
+    def rate(self, timestamp, value, interval):
+        # Cambio por minuto contra la referencia más nueva con al menos interval s
+        if value != value:
+            return math.nan
+        step = interval / RATE_STEPS
+        if self.ref_t and timestamp // step == self.ref_t[-1] // step:
+            self.ref_t[-1] = timestamp
+            self.ref_v[-1] = value
+        else:
+            self.ref_t.append(timestamp)
+            self.ref_v.append(value)
+        i = bisect.bisect_right(self.ref_t, timestamp - interval) - 1
+        if i < 0:
+            return math.nan
+        if i > 0:
+            # Las lecturas siguientes no van a usar referencias más viejas
+            del self.ref_t[:i]
+            del self.ref_v[:i]
+        return (value - self.ref_v[0]) / (timestamp - self.ref_t[0]) * 60
+
+    def rates(self, timestamps, values, interval):
+        # Lo mismo para un lote, por columnas
+        step = interval / RATE_STEPS
+        valid = None
+        if values.sum() != values.sum():
+            valid = ~np.isnan(values)
+            if not valid.any():
+                return np.full(len(values), np.nan)
+            last_t = timestamps[valid]
+            last_v = values[valid]
+        else:
+            last_t = timestamps
+            last_v = values
+        first = float(last_t[0]) // step
+        ref_t = self.ref_t
+        ref_v = self.ref_v
+        if ref_t and ref_t[-1] // step == first:
+            # El tramo de la última referencia sigue en este lote
+            ref_t = ref_t[:-1]
+            ref_v = ref_v[:-1]
+        if valid is None and float(timestamps[-1]) // step == first:
+            # Todo el lote en un tramo (lo normal en una trama): una sola referencia nueva
+            ref_t = np.array(ref_t + [float(timestamps[-1])])
+            ref_v = np.array(ref_v + [float(values[-1])])
+        else:
+            steps = last_t // step
+            last = np.append(steps[1:] != steps[:-1], True)
+            ref_t = np.concatenate((ref_t, last_t[last]))
+            ref_v = np.concatenate((ref_v, last_v[last]))
+        index = np.searchsorted(ref_t, timestamps - interval, "right") - 1
+        keep = int(index[-1])
+        if valid is None and index[0] >= 0:
+            rates = (values - ref_v[index]) / (timestamps - ref_t[index]) * 60
+        else:
+            rates = np.full(len(values), np.nan)
+            found = index >= 0
+            if valid is not None:
+                found &= valid
+            rates[found] = (values[found] - ref_v[index[found]]) / (timestamps[found] - ref_t[index[found]]) * 60
+        # Las lecturas siguientes no van a usar referencias más viejas que la de la última
+        self.ref_t = ref_t[max(keep, 0):].tolist()
+        self.ref_v = ref_v[max(keep, 0):].tolist()
+        return rates
+
+    def transition(self, level, hysteresis):
+        # Una lectura: True si la regla cambió de estado
+        if self.active:
+            if level <= -hysteresis:
+                self.active = False
+                return True
+        elif level > 0:
+            self.active = True
+            return True
+        return False
+
+    def transitions(self, levels, hysteresis):
+        # Un lote: índices de las lecturas donde la regla cambió de estado
+        if not (levels <= -hysteresis if self.active else levels > 0).any():
+            return ()
+        raised = levels > 0
+        events = raised | (levels <= -hysteresis)
+        # Cada lectura queda en el estado del último evento (activar o resolver)
+        # hasta ella, o en el anterior al lote si no hubo ninguno
+        last = np.maximum.accumulate(np.where(events, np.arange(len(levels)), -1))
+        states = np.where(last >= 0, raised[np.maximum(last, 0)], self.active)
+        previous = np.concatenate(([self.active], states[:-1]))
+        self.active = bool(states[-1])
+        return np.flatnonzero(states != previous).tolist()
+
+
+class AlertEngine:
+    def __init__(self, rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+        self.rules = [rule if isinstance(rule, AlertRule) else AlertRule(**rule) for rule in rules]
+        self.states = {}      # device_id -> [(regla, _RuleState)] de las reglas que le corresponden
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        # callback(alertas) se llama en el hilo de ingesta: debe ser rápido
+        self.listeners.append(callback)
+
+    def evaluate(self, batch):
+        # Evalúa un lote de lecturas y avisa a los suscriptores de los cambios de
+        # estado; devuelve las alertas (diccionarios con ALERT_FIELDS)
+        n = len(batch)
+        if not n or not self.rules:
+            return []
+        device_id = batch.device_id
+        alerts = []
+        with self.lock:
+            states = self.states.get(device_id)
+            if states is None:
+                states = self.states[device_id] = [(rule, _RuleState(rule)) for rule in self.rules
+                                                   if rule.device_id is None or rule.device_id == device_id]
+            if n < SCALAR_BATCH:
+                for record in batch.data.tolist():
+                    timestamp = record[0] / lecturas.NS
+                    if record[9] == 1:
+                        columns = {"temperature": (record[1],) * 3, "humidity": (record[2],) * 3}
+                    else:
+                        columns = {"temperature": record[3:6], "humidity": record[6:9]}
+                    for rule, state in states:
+                        value, high, low = column = columns[rule.field]
+                        score, level = rule.score(state, timestamp, value, high, low)
+                        if state.transition(level, rule.hysteresis):
+                            alerts.append(self._alert(rule, device_id, state.active, timestamp, column[rule.column],
+                                                      score))
+            else:
+                timestamps = batch.timestamps()
+                _, temp, temp_max, temp_min, hum, hum_max, hum_min = lecturas.summary_columns(batch.data)
+                columns = {"temperature": (temp, temp_max, temp_min), "humidity": (hum, hum_max, hum_min)}
+                for rule, state in states:
+                    scores, levels = rule.scores(state, timestamps, columns[rule.field])
+                    changes = state.transitions(levels, rule.hysteresis)
+                    if not changes:
+                        continue
+                    values = columns[rule.field][rule.column]
+                    # Los cambios alternan entre activar y resolver hasta el estado final
+                    active = state.active == (len(changes) % 2 == 1)
+                    for i in changes:
+                        alerts.append(self._alert(rule, device_id, active, float(timestamps[i]), float(values[i]),
+                                                  float(scores[i])))
+                        active = not active
+        if alerts:
+            for callback in self.listeners:
+                callback(alerts)
+        return alerts
+
+    def _alert(self, rule, device_id, active, timestamp, value, score):
+        if active:
+            ALERTS_RAISED.inc(1, rule.name)
+        return {
+            "timestamp": timestamp,
+            "device_id": device_id,
+            "rule": rule.name,
+            "kind": rule.kind,
+            "field": rule.field,
+            "active": active,
+            "value": round(value, lecturas.DECIMALS),
+            "score": round(score, 3),
+            "threshold": rule.threshold,
+        }
+
+    def active_alerts(self):
+        # [(device_id, regla)] de las alertas activas en este momento
+        with self.lock:
+            return [(device_id, rule.name) for device_id, states in self.states.items()
+                    for rule, state in states if state.active]
+
+
+def load_rules(path):
+    # Reglas desde un archivo JSON: lista de objetos con los argumentos de AlertRule
+    with open(path) as f:
+        return [AlertRule(**rule) for rule in json.load(f)]
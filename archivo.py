@@ -0,0 +1,290 @@
+# Archivo histórico de SensorData en Parquet, particionado por día
+#
+# SQLite es cómodo para las últimas semanas, pero leer meses de lecturas como
+# tuplas fila por fila es lento y ocupa mucha memoria. Archiver copia las
+# lecturas más antiguas que ARCHIVE_DAYS a archivos Parquet (columnas
+# comprimidas) en directorio/date=AAAA-MM-DD/part-<primer id>-<último id>.parquet,
+# de a ARCHIVE_CHUNK_ROWS filas, así la memoria no depende del tamaño de la base
+# de datos. Con prune=True las filas archivadas se borran de SensorData; los
+# agregados por minuto, hora y día se conservan (el espacio liberado lo reusa
+# SQLite, el archivo no se achica sin VACUUM), y DataBase.fetch_stats los usa
+# en lugar de las lecturas borradas, con resolución de un minuto.
+#
+# El último id archivado se guarda en directorio/_estado.json recién después de
+# escribir cada tramo, y los archivos de un tramo que no llegó a registrarse se
+# borran al volver a empezar: si el proceso se corta no quedan filas repetidas
+# ni se borra de SQLite algo que no esté en disco.
+#
+# scan() y read_table() leen el archivo de forma perezosa con pyarrow.dataset:
+# solo las columnas pedidas, solo los archivos de los días del rango y con el
+# filtro por timestamp aplicado por cada grupo de filas.
+#
+# Uso: python archivo.py --db sensor_data.db --dir archivo --days 30 --prune
+import argparse
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import metricas
+from basedatos import DB_FILE, LOG_FORMAT, SENSOR_COLUMNS
+
+ARCHIVE_DIR = "archivo"
+ARCHIVE_DAYS = 30              # Se archivan las lecturas con más días que esto
+ARCHIVE_CHUNK_ROWS = 50000     # Filas leídas de SQLite y escritas por tramo (~60 MB de memoria)
+ARCHIVE_COMPRESSION = "zstd"
+ARCHIVE_INTERVAL_S = 3600      # Cada cuánto archiva el daemon
+READ_BATCH_ROWS = 65536        # Filas por RecordBatch al leer
+STATE_FILE = "_estado.json"
+DAY_MS = 86400000
+
+# timestamp en milisegundos UTC, como en SQLite
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("timestamp", pa.timestamp("ms", tz="UTC")),
+    ("temperature", pa.float64()),
+    ("humidity", pa.float64()),
+    ("temp_avg", pa.float64()),
+    ("temp_max", pa.float64()),
+    ("temp_min", pa.float64()),
+    ("hum_avg", pa.float64()),
+    ("hum_max", pa.float64()),
+    ("hum_min", pa.float64()),
+    ("mode", pa.int8()),
+    ("device_id", pa.string()),
+    ("window_ms", pa.int32()),   # Solo en las lecturas calculadas en el servidor
+    ("samples", pa.int32()),     # Solo en las lecturas resumidas por la cola (coalesce)
+])
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+log = logging.getLogger(__name__)
+ARCHIVED_ROWS = metricas.REGISTRY.counter("archive_rows_total", "Filas copiadas al archivo Parquet")
+PRUNED_ROWS = metricas.REGISTRY.counter("archive_pruned_rows_total", "Filas archivadas borradas de SQLite")
+
+
+def day_partition(day):
+    # Número de día desde 1970 -> "date=AAAA-MM-DD"
+    return "date=" + (datetime.date(1970, 1, 1) + datetime.timedelta(days=int(day))).isoformat()
+
+
+def _first_id(name):
+    # "part-<primer id>-<último id>.parquet" -> primer id
+    return int(name[5:-8].split("-")[0])
+
+
+def _date(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date().isoformat()
+
+
+class Archiver:
+    def __init__(self, db_file, directory=ARCHIVE_DIR, chunk_rows=ARCHIVE_CHUNK_ROWS,
+                 compression=ARCHIVE_COMPRESSION):
+        self.db_file = db_file
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+        self.last_id = self.load_state()
+        self.clean_incomplete()
+
+    def load_state(self):
+        try:
+            with open(os.path.join(self.directory, STATE_FILE)) as f:
+                return json.load(f)["last_id"]
+        except FileNotFoundError:
+            return 0
+
+    def save_state(self):
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"last_id": self.last_id, "db": os.path.abspath(self.db_file)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def clean_incomplete(self):
+        # Temporales y tramos escritos después del último id registrado
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                stale = name.startswith(".") and name.endswith(".tmp")
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    stale = _first_id(name) > self.last_id
+                if stale:
+                    log.warning("Borrando %s de un archivado incompleto", os.path.join(root, name))
+                    os.remove(os.path.join(root, name))
+
+    def archive(self, until=None, prune=False):
+        # Archiva las lecturas con timestamp anterior a until (segundos; None =
+        # todas) que sigan a la última archivada, por orden de id. Si aparece una
+        # más nueva se detiene ahí: lo archivado es siempre un prefijo de ids.
+        # Devuelve (filas archivadas, filas borradas de SQLite)
+        until_ms = None if until is None else int(until * 1000)
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        archived = pruned = 0
+        t0 = time.perf_counter()
+        try:
+            while True:
+                rows = conn.execute(f'''
+                    SELECT id, {SENSOR_COLUMNS}, window_ms, samples FROM SensorData
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (self.last_id, self.chunk_rows)).fetchall()
+                if until_ms is not None:
+                    newer = next((i for i, row in enumerate(rows) if row[1] >= until_ms), None)
+                    if newer is not None:
+                        rows = rows[:newer]
+                if not rows:
+                    break
+                first_id = self.last_id
+                self.write_chunk(rows)
+                self.last_id = rows[-1][0]
+                self.save_state()
+                archived += len(rows)
+                ARCHIVED_ROWS.inc(len(rows))
+                if prune:
+                    with conn:
+                        deleted = conn.execute("DELETE FROM SensorData WHERE id > ? AND id <= ?",
+                                               (first_id, self.last_id)).rowcount
+                    pruned += deleted
+                    PRUNED_ROWS.inc(deleted)
+                if len(rows) < self.chunk_rows:
+                    break
+        finally:
+            conn.close()
+        if archived:
+            log.info("Archivo: %d filas hasta el id %d en %s (%d borradas de SQLite) en %.1f s", archived,
+                     self.last_id, self.directory, pruned, time.perf_counter() - t0)
+        return archived, pruned
+
+    def write_chunk(self, rows):
+        # Un archivo por día presente en el tramo, con el rango de ids en el nombre
+        columns = list(zip(*rows))
+        table = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, SCHEMA)],
+                                     schema=SCHEMA)
+        days = np.asarray(columns[1], dtype=np.int64) // DAY_MS
+        name = f"part-{rows[0][0]}-{rows[-1][0]}.parquet"
+        if days[0] == days[-1] and (days == days[0]).all():
+            parts = [(days[0], table)]
+        else:
+            parts = [(day, table.take(np.flatnonzero(days == day))) for day in np.unique(days)]
+        for day, part in parts:
+            directory = os.path.join(self.directory, day_partition(day))
+            os.makedirs(directory, exist_ok=True)
+            tmp = os.path.join(directory, "." + name + ".tmp")
+            # Antes de borrar de SQLite los datos tienen que estar en disco
+            with open(tmp, "wb") as f:
+                pq.write_table(part, f, compression=self.compression)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(directory, name))
+
+
+def _filter(start=None, end=None, device_id=None, mode=None):
+    # start y end en segundos desde 1970
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field("timestamp") >= pa.scalar(int(start * 1000), SCHEMA.field("timestamp").type))
+    if end is not None:
+        conditions.append(ds.field("timestamp") < pa.scalar(int(end * 1000), SCHEMA.field("timestamp").type))
+    if device_id is not None:
+        conditions.append(ds.field("device_id") == device_id)
+    if mode is not None:
+        conditions.append(ds.field("mode") == mode)
+    result = None
+    for condition in conditions:
+        result = condition if result is None else result & condition
+    return result
+
+
+def dataset(directory=ARCHIVE_DIR, start=None, end=None):
+    # Solo los archivos de los días entre start y end (segundos): las demás
+    # particiones ni se listan
+    first = None if start is None else _date(start)
+    last = None if end is None else _date(end)
+    files = []
+    for partition in sorted(os.listdir(directory)):
+        if not partition.startswith("date="):
+            continue
+        day = partition[5:]
+        if (first is not None and day < first) or (last is not None and day > last):
+            continue
+        path = os.path.join(directory, partition)
+        if not os.path.isdir(path):
+            continue
+        # En orden de id, que es casi el orden de llegada
+        names = [name for name in os.listdir(path) if name.startswith("part-") and name.endswith(".parquet")]
+        files.extend(os.path.join(path, name) for name in sorted(names, key=_first_id))
+    return ds.dataset(files, schema=SCHEMA.append(pa.field("date", pa.string())), format="parquet",
+                      partitioning=PARTITIONING, partition_base_dir=directory)
+
+
+def scan(directory=ARCHIVE_DIR, start=None, end=None, columns=None, device_id=None, mode=None,
+         batch_size=READ_BATCH_ROWS):
+    # Iterador de pyarrow.RecordBatch con las columnas pedidas (por defecto todas
+    # las de SensorData); se lee de disco a medida que se consume
+    return dataset(directory, start, end).to_batches(columns=columns or SCHEMA.names,
+                                                     filter=_filter(start, end, device_id, mode),
+                                                     batch_size=batch_size)
+
+
+def read_table(directory=ARCHIVE_DIR, start=None, end=None, columns=None, device_id=None, mode=None):
+    # Lo mismo que scan() pero en una sola pyarrow.Table, ordenada por timestamp.
+    # Casi siempre ya viene ordenada; ordenar duplica la memoria, así que solo se
+    # hace si alguna lectura llegó tarde
+    table = dataset(directory, start, end).to_table(columns=columns or SCHEMA.names,
+                                                    filter=_filter(start, end, device_id, mode))
+    if "timestamp" in table.column_names and table.num_rows > 1:
+        timestamps = table["timestamp"]
+        if not pc.all(pc.greater_equal(timestamps[1:], timestamps[:-1])).as_py():
+            table = table.sort_by("timestamp")
+    return table
+
+
+# Archivado periódico dentro del daemon
+class ArchiveThread(threading.Thread):
+    def __init__(self, db_file, directory=ARCHIVE_DIR, days=ARCHIVE_DAYS, prune=False,
+                 interval=ARCHIVE_INTERVAL_S):
+        threading.Thread.__init__(self, daemon=True)
+        self.archiver = Archiver(db_file, directory)
+        self.days = days
+        self.prune = prune
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                self.archiver.archive(time.time() - self.days * 86400, self.prune)
+            except (sqlite3.Error, OSError, pa.ArrowException) as e:
+                log.error("Error al archivar en %s: %s", self.archiver.directory, e)
+            if self.stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self.stop_event.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiva lecturas antiguas de SensorData en Parquet")
+    parser.add_argument("--db", default=DB_FILE, help="archivo de la base de datos SQLite")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="directorio del archivo Parquet")
+    parser.add_argument("--days", type=float, default=ARCHIVE_DAYS,
+                        help="archivar las lecturas con más de estos días; 0 archiva todo")
+    parser.add_argument("--prune", action="store_true", help="borrar de SQLite las filas archivadas")
+    parser.add_argument("--chunk-rows", type=int, default=ARCHIVE_CHUNK_ROWS, help="filas por tramo")
+    args = parser.parse_args()
+    logging.basicConfig(level="INFO", format=LOG_FORMAT, stream=sys.stdout)
+
+    archiver = Archiver(args.db, args.dir, args.chunk_rows)
+    archived, pruned = archiver.archive(time.time() - args.days * 86400 if args.days else None, args.prune)
+    if not archived:
+        log.info("No hay lecturas nuevas para archivar")
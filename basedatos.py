@@ -0,0 +1,546 @@
+# Base de datos SQLite del monitor: esquema, resúmenes por minuto, hora y día y
+# consultas (DataBase)
+#
+# La usan el daemon (monitorpi.py, que escribe desde DataBaseWriter), la
+# interfaz (interfaz.py, que lee el historial), el archivo en Parquet
+# (archivo.py) y los benchmarks. Está fuera de monitorpi.py para que importarla
+# no cargue de nuevo el daemon cuando este corre como script (__main__).
+import itertools
+import logging
+import sqlite3
+import time
+
+import numpy as np
+
+import alertas
+import protocolo
+from lecturas import VALUE_FIELDS, ReadingBatch
+
+DB_FILE = "sensor_data.db"
+DB_SYNCHRONOUS = "NORMAL"  # OFF, NORMAL o FULL (PRAGMA synchronous de SQLite)
+PLOT_POINTS = 1000    # Puntos visibles en los gráficos y en las consultas reducidas
+LOG_FORMAT = "%(message)s"  # Formato del log del daemon, la interfaz y el archivo
+
+log = logging.getLogger(__name__)
+
+# Tabla de lecturas; timestamp en milisegundos desde 1970 (UTC)
+SENSOR_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        temperature REAL,
+        humidity REAL,
+        temp_avg REAL,
+        temp_max REAL,
+        temp_min REAL,
+        hum_avg REAL,
+        hum_max REAL,
+        hum_min REAL,
+        mode INTEGER NOT NULL,
+        device_id TEXT,
+        window_ms INTEGER,
+        samples INTEGER
+    )
+'''
+SENSOR_COLUMNS = '''timestamp, temperature, humidity, temp_avg, temp_max, temp_min,
+                     hum_avg, hum_max, hum_min, mode, device_id'''
+# Las lecturas de modo 2 calculadas en el servidor (WindowAggregator) llevan su
+# ventana en window_ms; las recibidas de las placas la tienen en NULL y las
+# consultas de siempre solo ven esas (RECEIVED_ONLY)
+RECEIVED_ONLY = "window_ms IS NULL"
+# Las lecturas de modo 2 que arma la cola al resumir (cola.coalesce_batches) llevan
+# en samples cuántas lecturas en bruto representan; en los agregados pesan eso
+# Las consultas devuelven el timestamp en segundos, igual que las lecturas en memoria
+SELECT_COLUMNS = '''timestamp / 1000.0, temperature, humidity, temp_avg, temp_max, temp_min,
+                     hum_avg, hum_max, hum_min, mode, device_id'''
+
+# Tablas de agregados (de la más gruesa a la más fina) y tamaño de sus tramos en ms.
+# Cada fila resume las lecturas de un dispositivo y un modo en un tramo; en modo 2
+# la suma usa los promedios y el mínimo/máximo los extremos que envía el ESP32
+ROLLUPS = (("SensorRollup1d", 86400000), ("SensorRollup1h", 3600000), ("SensorRollup1m", 60000))
+ROLLUP_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        device_id TEXT NOT NULL,
+        mode INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        temp_sum REAL,
+        temp_min REAL,
+        temp_max REAL,
+        hum_sum REAL,
+        hum_min REAL,
+        hum_max REAL,
+        PRIMARY KEY (device_id, mode, bucket)
+    ) WITHOUT ROWID
+'''
+ROLLUP_COLUMNS = "device_id, mode, bucket, count, temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max"
+# Suma un lote a los tramos existentes; coalesce porque min/max de SQLite con un
+# NULL devuelven NULL
+ROLLUP_UPSERT = '''
+    INSERT INTO {name} ({columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (device_id, mode, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        temp_sum = coalesce(temp_sum + excluded.temp_sum, temp_sum, excluded.temp_sum),
+        temp_min = coalesce(min(temp_min, excluded.temp_min), temp_min, excluded.temp_min),
+        temp_max = coalesce(max(temp_max, excluded.temp_max), temp_max, excluded.temp_max),
+        hum_sum = coalesce(hum_sum + excluded.hum_sum, hum_sum, excluded.hum_sum),
+        hum_min = coalesce(min(hum_min, excluded.hum_min), hum_min, excluded.hum_min),
+        hum_max = coalesce(max(hum_max, excluded.hum_max), hum_max, excluded.hum_max)
+'''
+# Agregación de cualquier fuente con las columnas de ROLLUP_COLUMNS
+ROLLUP_AGGREGATES = '''SUM(count), SUM(temp_sum), MIN(temp_min), MAX(temp_max),
+                        SUM(hum_sum), MIN(hum_min), MAX(hum_max)'''
+# Las mismas columnas calculadas desde SensorData (una lectura por fila)
+RAW_AS_ROLLUP = '''
+    SELECT coalesce(device_id, '') AS device_id, mode, timestamp AS bucket, coalesce(samples, 1) AS count,
+           CASE WHEN mode = 2 THEN temp_avg * coalesce(samples, 1) ELSE temperature END AS temp_sum,
+           CASE WHEN mode = 2 THEN temp_min ELSE temperature END AS temp_min,
+           CASE WHEN mode = 2 THEN temp_max ELSE temperature END AS temp_max,
+           CASE WHEN mode = 2 THEN hum_avg * coalesce(samples, 1) ELSE humidity END AS hum_sum,
+           CASE WHEN mode = 2 THEN hum_min ELSE humidity END AS hum_min,
+           CASE WHEN mode = 2 THEN hum_max ELSE humidity END AS hum_max
+    FROM SensorData
+'''
+
+# Cambios de estado de las alertas (alertas.AlertEngine); timestamp en ms como SensorData
+ALERT_TABLE = '''
+    CREATE TABLE IF NOT EXISTS Alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        device_id TEXT,
+        rule TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        field TEXT NOT NULL,
+        active INTEGER NOT NULL,
+        value REAL,
+        score REAL,
+        threshold REAL
+    )
+'''
+ALERT_COLUMNS = ", ".join(alertas.ALERT_FIELDS)
+ALERT_INSERT = f"INSERT INTO Alerts ({ALERT_COLUMNS}) VALUES ({', '.join('?' * len(alertas.ALERT_FIELDS))})"
+
+# Hasta dónde de la bitácora (bitacora.SpoolQueue) ya está guardado; una sola fila
+SPOOL_TABLE = '''
+    CREATE TABLE IF NOT EXISTS SpoolCheckpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL
+    )
+'''
+
+
+def _merge_sum(a, b):
+    return b if a is None else a if b is None else a + b
+
+
+def _merge_min(a, b):
+    return b if a is None else a if b is None or a <= b else b
+
+
+def _merge_max(a, b):
+    return b if a is None else a if b is None or a >= b else b
+
+
+def merge_group(m, g):
+    # Suma el grupo g a la lista m: [count, temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max]
+    m[0] += g[0]
+    m[1] = _merge_sum(m[1], g[1])
+    m[2] = _merge_min(m[2], g[2])
+    m[3] = _merge_max(m[3], g[3])
+    m[4] = _merge_sum(m[4], g[4])
+    m[5] = _merge_min(m[5], g[5])
+    m[6] = _merge_max(m[6], g[6])
+
+
+def merge_rollups(items, size):
+    # Junta pares ((dispositivo, modo, tramo), grupo) en tramos de "size" ms
+    merged = {}
+    for (device_id, mode, bucket), g in items:
+        key = (device_id, mode, bucket - bucket % size)
+        m = merged.get(key)
+        if m is None:
+            merged[key] = list(g)
+        else:
+            merge_group(m, g)
+    return merged
+
+
+# Columnas de las que sale cada resumen (suma, mínimo, máximo) según el modo
+ROLLUP_SOURCES = {
+    1: (("temperature", "temperature", "temperature"), ("humidity", "humidity", "humidity")),
+    2: (("temp_avg", "temp_min", "temp_max"), ("hum_avg", "hum_min", "hum_max")),
+}
+
+
+def _nan_to_none(values):
+    return [None if v != v else v for v in values.tolist()]
+
+
+def rollup_batches(batches, size):
+    # Lotes de lecturas -> grupos de "size" ms por columnas: bincount para la
+    # cantidad y las sumas y reduceat sobre los valores ordenados por grupo para
+    # mínimos y máximos. Las lecturas faltantes (NaN) no cuentan en los resúmenes
+    # y las resumidas por la cola cuentan por sus samples
+    groups = {}
+    for batch in batches:
+        timestamps = (batch.data["timestamp"] + 500000) // 1000000
+        buckets = timestamps - timestamps % size
+        modes = batch.data["mode"]
+        values = {}
+        for mode in np.unique(modes).tolist():
+            rows = modes == mode
+            keys, inverse = np.unique(buckets[rows], return_inverse=True)
+            order = np.argsort(inverse, kind="stable")
+            starts = np.searchsorted(inverse[order], np.arange(len(keys)))
+            samples = batch.data["samples"][rows]
+            weights = np.where(samples > 0, samples, 1) if samples.any() else None
+            columns = [np.bincount(inverse, weights).astype(np.int64).tolist()]
+            for sum_name, min_name, max_name in ROLLUP_SOURCES[2 if mode == 2 else 1]:
+                for name in (sum_name, min_name, max_name):
+                    if name not in values:
+                        values[name] = batch.values(name)
+                v = values[sum_name][rows]
+                valid = ~np.isnan(v)
+                if weights is not None:
+                    v = v * weights
+                sums = np.bincount(inverse, weights=np.where(valid, v, 0.0))
+                sums[np.bincount(inverse, weights=valid) == 0] = np.nan
+                columns.append(_nan_to_none(sums))
+                columns.append(_nan_to_none(np.fmin.reduceat(values[min_name][rows][order], starts)))
+                columns.append(_nan_to_none(np.fmax.reduceat(values[max_name][rows][order], starts)))
+            device_id = batch.device_id or ''
+            for bucket, *g in zip(keys.tolist(), *columns):
+                key = (device_id, mode, bucket)
+                m = groups.get(key)
+                if m is None:
+                    groups[key] = g
+                else:
+                    merge_group(m, g)
+    return groups
+
+
+def split_range(start_ms, end_ms, levels=ROLLUPS):
+    # Divide [start, end) en tramos alineados a los agregados, del más grueso al
+    # más fino: [(tabla, inicio, fin)], con tabla None para los bordes sin agregar
+    if start_ms >= end_ms:
+        return []
+    if not levels:
+        return [(None, start_ms, end_ms)]
+    (name, size), finer = levels[0], levels[1:]
+    first = -(-start_ms // size) * size
+    last = end_ms - end_ms % size
+    if first >= last:
+        return split_range(start_ms, end_ms, finer)
+    return split_range(start_ms, first, finer) + [(name, first, last)] + split_range(last, end_ms, finer)
+
+
+# Clase para manejar la base de datos
+class DataBase:
+    def __init__(self, db_file, wal=True, synchronous=DB_SYNCHRONOUS):
+        self.conn = sqlite3.connect(db_file)
+        if wal:
+            # En modo WAL la interfaz puede leer mientras el hilo escritor inserta
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        if synchronous:
+            self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self.create_table()
+
+    def create_table(self):
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA table_info(SensorData)")
+        columnas = {fila[1]: fila[2].upper() for fila in cursor.fetchall()}
+        # Bases de datos antiguas no tienen la columna device_id
+        if columnas and 'device_id' not in columnas:
+            cursor.execute("ALTER TABLE SensorData ADD COLUMN device_id TEXT")
+        if columnas and 'window_ms' not in columnas:
+            cursor.execute("ALTER TABLE SensorData ADD COLUMN window_ms INTEGER")
+        if columnas and 'samples' not in columnas:
+            cursor.execute("ALTER TABLE SensorData ADD COLUMN samples INTEGER")
+        # ...y guardan la fecha como texto
+        if columnas.get('timestamp') == 'TEXT':
+            self.migrate_timestamps()
+        cursor.execute(SENSOR_TABLE.format(name="SensorData"))
+        # Consultas por rango de tiempo, de todos los dispositivos o de uno
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sensordata_timestamp ON SensorData (timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sensordata_device_timestamp "
+                       "ON SensorData (device_id, timestamp)")
+        cursor.execute(ALERT_TABLE)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON Alerts (timestamp)")
+        cursor.execute(SPOOL_TABLE)
+        # Agregados por minuto, hora y día; si no existían se calculan desde SensorData
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tablas = {fila[0] for fila in cursor.fetchall()}
+        for name, _ in ROLLUPS:
+            cursor.execute(ROLLUP_TABLE.format(name=name))
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{name.lower()}_bucket ON {name} (bucket)")
+        self.conn.commit()
+        if any(name not in tablas for name, _ in ROLLUPS):
+            self.rebuild_rollups()
+
+    def migrate_timestamps(self):
+        # Reconstruye la tabla con timestamps enteros. El texto está en hora local:
+        # el modificador 'utc' de strftime lo convierte a UTC igual que time.mktime
+        log.info("Migrando la base de datos a timestamps enteros...")
+        t0 = time.perf_counter()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DROP TABLE IF EXISTS SensorData_new")
+            self.conn.execute(SENSOR_TABLE.format(name="SensorData_new"))
+            self.conn.execute(f'''
+                INSERT INTO SensorData_new (id, {SENSOR_COLUMNS})
+                SELECT id, CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000, temperature, humidity,
+                       temp_avg, temp_max, temp_min, hum_avg, hum_max, hum_min, mode, device_id
+                FROM SensorData
+            ''')
+            self.conn.execute("DROP TABLE SensorData")
+            self.conn.execute("ALTER TABLE SensorData_new RENAME TO SensorData")
+        filas = self.conn.execute("SELECT COUNT(*) FROM SensorData").fetchone()[0]
+        log.info("Migración completa: %d filas en %.1f s", filas, time.perf_counter() - t0)
+
+    def rebuild_rollups(self):
+        # Recalcula los agregados: el de minutos desde las lecturas y cada uno de
+        # los siguientes desde el anterior
+        filas = self.conn.execute("SELECT COUNT(*) FROM SensorData").fetchone()[0]
+        if filas:
+            log.info("Calculando agregados por minuto, hora y día de %d filas...", filas)
+        t0 = time.perf_counter()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            source = f"{RAW_AS_ROLLUP} WHERE {RECEIVED_ONLY}"
+            for name, size in reversed(ROLLUPS):
+                self.conn.execute(f"DELETE FROM {name}")
+                self.conn.execute(f'''
+                    INSERT INTO {name} ({ROLLUP_COLUMNS})
+                    SELECT device_id, mode, bucket - bucket % {size} AS rollup_bucket, {ROLLUP_AGGREGATES}
+                    FROM ({source})
+                    GROUP BY device_id, mode, rollup_bucket
+                ''')
+                source = f"SELECT {ROLLUP_COLUMNS} FROM {name}"
+        if filas:
+            log.info("Agregados listos en %.1f s", time.perf_counter() - t0)
+
+    def insert_data(self, timestamp, temperature, humidity, temp_avg=None, temp_max=None, temp_min=None,
+                    hum_avg=None, hum_max=None, hum_min=None, mode=1, device_id=None):
+        self.insert_rows([(timestamp, temperature, humidity, temp_avg, temp_max, temp_min, hum_avg, hum_max,
+                           hum_min, mode, device_id)])
+
+    def insert_rows(self, rows):
+        # Tuplas de lectura (timestamp en segundos o en el texto de las bases de
+        # datos antiguas) -> lotes para insert_many
+        rows = [(protocolo.to_epoch_ms(row[0]) / 1000.0,) + tuple(row[1:]) for row in rows]
+        self.insert_many(ReadingBatch.from_rows(rows))
+
+    def insert_many(self, batches, alerts=(), checkpoint=None):
+        # Inserta lotes de lecturas (ReadingBatch de la cola) en una sola transacción
+        # y los suma a los agregados: los grupos de minuto se calculan por columnas
+        # y se juntan en horas y días. Los NaN se guardan como NULL. Las lecturas
+        # calculadas en el servidor (window_ms) no van a los agregados: resumen
+        # lecturas que ya están. Las alertas (diccionarios de AlertEngine) y el
+        # checkpoint de la bitácora, (segmento, offset), van en la misma transacción
+        rows = []
+        received = []
+        for batch in batches:
+            columns = [((batch.data["timestamp"] + 500000) // 1000000).tolist()]
+            columns.extend(batch.values(name).tolist() for name in VALUE_FIELDS)
+            columns.append(batch.data["mode"].tolist())
+            columns.append(itertools.repeat(batch.device_id, len(batch)))
+            windows = batch.data["window_ms"]
+            if windows.any():
+                columns.append([window or None for window in windows.tolist()])
+            else:
+                columns.append(itertools.repeat(None, len(batch)))
+                received.append(batch)
+            samples = batch.data["samples"]
+            if samples.any():
+                columns.append([n or None for n in samples.tolist()])
+            else:
+                columns.append(itertools.repeat(None, len(batch)))
+            rows.extend(zip(*columns))
+        with self.conn:
+            self.conn.executemany(f'''
+                INSERT INTO SensorData ({SENSOR_COLUMNS}, window_ms, samples)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            groups = None
+            for name, size in reversed(ROLLUPS):
+                groups = rollup_batches(received, size) if groups is None else merge_rollups(groups.items(), size)
+                self.conn.executemany(ROLLUP_UPSERT.format(name=name, columns=ROLLUP_COLUMNS),
+                                      [key + tuple(g) for key, g in groups.items()])
+            if alerts:
+                self.conn.executemany(ALERT_INSERT, [(round(alert["timestamp"] * 1000),) +
+                                                     tuple(alert[name] for name in alertas.ALERT_FIELDS[1:])
+                                                     for alert in alerts])
+            if checkpoint is not None:
+                self.conn.execute("INSERT OR REPLACE INTO SpoolCheckpoint (id, segment, offset) VALUES (1, ?, ?)",
+                                  checkpoint)
+
+    def fetch_spool_checkpoint(self):
+        # (segmento, offset) de la bitácora hasta donde ya está guardado, o None
+        row = self.conn.execute("SELECT segment, offset FROM SpoolCheckpoint WHERE id = 1").fetchone()
+        return tuple(row) if row else None
+
+    def _filter(self, device_id=None, mode=None, start=None, end=None, column="timestamp", conditions=()):
+        # Cláusula WHERE y parámetros; start y end en segundos desde 1970
+        conditions = list(conditions)
+        params = []
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        if mode is not None:
+            conditions.append("mode = ?")
+            params.append(mode)
+        if start is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(protocolo.to_epoch_ms(start))
+        if end is not None:
+            conditions.append(f"{column} < ?")
+            params.append(protocolo.to_epoch_ms(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def fetch_last_data(self, limit=20, device_id=None, before=None):
+        # Últimas lecturas, opcionalmente de un dispositivo y anteriores a "before"
+        where, params = self._filter(device_id, end=before, conditions=(RECEIVED_ONLY,))
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT {SELECT_COLUMNS} FROM SensorData
+            {where}
+            ORDER BY id DESC LIMIT ?
+        ''', (*params, limit))
+        return cursor.fetchall()[::-1]  # Revertir para orden cronologico
+
+    def fetch_range(self, start, end=None, device_id=None, mode=None, limit=-1):
+        # Todas las lecturas entre start y end (segundos), en orden cronológico
+        where, params = self._filter(device_id, mode, start, end, conditions=(RECEIVED_ONLY,))
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT {SELECT_COLUMNS} FROM SensorData
+            {where}
+            ORDER BY timestamp LIMIT ?
+        ''', (*params, limit))
+        return cursor.fetchall()
+
+    def fetch_windows(self, start, end=None, device_id=None, windows=None):
+        # Lecturas de modo 2 calculadas en el servidor entre start y end: {ventana
+        # en segundos: filas}, de todas las ventanas guardadas o de las indicadas
+        if windows is None:
+            condition = "window_ms IS NOT NULL"
+        else:
+            condition = f"window_ms IN ({', '.join(str(int(round(w * 1000))) for w in windows)})"
+        where, params = self._filter(device_id, start=start, end=end, conditions=(condition,))
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT window_ms, {SELECT_COLUMNS} FROM SensorData
+            {where}
+            ORDER BY window_ms, timestamp
+        ''', params)
+        result = {int(round(w * 1000)) / 1000: [] for w in windows} if windows is not None else {}
+        for window_ms, *row in cursor:
+            result.setdefault(window_ms / 1000, []).append(tuple(row))
+        return result
+
+    def fetch_alerts(self, start, end=None, device_id=None):
+        # Cambios de estado de las alertas entre start y end, como diccionarios
+        where, params = self._filter(device_id, start=start, end=end)
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {ALERT_COLUMNS} FROM Alerts {where} ORDER BY timestamp, id", params)
+        alerts = []
+        for row in cursor:
+            alert = dict(zip(alertas.ALERT_FIELDS, row))
+            alert["timestamp"] /= 1000.0
+            alert["active"] = bool(alert["active"])
+            alerts.append(alert)
+        return alerts
+
+    def choose_rollup(self, resolution):
+        # El agregado más grueso cuyos tramos no superan "resolution" segundos;
+        # (None, 1) si hace falta leer las lecturas
+        for name, size in ROLLUPS:
+            if size <= resolution * 1000:
+                return name, size
+        return None, 1
+
+    def _rollup_source(self, name, device_id=None, mode=None, start=None, end=None):
+        # Subconsulta con las columnas de ROLLUP_COLUMNS, desde un agregado o desde SensorData
+        if name is None:
+            where, params = self._filter(device_id, mode, start, end, conditions=(RECEIVED_ONLY,))
+            return f"{RAW_AS_ROLLUP} {where}", params
+        where, params = self._filter(device_id, mode, start, end, column="bucket")
+        return f"SELECT {ROLLUP_COLUMNS} FROM {name} {where}", params
+
+    def fetch_aggregates(self, start, end=None, device_id=None, mode=None, resolution=60):
+        # Lecturas resumidas en tramos de "resolution" segundos (alineados a múltiplos
+        # de resolution desde 1970): filas (inicio del tramo, primera, última,
+        # cantidad, temp promedio, mín, máx, hum promedio, mín, máx), tiempos en
+        # segundos. Se lee el agregado más grueso que alcance la resolución pedida;
+        # por debajo de un minuto se agrupan las lecturas. Desde un agregado no se
+        # conocen los tiempos de las lecturas: primera y última son el inicio del
+        # primer tramo del agregado y el final (1 ms antes del siguiente) del último
+        end = time.time() if end is None else end
+        name, size = self.choose_rollup(resolution)
+        # El tramo del agregado que contiene a start empieza antes de start
+        source, params = self._rollup_source(name, device_id, mode, start - (size - 1) / 1000, end)
+        resolution_ms = max(int(resolution * 1000), 1)
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT (bucket - bucket % ?) / 1000.0 AS b, MIN(bucket) / 1000.0, (MAX(bucket) + ? - 1) / 1000.0,
+                   SUM(count), SUM(temp_sum) / SUM(count), MIN(temp_min), MAX(temp_max),
+                   SUM(hum_sum) / SUM(count), MIN(hum_min), MAX(hum_max)
+            FROM ({source})
+            GROUP BY b ORDER BY b
+        ''', (resolution_ms, size, *params))
+        return cursor.fetchall()
+
+    def fetch_stats(self, start, end=None, device_id=None, mode=None):
+        # Cantidad, promedio, mínimo y máximo exactos entre start y end. Los días,
+        # horas y minutos completos salen de los agregados y solo los bordes de
+        # las lecturas, así el costo casi no depende del largo del rango.
+        # Las lecturas anteriores a la más vieja de SensorData ya se borraron
+        # (archivo.py --prune): esos bordes salen del agregado por minuto, que
+        # se conserva, y los minutos se cuentan enteros aunque el rango empiece
+        # o termine a mitad de uno
+        end = time.time() if end is None else end
+        totals = [0, None, None, None, None, None, None]
+        cursor = self.conn.cursor()
+        oldest = cursor.execute("SELECT MIN(timestamp) FROM SensorData").fetchone()[0]
+        for name, first, last in split_range(protocolo.to_epoch_ms(start), protocolo.to_epoch_ms(end)):
+            if name is None and (oldest is None or first < oldest):
+                name, size = ROLLUPS[-1]
+                first, last = first - first % size, -(-last // size) * size
+            source, params = self._rollup_source(name, device_id, mode, first / 1000, last / 1000)
+            cursor.execute(f"SELECT {ROLLUP_AGGREGATES} FROM ({source})", params)
+            row = cursor.fetchone()
+            if row[0]:
+                merge_group(totals, row)
+        count = totals[0]
+        return {
+            "count": count,
+            "temp_avg": totals[1] / count if count and totals[1] is not None else None,
+            "temp_min": totals[2],
+            "temp_max": totals[3],
+            "hum_avg": totals[4] / count if count and totals[4] is not None else None,
+            "hum_min": totals[5],
+            "hum_max": totals[6],
+        }
+
+    def fetch_downsampled(self, start, end=None, device_id=None, mode=None, points=PLOT_POINTS):
+        # Serie (timestamps, temperaturas, humedades) de a lo sumo ~points puntos
+        # para graficar un rango largo: el rango se divide en points/2 tramos y de
+        # cada uno se grafican el mínimo y el máximo, así los picos se conservan.
+        # Con tramos de un minuto o más los datos salen de los agregados
+        end = time.time() if end is None else end
+        resolution = max((end - start) / max(points // 2, 1), 0.001)
+        rows = np.array(self.fetch_aggregates(start, end, device_id, mode, resolution), dtype=float)
+        rows = rows.reshape(-1, 10)
+        # El mínimo en la primera lectura del tramo y el máximo en la última
+        # (dentro de un tramo la diferencia no se ve). Tramos de una sola lectura
+        # van una vez; los que salen de un agregado siempre tienen primera < última
+        keep = np.ones((len(rows), 2), dtype=bool)
+        keep[:, 1] = rows[:, 2] != rows[:, 1]
+        keep = keep.ravel()
+        timestamps = rows[:, 1:3].ravel()[keep]
+        temperatures = rows[:, 5:7].ravel()[keep]
+        humidities = rows[:, 8:10].ravel()[keep]
+        return timestamps, temperatures, humidities
+
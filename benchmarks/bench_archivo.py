@@ -0,0 +1,105 @@
+# Lectura de un rango largo: tuplas desde SQLite vs archivo Parquet
+#
+# Uso: python benchmarks/bench_archivo.py --filas 2000000 --dias 60
+#
+# Se genera una base de datos con --filas lecturas de 10 dispositivos repartidas
+# en --dias días y se mide, cada caso en un proceso nuevo, el tiempo y la
+# memoria extra (pico de VmHWM menos la RSS antes de empezar):
+#   - fetch_range de todo el rango (lista de tuplas, como se leía hasta ahora)
+#   - Archiver.archive de todo (por tramos, memoria constante)
+#   - read_table completo, con dos columnas, y una semana de un dispositivo
+#   - scan() recorriendo el archivo completo por RecordBatch (dos columnas)
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import archivo
+from basedatos import DataBase
+
+DISPOSITIVOS = 10
+
+
+def memoria_kb():
+    valores = {}
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith(("VmRSS:", "VmHWM:")):
+                nombre, valor = linea.split()[:2]
+                valores[nombre[:-1]] = int(valor)
+    return valores["VmRSS"], valores["VmHWM"]
+
+
+def generar(db_file, filas, dias):
+    db = DataBase(db_file)
+    fin = time.time() - 86400
+    inicio = fin - dias * 86400
+    paso = (fin - inicio) / filas
+    lote = 100000
+    for i in range(0, filas, lote):
+        db.insert_rows([(inicio + j * paso, 20.0 + j % 50 / 10, 50.0 + j % 30 / 10, None, None, None, None, None,
+                         None, 1, f"esp32-{j % DISPOSITIVOS}") for j in range(i, min(i + lote, filas))])
+    db.conn.close()
+    return inicio, fin
+
+
+def caso(nombre, db_file, directorio, inicio, fin, resultado):
+    rss_antes, _ = memoria_kb()
+    t0 = time.perf_counter()
+    if nombre == "fetch_range (tuplas)":
+        filas = len(DataBase(db_file).fetch_range(inicio, fin))
+    elif nombre == "archive":
+        filas, _ = archivo.Archiver(db_file, directorio).archive()
+    elif nombre == "read_table todo":
+        filas = archivo.read_table(directorio, inicio, fin).num_rows
+    elif nombre == "read_table 2 columnas":
+        filas = archivo.read_table(directorio, inicio, fin, columns=["timestamp", "temperature"]).num_rows
+    elif nombre == "read_table 1 semana, 1 disp.":
+        filas = archivo.read_table(directorio, fin - 7 * 86400, fin, device_id="esp32-3").num_rows
+    else:
+        filas = 0
+        for batch in archivo.scan(directorio, inicio, fin, columns=["timestamp", "temperature"]):
+            filas += batch.num_rows
+    total = time.perf_counter() - t0
+    _, pico = memoria_kb()
+    resultado.put((filas, total, pico - rss_antes))
+
+
+def medir(nombre, *args):
+    # Proceso nuevo por caso para que el pico de memoria sea solo el del caso
+    contexto = multiprocessing.get_context("spawn")
+    resultado = contexto.Queue()
+    proceso = contexto.Process(target=caso, args=(nombre,) + args + (resultado,))
+    proceso.start()
+    valores = resultado.get()
+    proceso.join()
+    return valores
+
+
+def tamano_mb(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1e6
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files) / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del archivo Parquet")
+    parser.add_argument("--filas", type=int, default=2000000)
+    parser.add_argument("--dias", type=int, default=60)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "archivo.db")
+        directorio = os.path.join(tmp, "parquet")
+        inicio, fin = generar(db_file, args.filas, args.dias)
+        print(f"{args.filas} lecturas en {args.dias} días; SQLite {tamano_mb(db_file):.0f} MB")
+        print(f"{'caso':>30} {'filas':>9} {'s':>7} {'memoria MB':>11}")
+        for nombre in ("fetch_range (tuplas)", "archive", "read_table todo", "read_table 2 columnas",
+                       "read_table 1 semana, 1 disp.", "scan 2 columnas"):
+            filas, total, memoria = medir(nombre, db_file, directorio, inicio, fin)
+            print(f"{nombre:>30} {filas:>9} {total:>7.2f} {memoria / 1024:>11.1f}")
+        print(f"Parquet {tamano_mb(directorio):.0f} MB")
@@ -0,0 +1,79 @@
+# Arranque en frío y memoria: daemon sin interfaz vs daemon con interfaz (--gui)
+#
+# Uso: python benchmarks/bench_arranque.py --repeticiones 5
+#
+# Se lanza monitorpi.py como proceso aparte con una base de datos temporal y se
+# mide el tiempo hasta que termina de arrancar ("Monitor en ejecución" sin
+# interfaz, "Interfaz lista" con --gui), y la memoria residente (VmRSS) y su
+# pico (VmHWM) un segundo después. La interfaz usa la plataforma "offscreen" de
+# Qt para no depender de una pantalla; con --gui el proceso es equivalente al
+# monitorpi.py original, que siempre abría la ventana.
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PUERTO = 18901
+PUERTO_CONTROL = 18902
+
+
+def memoria_kb(pid):
+    valores = {}
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            if linea.startswith(("VmRSS:", "VmHWM:")):
+                nombre, valor = linea.split()[:2]
+                valores[nombre[:-1]] = int(valor)
+    return valores["VmRSS"], valores["VmHWM"]
+
+
+def esperar_mensaje(proceso, mensajes):
+    for linea in proceso.stdout:
+        if linea.startswith(mensajes):
+            return
+    raise RuntimeError(f"monitorpi.py terminó con código {proceso.wait()} sin terminar de arrancar")
+
+
+def arrancar(extra, db_file):
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", PYTHONUNBUFFERED="1")
+    comando = [sys.executable, os.path.join(RAIZ, "monitorpi.py"), "--db", db_file,
+               "--port", str(PUERTO), "--control-port", str(PUERTO_CONTROL)] + extra
+    t0 = time.perf_counter()
+    proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, text=True)
+    try:
+        esperar_mensaje(proceso, ("Monitor en ejecución", "Interfaz lista"))
+        listo = time.perf_counter() - t0
+        time.sleep(1.0)
+        rss, pico = memoria_kb(proceso.pid)
+    finally:
+        proceso.send_signal(signal.SIGINT)
+        try:
+            proceso.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+            proceso.wait()
+    return listo, rss, pico
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de arranque y memoria del daemon")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    db_file = os.path.join(directorio, "arranque.db")
+    # Primera ejecución fuera de la medición: crea la base de datos y calienta la caché de disco
+    arrancar([], db_file)
+
+    print(f"{'modo':>12} {'arranque ms':>12} {'RSS MB':>8} {'pico MB':>8}")
+    for nombre, extra in (("sin interfaz", []), ("--gui", ["--gui"])):
+        medidas = [arrancar(extra, db_file) for _ in range(args.repeticiones)]
+        listo = statistics.median(m[0] for m in medidas)
+        rss = statistics.median(m[1] for m in medidas)
+        pico = statistics.median(m[2] for m in medidas)
+        print(f"{nombre:>12} {listo * 1000:>12.0f} {rss / 1024:>8.1f} {pico / 1024:>8.1f}")
@@ -0,0 +1,98 @@
+# Microbenchmark del codec: protocolo de texto vs protocolo binario
+#
+# Uso: python benchmarks/bench_codec.py --muestras 200000 --lote 10
+#
+# Mide bytes por muestra (contando 40 bytes de cabeceras TCP/IP por cada send,
+# el texto envía una línea por send y el binario una trama de "lote" muestras)
+# y el costo de CPU de decodificar en el servidor.
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import protocolo
+
+TCP_IP_OVERHEAD = 40
+
+
+def muestras(n):
+    return [(20 + i % 700 / 100, 50 + i % 300 / 100) for i in range(n)]
+
+
+def codificar_texto(samples):
+    return [f"DATA {t:.2f} {h:.2f}\n".encode() for t, h in samples]
+
+
+def codificar_binario(samples, lote):
+    frames = []
+    for start in range(0, len(samples), lote):
+        records = [(start + i, 100 * i, round(t * 100), round(h * 100))
+                   for i, (t, h) in enumerate(samples[start:start + lote])]
+        frames.append(protocolo.encode_frame(protocolo.KIND_DATA, records))
+    return frames
+
+
+def framear(packets, chunk_size=64 * 1024):
+    # Entrega el flujo al framer en trozos, como llegaría por el socket
+    data = b"".join(packets)
+    framer = protocolo.LineFramer()
+    lines = []
+    frames = []
+    for start in range(0, len(data), chunk_size):
+        framer.feed(data[start:start + chunk_size])
+        new_lines, new_frames = framer.messages()
+        lines.extend(new_lines)
+        frames.extend(new_frames)
+    return lines, frames
+
+
+def decodificar_texto(packets):
+    lines, _ = framear(packets)
+    readings, _ = protocolo.parse_lines(lines, time.time_ns())
+    return len(readings)
+
+
+def decodificar_binario(packets):
+    _, frames = framear(packets)
+    return len(protocolo.BinaryDecoder().decode(frames, time.time_ns()))
+
+
+def decodificar_numpy(packets):
+    # Solo frombuffer y los valores, sin armar el ReadingBatch: el mínimo posible
+    import numpy as np
+    dtype = np.dtype([("seq", "<u4"), ("ms", "<u4"), ("temp", "<i2"), ("hum", "<u2")])
+    _, frames = framear(packets)
+    records = np.frombuffer(b"".join(payload for _, _, payload in frames), dtype=dtype)
+    temps = records["temp"] / 100.0
+    hums = records["hum"] / 100.0
+    return len(temps) + 0 * len(hums)
+
+
+def medir(nombre, decode, packets, n):
+    t0 = time.perf_counter()
+    decoded = decode(packets)
+    elapsed = time.perf_counter() - t0
+    assert decoded == n, (nombre, decoded, n)
+    payload = sum(map(len, packets))
+    wire = payload + TCP_IP_OVERHEAD * len(packets)
+    print(f"{nombre:>16} {payload / n:>10.1f} {wire / n:>10.1f} {elapsed * 1e9 / n:>10.0f} {n / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark del protocolo texto vs binario")
+    parser.add_argument("--muestras", type=int, default=200000)
+    parser.add_argument("--lote", type=int, default=10, help="muestras por trama binaria (100 ms -> 10)")
+    args = parser.parse_args()
+
+    samples = muestras(args.muestras)
+    texto = codificar_texto(samples)
+    binario = codificar_binario(samples, args.lote)
+    print(f"{'codec':>16} {'B/muestra':>10} {'B en red':>10} {'ns/muestra':>10} {'muestras/s':>12}")
+    medir("texto", decodificar_texto, texto, args.muestras)
+    medir("binario", decodificar_binario, binario, args.muestras)
+    try:
+        medir("solo frombuffer", decodificar_numpy, binario, args.muestras)
+    except ImportError:
+        print("numpy no está instalado, se omite la decodificación con frombuffer")
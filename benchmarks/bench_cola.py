@@ -0,0 +1,107 @@
+# Ráfaga de muchas placas contra un escritor más lento: queue.Queue sin límite
+# vs IngestQueue con cada política
+#
+# Uso: python benchmarks/bench_cola.py --placas 200 --lecturas 2000 --escritor 50000
+#
+# Cada placa es un hilo que decodifica y encola tramas de 50 lecturas tan rápido
+# como puede (put, como el servidor). El consumidor imita a DataBaseWriter:
+# saca lotes de 500 y tarda lo que tardaría SQLite a --escritor filas/s. La
+# memoria es el pico de tracemalloc (lotes de lectura retenidos en la cola), en
+# una segunda pasada porque tracemalloc hace mucho más lento al código que crea
+# objetos.
+# "bloqueo s" suma el tiempo que esperaron todas las placas con la cola llena.
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+import cola
+from lecturas import NS, ReadingBatch, count
+
+TRAMA = 50
+LOTE = 500
+
+
+# Consumidor de la cola sin límite, como el escritor antes de IngestQueue
+class ColaSinLimite(queue.Queue):
+    def get_batch(self, max_items, timeout=None):
+        try:
+            batch = [self.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        try:
+            while count(batch) < max_items:
+                batch.append(self.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def stats(self):
+        return {"dropped": 0, "coalesced": 0, "blocked_s": 0.0, "latency_avg_ms": None}
+
+
+def placa(data_queue, device_id, lecturas, t0):
+    for i in range(0, lecturas, TRAMA):
+        j = np.arange(i, i + TRAMA)
+        frame = ReadingBatch.raw(t0 + j * (NS // 100), 22.0 + j % 7 / 10, 55.0, device_id)
+        data_queue.put(frame)
+
+
+def medir(data_queue, placas, lecturas, filas_por_s, memoria=False):
+    if memoria:
+        tracemalloc.start()
+    t0 = time.time_ns()
+    producers = [threading.Thread(target=placa, args=(data_queue, f"esp32-{d}", lecturas, t0))
+                 for d in range(placas)]
+    start = time.perf_counter()
+    for producer in producers:
+        producer.start()
+    escritas = 0
+    filas = 0
+    while True:
+        batch = data_queue.get_batch(LOTE, 0.05)
+        if batch:
+            n = count(batch)
+            escritas += n
+            filas += sum(int((b.data["mode"] == 1).sum()) for b in batch)
+            time.sleep(n / filas_por_s)
+        elif not any(producer.is_alive() for producer in producers):
+            break
+    total = time.perf_counter() - start
+    peak = None
+    if memoria:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return total, peak, escritas, filas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la cola de ingesta")
+    parser.add_argument("--placas", type=int, default=200)
+    parser.add_argument("--lecturas", type=int, default=2000, help="lecturas por placa")
+    parser.add_argument("--escritor", type=int, default=50000, help="filas/s que escribe el consumidor")
+    parser.add_argument("--capacidad", type=int, default=20000)
+    args = parser.parse_args()
+
+    total_lecturas = args.placas * args.lecturas
+    print(f"{total_lecturas} lecturas de {args.placas} placas, escritor a {args.escritor} filas/s, "
+          f"capacidad {args.capacidad}")
+    print(f"{'cola':>12} {'s':>6} {'pico MB':>8} {'escritas':>9} {'en bruto':>9} {'descartes':>10} "
+          f"{'resumidas':>10} {'bloqueo s':>10} {'latencia ms':>12}")
+    colas = [("sin límite", lambda: ColaSinLimite())]
+    colas += [(policy, lambda policy=policy: cola.IngestQueue(args.capacidad, policy)) for policy in cola.POLICIES]
+    for nombre, crear in colas:
+        data_queue = crear()
+        total, _, escritas, filas = medir(data_queue, args.placas, args.lecturas, args.escritor)
+        stats = data_queue.stats()
+        _, peak, _, _ = medir(crear(), args.placas, args.lecturas, args.escritor, memoria=True)
+        latencia = "-" if stats["latency_avg_ms"] is None else f"{stats['latency_avg_ms']:.1f}"
+        print(f"{nombre:>12} {total:>6.2f} {peak / 1e6:>8.1f} {escritas:>9} {filas:>9} "
+              f"{stats['dropped']:>10} {stats['coalesced']:>10} {stats['blocked_s']:>10.2f} {latencia:>12}")
@@ -0,0 +1,105 @@
+# Reconfiguración de la flota: comandos con confirmación a cientos de placas
+#
+# Uso: python benchmarks/bench_comandos.py --placas 500 --repeticiones 10
+#      python benchmarks/bench_comandos.py --placas 500 --sordas 5
+#      python benchmarks/bench_comandos.py --placas 100 -- --threaded
+#
+# Se lanzan monitorpi.py y simulador_esp32.py como en bench_flota.py y, con
+# las placas conectadas e inactivas, se mide por el canal de control cuánto
+# tarda cada comando hasta que todas las placas lo confirmaron (SENDWAIT):
+#   - difusión: "SENDWAIT * SET_FREQ ..." a toda la flota de una vez
+#   - grupo: SENDWAIT a la mitad de las placas, separadas por comas
+#   - en serie: un SENDWAIT por placa esperando cada confirmación, como
+#     enviar y esperar placa por placa (solo --serie placas, es lento)
+# Con --sordas algunas placas no responden: la difusión termina cuando se
+# agotan sus reintentos (timeout) y los grupos sin ellas no se ven afectados.
+# Todos los argumentos después de "--" se pasan tal cual a monitorpi.py.
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_flota import SIMULADOR, CanalControl, arrancar_daemon, esperar_placas, percentil, terminar
+
+
+def comando(control, linea):
+    t0 = time.perf_counter()
+    respuesta = control.comando(linea)
+    total = time.perf_counter() - t0
+    if not respuesta.startswith("RESULT "):
+        raise RuntimeError(f"{linea}: {respuesta}")
+    return total, json.loads(respuesta[7:])
+
+
+def resumen(nombre, tiempos, resultados):
+    tiempos = sorted(tiempos)
+    conteo = collections.Counter()
+    for r in resultados:
+        conteo.update(r["results"].values())
+    print(f"{nombre:>22} {percentil(tiempos, 0.5) * 1000:>9.1f} {tiempos[-1] * 1000:>9.1f}  "
+          + ", ".join(f"{clave} {valor}" for clave, valor in sorted(conteo.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de comandos a la flota")
+    parser.add_argument("--placas", type=int, default=500)
+    parser.add_argument("--sordas", type=int, default=0, help="placas que no responden a los comandos")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--serie", type=int, default=50, help="placas del caso en serie")
+    argv = sys.argv[1:]
+    extra = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix="bench_comandos_")
+    daemon, ports, _ = arrancar_daemon(directorio, extra)
+    simulador = subprocess.Popen([sys.executable, SIMULADOR, "--port", str(ports["port"]), "--placas",
+                                  str(args.placas), "--sordas", str(args.sordas), "--json"],
+                                 stdout=subprocess.PIPE, text=True)
+    control = None
+    try:
+        control = CanalControl(ports["control"])
+        control.sock.settimeout(120)
+        esperar_placas(control, args.placas, 60)
+        placas = sorted(control.comando("DEVICES").split()[1:])
+        print(f"{len(placas)} placas conectadas, {args.sordas} sordas")
+        print(f"{'caso':>22} {'p50 ms':>9} {'max ms':>9}  resultados")
+
+        tiempos, resultados = [], []
+        for i in range(args.repeticiones):
+            total, resultado = comando(control, f"SENDWAIT * SET_FREQ {1000 + i}")
+            tiempos.append(total)
+            resultados.append(resultado)
+        resumen("difusión", tiempos, resultados)
+
+        mitad = ",".join(placas[args.sordas:args.sordas + len(placas) // 2])
+        tiempos, resultados = [], []
+        for i in range(args.repeticiones):
+            total, resultado = comando(control, f"SENDWAIT {mitad} SET_WINDOW {5000 + i}")
+            tiempos.append(total)
+            resultados.append(resultado)
+        resumen("grupo (mitad)", tiempos, resultados)
+
+        t0 = time.perf_counter()
+        tiempos, resultados = [], []
+        for placa in placas[args.sordas:args.sordas + args.serie]:
+            total, resultado = comando(control, f"SENDWAIT {placa} MODE1")
+            tiempos.append(total)
+            resultados.append(resultado)
+        serie = time.perf_counter() - t0
+        resumen("en serie (1 placa)", tiempos, resultados)
+        print(f"en serie: {serie * 1000:.1f} ms para {len(tiempos)} placas, "
+              f"{serie / max(len(tiempos), 1) * len(placas) * 1000:.0f} ms estimados para toda la flota")
+    finally:
+        if control:
+            control.close()
+        terminar(simulador)
+        terminar(daemon)
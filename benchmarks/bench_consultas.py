@@ -0,0 +1,151 @@
+# Consultas por rango de tiempo sobre una base de datos grande: tabla original
+# (timestamp en texto, sin índices) vs timestamps enteros con índices, reducción
+# a pocos puntos y agregados por minuto/hora/día
+#
+# Uso: python benchmarks/bench_consultas.py --filas 3000000
+#
+# Se genera una base con el formato original (3 dispositivos, una lectura por
+# segundo cada uno, una de cada 10 en modo 2), se mide la migración que hace
+# DataBase al abrirla y luego las consultas "últimas N horas del dispositivo X".
+# La ruta original no tenía consultas por rango: lo mejor posible era filtrar
+# por texto, leer todas las filas y reducirlas en NumPy para graficar. Las
+# estadísticas del rango (cantidad, promedio, extremos) se comparan calculadas
+# sobre las lecturas y con fetch_stats.
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import graficos
+import protocolo
+from basedatos import DataBase, PLOT_POINTS
+
+DISPOSITIVOS = ("sim-0", "sim-1", "sim-2")
+
+
+def crear_base_original(db_file, filas, fin):
+    # Esquema de create_table antes de la migración
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+        CREATE TABLE SensorData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            temperature REAL,
+            humidity REAL,
+            temp_avg REAL,
+            temp_max REAL,
+            temp_min REAL,
+            hum_avg REAL,
+            hum_max REAL,
+            hum_min REAL,
+            mode INTEGER NOT NULL,
+            device_id TEXT
+        )
+    ''')
+    inicio = fin - filas // len(DISPOSITIVOS)
+
+    def generar():
+        texto = None
+        segundo = None
+        for i in range(filas):
+            epoch = inicio + i // len(DISPOSITIVOS)
+            if epoch != segundo:
+                segundo = epoch
+                texto = time.strftime(protocolo.TIMESTAMP_FORMAT, time.localtime(epoch))
+            temp = 22 + (i * 7919 % 500) / 100
+            hum = 55 + (i * 104729 % 700) / 100
+            if (i // len(DISPOSITIVOS)) % 10 == 0:
+                yield (texto, None, None, temp, temp + 1, temp - 1, hum, hum + 1, hum - 1, 2,
+                       DISPOSITIVOS[i % len(DISPOSITIVOS)])
+            else:
+                yield (texto, temp, hum, None, None, None, None, None, None, 1, DISPOSITIVOS[i % len(DISPOSITIVOS)])
+
+    with conn:
+        conn.executemany('''
+            INSERT INTO SensorData (timestamp, temperature, humidity, temp_avg, temp_max, temp_min,
+                                    hum_avg, hum_max, hum_min, mode, device_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', generar())
+    conn.close()
+
+
+def consulta_original(conn, desde, dispositivo, puntos):
+    # Filtro por texto sin índice, todas las filas a Python y reducción en NumPy
+    texto = time.strftime(protocolo.TIMESTAMP_FORMAT, time.localtime(desde))
+    rows = conn.execute('''
+        SELECT timestamp, temperature, humidity FROM SensorData
+        WHERE device_id = ? AND mode = 1 AND timestamp >= ?
+        ORDER BY id
+    ''', (dispositivo, texto)).fetchall()
+    epochs = np.array([protocolo.parse_timestamp(row[0]) for row in rows])
+    temps = np.array([row[1] for row in rows], dtype=float)
+    graficos.minmax_decimate(epochs, temps, puntos)
+    return len(rows)
+
+
+def stats_crudo(db, desde, dispositivo):
+    # Promedio y extremos del rango directamente desde SensorData
+    return db.conn.execute('''
+        SELECT COUNT(*), AVG(temperature), MIN(temperature), MAX(temperature) FROM SensorData
+        WHERE device_id = ? AND mode = 1 AND timestamp >= ?
+    ''', (dispositivo, int(desde * 1000))).fetchone()
+
+
+def medir(funcion, repeticiones=3):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - t0)
+    return min(tiempos), resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de consultas por rango en SQLite")
+    parser.add_argument("--filas", type=int, default=3000000)
+    parser.add_argument("--puntos", type=int, default=PLOT_POINTS)
+    parser.add_argument("--horas", type=float, nargs="+", default=[1, 24, 24 * 7])
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    original = os.path.join(directorio, "original.db")
+    migrada = os.path.join(directorio, "migrada.db")
+    try:
+        fin = int(time.time())
+        t0 = time.perf_counter()
+        crear_base_original(original, args.filas, fin)
+        print(f"Base original: {args.filas} filas, {os.path.getsize(original) / 1e6:.0f} MB "
+              f"(generada en {time.perf_counter() - t0:.1f} s)")
+
+        shutil.copy(original, migrada)
+        t0 = time.perf_counter()
+        db = DataBase(migrada)
+        print(f"Migración + índices + agregados: {time.perf_counter() - t0:.1f} s, "
+              f"{os.path.getsize(migrada) / 1e6:.0f} MB\n")
+
+        conn = sqlite3.connect(original)
+        print(f"{'horas':>7} {'filas':>9} {'original ms':>12} {'rango ms':>10} {'reducida ms':>12} {'puntos':>7} "
+              f"{'stats crudo ms':>15} {'stats ms':>9}")
+        for horas in args.horas:
+            desde = fin - horas * 3600
+            t_original, filas = medir(lambda: consulta_original(conn, desde, DISPOSITIVOS[1], args.puntos), 1)
+            t_rango, rows = medir(lambda: db.fetch_range(desde, device_id=DISPOSITIVOS[1], mode=1))
+            assert len(rows) == filas, (len(rows), filas)
+            t_reducida, serie = medir(lambda: db.fetch_downsampled(desde, device_id=DISPOSITIVOS[1], mode=1,
+                                                                    points=args.puntos))
+            t_crudo, crudo = medir(lambda: stats_crudo(db, desde, DISPOSITIVOS[1]))
+            t_stats, stats = medir(lambda: db.fetch_stats(desde, device_id=DISPOSITIVOS[1], mode=1))
+            assert stats["count"] == crudo[0] and abs(stats["temp_avg"] - crudo[1]) < 1e-6, (stats, crudo)
+            print(f"{horas:>7g} {filas:>9} {t_original * 1000:>12.1f} {t_rango * 1000:>10.1f} "
+                  f"{t_reducida * 1000:>12.1f} {len(serie[0]):>7} {t_crudo * 1000:>15.1f} {t_stats * 1000:>9.1f}")
+        conn.close()
+        db.conn.close()
+    finally:
+        shutil.rmtree(directorio)
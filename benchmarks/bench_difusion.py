@@ -0,0 +1,251 @@
+# Lecturas en vivo a muchos tableros: reparto de /stream a cientos de suscriptores
+#
+# Uso: python benchmarks/bench_difusion.py --placas 100 --suscriptores 200 --duracion 10
+#      python benchmarks/bench_difusion.py --suscriptores 500 --filtro todo --lentos 10
+#
+# Se lanzan monitorpi.py y simulador_esp32.py como en bench_flota.py. Con las
+# placas enviando se mide durante --duracion segundos sin suscriptores y después
+# con --suscriptores conexiones a /stream (mitad Server-Sent Events, mitad
+# WebSocket), todas en este proceso con asyncio:
+#
+#   - CPU del daemon (% de un núcleo) en cada fase: lo que cuesta el reparto
+#   - mensajes y MB por segundo entregados, en total y por suscriptor
+#   - latencia en vivo: desde el timestamp de la lectura más nueva de cada
+#     mensaje hasta que llega, en los primeros --medidos suscriptores (se lee
+#     solo ese timestamp, sin decodificar el JSON, para que los clientes
+#     gasten poco). Como referencia, la latencia de los lotes guardados que
+#     reparte el canal de control (SUBSCRIBE), lectura por lectura
+#   - suscriptores lentos (--lentos, no leen nada y tienen un buffer de
+#     recepción chico): cuánto tardan en ser desconectados (stream_evicted_total),
+#     sin que los demás dejen de recibir
+#
+# El daemon, el simulador y los clientes corren en la misma máquina: con pocos
+# núcleos las latencias incluyen la competencia por la CPU.
+#
+# Filtros (--filtro): "todo" sin filtro, "placa" una placa por suscriptor,
+# "stride" stride=10 y "mixto" rota entre los tres.
+# Todos los argumentos después de "--" se pasan tal cual a monitorpi.py.
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_flota import (SIMULADOR, CanalControl, Suscriptor, arrancar_daemon, cpu_rss, esperar_placas,
+                         leer_metricas, percentil, terminar, total)
+
+FILTROS = ("todo", "placa", "stride", "mixto")
+
+
+class Cliente(asyncio.Protocol):
+    def __init__(self, consulta, websocket, medido=False):
+        self.consulta = consulta
+        self.websocket = websocket
+        self.medido = medido
+        self.transport = None
+        self.buffer = b""
+        self.conectado = False
+        self.midiendo = False
+        self.mensajes = 0
+        self.bytes = 0
+        self.latencias = []
+        self.cerrado = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        cabeceras = "Accept: text/event-stream\r\n"
+        if self.websocket:
+            clave = base64.b64encode(os.urandom(16)).decode()
+            cabeceras = f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {clave}\r\n" \
+                        f"Sec-WebSocket-Version: 13\r\n"
+        transport.write(f"GET /stream?{self.consulta} HTTP/1.1\r\nHost: localhost\r\n{cabeceras}\r\n".encode())
+
+    def data_received(self, data):
+        if self.midiendo:
+            self.bytes += len(data)
+        self.buffer += data
+        if not self.conectado:
+            if b"\r\n\r\n" not in self.buffer:
+                return
+            respuesta, _, self.buffer = self.buffer.partition(b"\r\n\r\n")
+            if b" 200 " not in respuesta.split(b"\r\n")[0] and b" 101 " not in respuesta.split(b"\r\n")[0]:
+                raise RuntimeError(respuesta.decode(errors="replace"))
+            self.conectado = True
+        if self.websocket:
+            self.tramas()
+        else:
+            *mensajes, self.buffer = self.buffer.split(b"\n\n")
+            for mensaje in mensajes:
+                self.mensaje(mensaje[6:])
+
+    def tramas(self):
+        while len(self.buffer) >= 2:
+            n = self.buffer[1] & 0x7F
+            inicio = 2
+            if n == 126:
+                n = struct.unpack_from("!H", self.buffer, 2)[0] if len(self.buffer) >= 4 else None
+                inicio = 4
+            elif n == 127:
+                n = struct.unpack_from("!Q", self.buffer, 2)[0] if len(self.buffer) >= 10 else None
+                inicio = 10
+            if n is None or len(self.buffer) < inicio + n:
+                return
+            self.mensaje(self.buffer[inicio:inicio + n])
+            self.buffer = self.buffer[inicio + n:]
+
+    def mensaje(self, payload):
+        if not self.midiendo:
+            return
+        self.mensajes += 1
+        if self.medido:
+            # Timestamp de la última lectura: '...,[<timestamp>,...]]'
+            inicio = payload.rfind(b",[") + 2 if payload.count(b"[") > 2 else 2
+            self.latencias.append(time.time() - float(payload[inicio:payload.index(b",", inicio)]))
+
+    def connection_lost(self, exc):
+        self.cerrado = time.monotonic()
+
+
+async def vigilar_desconexiones(port, desde, tiempos):
+    # Momento de cada aumento de stream_evicted_total (los lentos no leen, así
+    # que no se enteran de que el daemon los desconectó)
+    loop = asyncio.get_running_loop()
+    anterior = (await loop.run_in_executor(None, leer_metricas, port)).get("stream_evicted_total", 0)
+    while True:
+        await asyncio.sleep(0.1)
+        actual = (await loop.run_in_executor(None, leer_metricas, port)).get("stream_evicted_total", 0)
+        tiempos.extend([time.monotonic() - desde] * int(actual - anterior))
+        anterior = actual
+
+
+async def conectar(loop, port, consulta, websocket, medido=False, lento=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if lento:
+        # Buffer de recepción chico: el daemon nota enseguida que no se lee
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await loop.sock_connect(sock, ("127.0.0.1", port))
+    _, cliente = await loop.create_connection(lambda: Cliente(consulta, websocket, medido), sock=sock)
+    if lento:
+        cliente.transport.pause_reading()
+    return cliente
+
+
+def consulta(filtro, i, placas):
+    if filtro == "mixto":
+        filtro = FILTROS[i % 3]
+    if filtro == "placa":
+        return "device=" + placas[i % len(placas)]
+    if filtro == "stride":
+        return "stride=10"
+    return ""
+
+
+async def fase(daemon, duracion):
+    # CPU del daemon (% de un núcleo) durante duracion segundos
+    cpu_inicio, _ = cpu_rss(daemon.pid)
+    t_inicio = time.monotonic()
+    await asyncio.sleep(duracion)
+    cpu_fin, rss = cpu_rss(daemon.pid)
+    return (cpu_fin - cpu_inicio) / (time.monotonic() - t_inicio) * 100, rss / 1024
+
+
+async def medir(args, daemon, ports, placas):
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(args.calentamiento)
+    cpu_sin, rss_sin = await fase(daemon, args.duracion)
+
+    clientes = [await conectar(loop, ports["stream"], consulta(args.filtro, i, placas), i % 2 == 1,
+                               medido=i < args.medidos)
+                for i in range(args.suscriptores)]
+    desconexiones = []
+    vigilancia = asyncio.create_task(vigilar_desconexiones(ports["metrics"], time.monotonic(), desconexiones))
+    lentos = [await conectar(loop, ports["stream"], "", i % 2 == 1, lento=True) for i in range(args.lentos)]
+    suscriptor = Suscriptor(ports["control"])
+    suscriptor.start()
+    await asyncio.sleep(args.calentamiento)
+
+    inicio = leer_metricas(ports["metrics"])
+    for cliente in clientes:
+        cliente.midiendo = True
+    suscriptor.midiendo = True
+    t0 = time.monotonic()
+    cpu_con, rss_con = await fase(daemon, args.duracion)
+    segundos = time.monotonic() - t0
+    for cliente in clientes:
+        cliente.midiendo = False
+    suscriptor.midiendo = False
+    fin = leer_metricas(ports["metrics"])
+    vigilancia.cancel()
+    suscriptor.close()
+    for cliente in clientes + lentos:
+        cliente.transport.close()
+
+    conectados = sum(1 for cliente in clientes if cliente.cerrado is None or cliente.cerrado > t0 + segundos)
+    mensajes = sum(cliente.mensajes for cliente in clientes)
+    mb = sum(cliente.bytes for cliente in clientes) / 1e6
+    latencias = sorted(latencia for cliente in clientes for latencia in cliente.latencias)
+    guardadas = sorted(suscriptor.latencias)
+    recibidas = total(fin, "readings_total") - total(inicio, "readings_total")
+
+    print(f"{len(placas)} placas, {recibidas / segundos:.0f} lecturas/s; {args.suscriptores} suscriptores "
+          f"({args.filtro}), {args.lentos} lentos")
+    print(f"{'':>28} {'sin suscr.':>12} {'con suscr.':>12}")
+    print(f"{'CPU del daemon (%)':>28} {cpu_sin:>12.1f} {cpu_con:>12.1f}")
+    print(f"{'RSS del daemon (MB)':>28} {rss_sin:>12.1f} {rss_con:>12.1f}")
+    print(f"suscriptores conectados al final: {conectados}/{len(clientes)}")
+    print(f"entregado: {mensajes / segundos:.0f} mensajes/s, {mb / segundos:.1f} MB/s "
+          f"({mensajes / segundos / max(len(clientes), 1):.1f} mensajes/s por suscriptor)")
+    if latencias:
+        print(f"latencia en vivo ({len(latencias)} mensajes): p50 {percentil(latencias, 0.5) * 1000:.1f} ms, "
+              f"p99 {percentil(latencias, 0.99) * 1000:.1f} ms, máx {latencias[-1] * 1000:.1f} ms")
+    if guardadas:
+        print(f"latencia de lo guardado (SUBSCRIBE): p50 {percentil(guardadas, 0.5) * 1000:.1f} ms, "
+              f"p99 {percentil(guardadas, 0.99) * 1000:.1f} ms")
+    print(f"lentos desconectados: {len(desconexiones)}/{args.lentos}"
+          + (f", entre {desconexiones[0]:.1f} y {desconexiones[-1]:.1f} s después de conectarse" if desconexiones
+             else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de lecturas en vivo a muchos suscriptores")
+    parser.add_argument("--placas", type=int, default=100)
+    parser.add_argument("--freq-ms", type=float, default=10, help="ms entre lecturas de cada placa")
+    parser.add_argument("--suscriptores", type=int, default=200)
+    parser.add_argument("--filtro", choices=FILTROS, default="mixto")
+    parser.add_argument("--medidos", type=int, default=10, help="suscriptores que miden la latencia")
+    parser.add_argument("--lentos", type=int, default=5, help="suscriptores que no leen")
+    parser.add_argument("--duracion", type=float, default=10, help="segundos de cada fase")
+    parser.add_argument("--calentamiento", type=float, default=2)
+    argv = sys.argv[1:]
+    extra = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix="bench_difusion_")
+    daemon, ports, _ = arrancar_daemon(directorio, extra)
+    simulador = subprocess.Popen([sys.executable, SIMULADOR, "--port", str(ports["port"]), "--placas",
+                                  str(args.placas), "--freq-ms", str(args.freq_ms), "--json"],
+                                 stdout=subprocess.PIPE, text=True)
+    control = None
+    try:
+        control = CanalControl(ports["control"])
+        esperar_placas(control, args.placas, 60)
+        placas = sorted(control.comando("DEVICES").split()[1:])
+        control.comando("SEND * START")
+        asyncio.run(medir(args, daemon, ports, placas))
+        control.comando("SEND * STOP")
+    finally:
+        if control:
+            control.close()
+        terminar(simulador)
+        terminar(daemon)
@@ -0,0 +1,90 @@
+# Costo por lectura de las estadísticas internas: listas con pop(0) y
+# sum/max/min en cada actualización vs RollingWindow (Welford + colas monótonas),
+# de a una lectura con add() y por lotes con extend()
+#
+# Uso: python benchmarks/bench_estadisticas.py --lecturas 20000
+#
+# Se agrega una lectura y se piden promedio, máximo y mínimo, como hace la
+# interfaz en cada tick cuando llega una lectura por tick. Las columnas de
+# resultado permiten comprobar que las tres rutas dan lo mismo.
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import estadisticas
+
+LOTE = 500  # Lecturas por extend() en la ruta por lotes (DB_BATCH_SIZE)
+
+
+def valor(i):
+    return 22 + 2 * math.sin(i / 500) + (i * 7919 % 13) / 100
+
+
+def medir_listas(ventana, lecturas):
+    # Copia de process_data_queue/actualizar_datos antes de estadisticas.py
+    internal = [valor(i) for i in range(ventana)]
+    t0 = time.perf_counter()
+    for i in range(ventana, ventana + lecturas):
+        internal.append(valor(i))
+        if len(internal) > ventana:
+            internal.pop(0)
+        avg = sum(internal) / len(internal)
+        high = max(internal)
+        low = min(internal)
+    elapsed = time.perf_counter() - t0
+    return elapsed, (avg, high, low, statistics.stdev(internal))
+
+
+def medir_rolling(ventana, lecturas):
+    window = estadisticas.RollingWindow(size=ventana)
+    for i in range(ventana):
+        window.add(i, valor(i))
+    t0 = time.perf_counter()
+    for i in range(ventana, ventana + lecturas):
+        window.add(i, valor(i))
+        avg = window.mean
+        high = window.max()
+        low = window.min()
+    elapsed = time.perf_counter() - t0
+    return elapsed, (avg, high, low, window.std())
+
+
+def medir_lotes(ventana, lecturas):
+    # Lo mismo con extend() y lotes como los que deja el hilo escritor
+    window = estadisticas.RollingWindow(size=ventana)
+    window.extend(numpy.arange(ventana), [valor(i) for i in range(ventana)])
+    indices = numpy.arange(ventana, ventana + lecturas)
+    valores = numpy.array([valor(i) for i in indices])
+    t0 = time.perf_counter()
+    for i in range(0, lecturas, LOTE):
+        window.extend(indices[i:i + LOTE], valores[i:i + LOTE])
+        avg = window.mean
+        high = window.max()
+        low = window.min()
+    elapsed = time.perf_counter() - t0
+    return elapsed, (avg, high, low, window.std())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de estadísticas móviles")
+    parser.add_argument("--lecturas", type=int, default=20000)
+    parser.add_argument("--ventanas", type=int, nargs="+", default=[100, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'ruta':>8} {'ventana':>8} {'µs/lectura':>11} {'promedio':>10} {'máx':>8} {'mín':>8} {'desv':>8}")
+    for ventana in args.ventanas:
+        # La ventana se llena antes de medir, así cada lectura también quita una.
+        # Con ventanas grandes las listas tardan milisegundos por lectura: se miden
+        # menos lecturas y se compara el resultado con el mismo número
+        lecturas = args.lecturas if ventana <= 1000 else max(args.lecturas // 100, 20)
+        for nombre, medir in (("listas", medir_listas), ("rolling", medir_rolling), ("lotes", medir_lotes)):
+            elapsed, (avg, high, low, std) = medir(ventana, lecturas)
+            print(f"{nombre:>8} {ventana:>8} {elapsed * 1e6 / lecturas:>11.2f} "
+                  f"{avg:>10.4f} {high:>8.2f} {low:>8.2f} {std:>8.4f}")
@@ -0,0 +1,417 @@
+# Prueba de carga de punta a punta: daemon monitorpi.py contra una flota simulada
+#
+# Uso: python benchmarks/bench_flota.py --placas 100 --freq-ms 10 --duracion 20 --salida flota.json
+#      python benchmarks/bench_flota.py ... --comparar flota_anterior.json
+#      python benchmarks/bench_flota.py ... -- --queue-policy coalesce --threaded
+#
+# Se lanza monitorpi.py (sin interfaz, con base de datos temporal y puertos
+# libres) y simulador_esp32.py como procesos aparte. Cuando todas las placas
+# se conectaron se envía "SEND * START" por el canal de control, se descartan
+# los primeros --calentamiento segundos y durante --duracion segundos se mide:
+#
+#   - lecturas recibidas y filas escritas por segundo (métricas del daemon)
+#   - latencia de almacenamiento: desde el timestamp de cada lectura hasta que
+#     el lote guardado llega a un suscriptor del canal de control (como la
+#     interfaz); en binario incluye lo que la placa espera para llenar la trama
+#   - db_insert_seconds, queue_wait_seconds y decode_seconds del endpoint de
+#     métricas (promedio y percentiles con la resolución de sus cubetas)
+#   - profundidad de la cola, CPU (utime + stime, en % de un núcleo) y RSS del
+#     daemon, leídos de /proc cada --muestreo segundos
+#
+# Después se envía STOP y se mide cuánto tarda en vaciarse la cola. El
+# resultado (versión del código, parámetros, resumen y las muestras) se guarda
+# como JSON; con --comparar se muestra la diferencia con un resultado anterior
+# y el código de salida es 1 si alguna métrica empeoró más que --tolerancia.
+# Todos los argumentos después de "--" se pasan tal cual a monitorpi.py.
+import argparse
+import datetime
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SIMULADOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulador_esp32.py")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PREFIX = "monitorpi_"
+
+# Métricas del resumen que se comparan entre versiones: True si más es mejor
+COMPARABLES = {
+    "escritas_por_s": True,
+    "recibidas_por_s": True,
+    "latencia_p50_ms": False,
+    "latencia_p99_ms": False,
+    "db_insert_prom_ms": False,
+    "queue_wait_prom_ms": False,
+    "cola_max": False,
+    "cpu_pct": False,
+    "rss_max_mb": False,
+    "drenado_s": False,
+}
+
+
+def puerto_libre():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def version_codigo():
+    try:
+        commit = subprocess.run(["git", "-C", RAIZ, "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        cambios = subprocess.run(["git", "-C", RAIZ, "status", "--porcelain", "--untracked-files=no"],
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-modificado" if cambios else "")
+
+
+def cpu_rss(pid):
+    # Segundos de CPU (usuario + sistema) y RSS en KB de un proceso
+    with open(f"/proc/{pid}/stat") as f:
+        # El nombre del proceso va entre paréntesis y puede tener espacios
+        campos = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(campos[11]) + int(campos[12])) / CLOCK_TICKS
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            if linea.startswith("VmRSS:"):
+                return cpu, int(linea.split()[1])
+    return cpu, 0
+
+
+def leer_metricas(port):
+    # Texto de Prometheus -> {nombre (sin prefijo) o nombre{etiquetas}: valor}
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as s:
+        s.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    body = b"".join(chunks).split(b"\r\n\r\n", 1)[1].decode()
+    valores = {}
+    for linea in body.splitlines():
+        if not linea or linea.startswith("#"):
+            continue
+        nombre, _, valor = linea.rpartition(" ")
+        valores[nombre[len(PREFIX):] if nombre.startswith(PREFIX) else nombre] = float(valor)
+    return valores
+
+
+def total(valores, nombre):
+    # Suma de un contador sobre todas sus etiquetas
+    return sum(valor for clave, valor in valores.items() if clave == nombre or clave.startswith(nombre + "{"))
+
+
+def histograma(inicio, fin, nombre):
+    # Promedio y percentiles de las observaciones entre dos lecturas de /metrics.
+    # Los percentiles son el límite superior de la cubeta (potencias de dos)
+    count = fin.get(nombre + "_count", 0) - inicio.get(nombre + "_count", 0)
+    if count <= 0:
+        return {"n": 0}
+    resultado = {"n": int(count),
+                 "prom_ms": (fin[nombre + "_sum"] - inicio.get(nombre + "_sum", 0)) / count * 1000}
+    cubetas = []
+    for clave, valor in fin.items():
+        if clave.startswith(nombre + '_bucket{le="'):
+            le = clave[len(nombre) + 12:-2]
+            cubetas.append((float(le), valor - inicio.get(clave, 0)))
+    cubetas.sort()
+    for q in (0.5, 0.99):
+        for le, acumulado in cubetas:
+            if acumulado >= q * count:
+                resultado[f"p{int(q * 100)}_ms"] = le * 1000
+                break
+    return resultado
+
+
+def percentil(ordenados, q):
+    if not ordenados:
+        return None
+    return ordenados[min(int(q * len(ordenados)), len(ordenados) - 1)]
+
+
+class CanalControl:
+    # Conexión de texto al canal de control del daemon
+    def __init__(self, port):
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+        self.archivo = self.sock.makefile("rb")
+
+    def comando(self, linea):
+        self.sock.sendall(linea.encode() + b"\n")
+        return self.archivo.readline().decode().strip()
+
+    def close(self):
+        self.archivo.close()
+        self.sock.close()
+
+
+# Suscriptor del canal de control que mide la latencia de almacenamiento de
+# cada lectura guardada mientras midiendo está activo
+class Suscriptor(threading.Thread):
+    def __init__(self, port):
+        threading.Thread.__init__(self, daemon=True)
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+        self.sock.settimeout(None)
+        self.sock.sendall(b"SUBSCRIBE\n")
+        self.midiendo = False
+        self.latencias = []
+        self.lotes = 0
+
+    def run(self):
+        with self.sock.makefile("rb") as archivo:
+            for linea in archivo:
+                if not linea.startswith(b"BATCH ") or not self.midiendo:
+                    continue
+                ahora = time.time()
+                lote = json.loads(linea[6:])
+                self.lotes += 1
+                self.latencias.extend(ahora - lectura[0] for lectura in lote)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def arrancar_daemon(directorio, extra):
+    ports = {"port": puerto_libre(), "control": puerto_libre(), "metrics": puerto_libre(), "stream": puerto_libre()}
+    log_file = os.path.join(directorio, "monitorpi.log")
+    comando = [sys.executable, os.path.join(RAIZ, "monitorpi.py"), "--db", os.path.join(directorio, "flota.db"),
+               "--port", str(ports["port"]), "--control-port", str(ports["control"]),
+               "--metrics-port", str(ports["metrics"]), "--stream-port", str(ports["stream"])] + extra
+    with open(log_file, "w") as log:
+        proceso = subprocess.Popen(comando, stdout=log, stderr=subprocess.STDOUT,
+                                   env=dict(os.environ, PYTHONUNBUFFERED="1"))
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proceso.poll() is not None:
+            break
+        with open(log_file) as f:
+            if "Monitor en ejecución" in f.read():
+                return proceso, ports, log_file
+        time.sleep(0.05)
+    proceso.kill()
+    with open(log_file) as f:
+        raise RuntimeError("monitorpi.py no terminó de arrancar:\n" + f.read())
+
+
+def esperar_placas(control, cantidad, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        conectadas = len(control.comando("DEVICES").split()) - 1
+        if conectadas >= cantidad:
+            return conectadas
+        time.sleep(0.2)
+    raise RuntimeError(f"solo se conectaron {conectadas} de {cantidad} placas")
+
+
+def terminar(proceso, timeout=30):
+    if proceso.poll() is None:
+        proceso.send_signal(signal.SIGTERM)
+    try:
+        return proceso.communicate(timeout=timeout)[0]
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        return proceso.communicate()[0]
+
+
+def medir(args, extra):
+    directorio = tempfile.mkdtemp(prefix="bench_flota_")
+    daemon, ports, log_file = arrancar_daemon(directorio, extra)
+    simulador = None
+    suscriptor = None
+    control = None
+    try:
+        comando = [sys.executable, SIMULADOR, "--port", str(ports["port"]), "--placas", str(args.placas),
+                   "--freq-ms", str(args.freq_ms), "--ventana-ms", str(args.ventana_ms), "--modo", str(args.modo),
+                   "--jitter", str(args.jitter), "--semilla", str(args.semilla), "--json"]
+        if args.texto:
+            comando.append("--texto")
+        simulador = subprocess.Popen(comando, stdout=subprocess.PIPE, text=True)
+        control = CanalControl(ports["control"])
+        esperar_placas(control, args.placas, 60)
+        if args.latencia:
+            suscriptor = Suscriptor(ports["control"])
+            suscriptor.start()
+
+        control.comando("SEND * START")
+        time.sleep(args.calentamiento)
+
+        # Medición
+        if suscriptor:
+            suscriptor.midiendo = True
+        inicio = leer_metricas(ports["metrics"])
+        cpu_inicio, _ = cpu_rss(daemon.pid)
+        t_inicio = time.monotonic()
+        muestras = []
+        cpu_anterior, t_anterior = cpu_inicio, t_inicio
+        while time.monotonic() - t_inicio < args.duracion:
+            time.sleep(args.muestreo)
+            cpu, rss = cpu_rss(daemon.pid)
+            ahora = time.monotonic()
+            valores = leer_metricas(ports["metrics"])
+            muestras.append({
+                "t": round(ahora - t_inicio, 3),
+                "cola": int(valores.get("queue_depth", 0)),
+                "escritas": int(total(valores, "db_rows_total")),
+                "cpu_pct": round((cpu - cpu_anterior) / (ahora - t_anterior) * 100, 1),
+                "rss_mb": round(rss / 1024, 1),
+            })
+            cpu_anterior, t_anterior = cpu, ahora
+        fin = leer_metricas(ports["metrics"])
+        cpu_fin, _ = cpu_rss(daemon.pid)
+        t_fin = time.monotonic()
+        if suscriptor:
+            suscriptor.midiendo = False
+
+        # Vaciado: se detienen las placas y se espera a que todo lo recibido esté
+        # escrito (o descartado o resumido por la cola)
+        control.comando("SEND * STOP")
+        t_stop = time.monotonic()
+        recibidas_stop = None
+        while time.monotonic() - t_stop < args.timeout_drenado:
+            valores = leer_metricas(ports["metrics"])
+            recibidas = total(valores, "readings_total")
+            procesadas = (total(valores, "db_rows_total") + valores.get("queue_dropped_total", 0)
+                          + valores.get("queue_coalesced_total", 0))
+            if recibidas == recibidas_stop and procesadas >= recibidas:
+                break
+            recibidas_stop = recibidas
+            time.sleep(0.05)
+        drenado = time.monotonic() - t_stop
+        final = leer_metricas(ports["metrics"])
+    finally:
+        if control:
+            control.close()
+        salida_simulador = terminar(simulador) if simulador else ""
+        if suscriptor:
+            suscriptor.close()
+        terminar(daemon)
+
+    flota = json.loads(salida_simulador.strip().splitlines()[-1]) if salida_simulador.strip() else {}
+    segundos = t_fin - t_inicio
+    latencias = sorted(suscriptor.latencias) if suscriptor else []
+    resumen = {
+        "recibidas_por_s": (total(fin, "readings_total") - total(inicio, "readings_total")) / segundos,
+        "escritas_por_s": (total(fin, "db_rows_total") - total(inicio, "db_rows_total")) / segundos,
+        "cpu_pct": (cpu_fin - cpu_inicio) / segundos * 100,
+        "rss_max_mb": max(m["rss_mb"] for m in muestras) if muestras else None,
+        "cola_max": max(m["cola"] for m in muestras) if muestras else None,
+        "cola_prom": sum(m["cola"] for m in muestras) / len(muestras) if muestras else None,
+        "drenado_s": drenado,
+        "latencia_p50_ms": _ms(percentil(latencias, 0.5)),
+        "latencia_p90_ms": _ms(percentil(latencias, 0.9)),
+        "latencia_p99_ms": _ms(percentil(latencias, 0.99)),
+        "latencia_max_ms": _ms(latencias[-1] if latencias else None),
+        "db_insert_prom_ms": histograma(inicio, fin, "db_insert_seconds").get("prom_ms"),
+        "queue_wait_prom_ms": histograma(inicio, fin, "queue_wait_seconds").get("prom_ms"),
+    }
+    totales = {
+        "enviadas": flota.get("data", 0) + flota.get("stats", 0),
+        "omitidas_por_las_placas": flota.get("omitidas", 0),
+        "recibidas": int(total(final, "readings_total")),
+        "escritas": int(total(final, "db_rows_total")),
+        "perdidas_en_secuencia": int(total(final, "lost_readings_total")),
+        "descartadas_en_cola": int(final.get("queue_dropped_total", 0)),
+        "resumidas_en_cola": int(final.get("queue_coalesced_total", 0)),
+        "mensajes_desconocidos": int(total(final, "unknown_messages_total")),
+        "errores_db": int(total(final, "db_errors_total")),
+    }
+    histogramas = {nombre: histograma(inicio, fin, nombre)
+                   for nombre in ("decode_seconds", "enqueue_seconds", "db_insert_seconds", "queue_wait_seconds")}
+    return resumen, totales, histogramas, flota, muestras
+
+
+def _ms(segundos):
+    return None if segundos is None else segundos * 1000
+
+
+def comparar(anterior, actual, tolerancia):
+    # Imprime la diferencia por métrica; devuelve las que empeoraron más que la tolerancia
+    print(f"\ncomparación con {anterior.get('version')} ({anterior.get('fecha')}):")
+    print(f"{'métrica':>20} {'antes':>12} {'ahora':>12} {'cambio':>8}")
+    peores = []
+    for nombre, mas_es_mejor in COMPARABLES.items():
+        antes = anterior["resumen"].get(nombre)
+        ahora = actual["resumen"].get(nombre)
+        if antes is None or ahora is None:
+            continue
+        cambio = (ahora - antes) / antes if antes else 0.0
+        empeoro = -cambio > tolerancia if mas_es_mejor else cambio > tolerancia
+        marca = "  <- peor" if empeoro else ""
+        print(f"{nombre:>20} {antes:>12.2f} {ahora:>12.2f} {cambio * 100:>+7.1f}%{marca}")
+        if empeoro:
+            peores.append(nombre)
+    if anterior.get("parametros") != actual["parametros"]:
+        print("(ojo: los parámetros de las dos ejecuciones no son iguales)")
+    return peores
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    extra = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    parser = argparse.ArgumentParser(description="Prueba de carga del daemon con una flota simulada")
+    parser.add_argument("--placas", type=int, default=50)
+    parser.add_argument("--freq-ms", type=float, default=10, help="ms entre lecturas de cada placa")
+    parser.add_argument("--ventana-ms", type=int, default=5000)
+    parser.add_argument("--modo", type=int, choices=[1, 2], default=1)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--texto", action="store_true", help="placas sin protocolo binario")
+    parser.add_argument("--duracion", type=float, default=10, help="segundos de medición")
+    parser.add_argument("--calentamiento", type=float, default=2, help="segundos antes de empezar a medir")
+    parser.add_argument("--muestreo", type=float, default=0.5, help="segundos entre muestras de CPU, RSS y cola")
+    parser.add_argument("--timeout-drenado", type=float, default=60)
+    parser.add_argument("--sin-latencia", dest="latencia", action="store_false",
+                        help="no suscribirse al canal de control (sin latencia de almacenamiento)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", help="archivo JSON donde guardar el resultado")
+    parser.add_argument("--comparar", help="resultado JSON anterior contra el cual comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.10,
+                        help="empeoramiento relativo que se considera regresión")
+    args = parser.parse_args(argv)
+
+    parametros = {key: value for key, value in vars(args).items()
+                  if key not in ("salida", "comparar", "tolerancia")}
+    parametros["monitorpi"] = extra
+    print(f"{args.placas} placas cada {args.freq_ms:g} ms ({args.placas * 1000 / args.freq_ms:.0f} lecturas/s "
+          f"ofrecidas, {'texto' if args.texto else 'binario'}, modo {args.modo}), {args.duracion:g} s")
+    resumen, totales, histogramas, flota, muestras = medir(args, extra)
+    resultado = {
+        "version": version_codigo(),
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "maquina": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": parametros,
+        "resumen": resumen,
+        "totales": totales,
+        "histogramas": histogramas,
+        "flota": flota,
+        "muestras": muestras,
+    }
+
+    for nombre, valor in resumen.items():
+        print(f"{nombre:>20} {'-' if valor is None else f'{valor:.2f}':>12}")
+    print("totales: " + ", ".join(f"{nombre} {valor}" for nombre, valor in totales.items()))
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2)
+        print(f"resultado guardado en {args.salida}")
+    if args.comparar:
+        with open(args.comparar) as f:
+            peores = comparar(json.load(f), resultado, args.tolerancia)
+        if peores:
+            print("regresión en: " + ", ".join(peores))
+            sys.exit(1)
@@ -0,0 +1,116 @@
+# Tiempo por redibujado: graficar_datos original (clear + plot + tight_layout +
+# draw) vs LivePlot (líneas fijas, blitting y reescalado solo cuando hace falta)
+#
+# Uso: python benchmarks/bench_graficos.py --ticks 20
+#
+# Se usa el backend Agg para no depender de una pantalla. En cada tick llega un
+# punto nuevo y se descarta el más antiguo, como en la ventana en ejecución.
+import argparse
+import collections
+import datetime
+import math
+import os
+import sys
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import buffer_circular
+import graficos
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def valores(i):
+    # Variación lenta con algo de ruido, como un sensor real
+    return 22 + 2 * math.sin(i / 500) + (i * 7919 % 13) / 100, 55 + 5 * math.cos(i / 800) + (i * 104729 % 11) / 100
+
+
+def fila(epoch, i):
+    timestamp = time.strftime(TIMESTAMP_FORMAT, time.localtime(epoch))
+    return (timestamp, *valores(i), None, None, None, None, None, None, 1, "sim")
+
+
+def graficar_original(figure, axs, data_list):
+    # Copia de TemperatureHumidityMonitorApp.graficar_datos antes de LivePlot
+    for ax in axs:
+        ax.clear()
+    timestamps = []
+    temperaturas = []
+    humedades = []
+    for entry in data_list:
+        timestamps.append(datetime.datetime.strptime(entry[0], TIMESTAMP_FORMAT))
+        temperaturas.append(entry[1])
+        humedades.append(entry[2])
+    axs[0].plot(timestamps, temperaturas, label='Temperatura (C)', color='r', marker='o')
+    axs[0].set_ylabel('Temperatura (C)')
+    axs[0].legend()
+    axs[0].grid(True)
+    axs[1].plot(timestamps, humedades, label='Humedad (%)', color='b', marker='o')
+    axs[1].set_ylabel('Humedad (%)')
+    axs[1].legend()
+    axs[1].grid(True)
+    axs[1].xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+    figure.autofmt_xdate()
+    figure.tight_layout()
+    figure.canvas.draw()
+
+
+def medir_original(n, ticks):
+    figure, axs = plt.subplots(2, 1, figsize=(8, 10), sharex=True)
+    start = time.time() - n
+    data = collections.deque((fila(start + i, i) for i in range(n)), maxlen=n)
+    tiempos = []
+    for k in range(ticks):
+        data.append(fila(start + n + k, n + k))
+        t0 = time.perf_counter()
+        graficar_original(figure, axs, list(data))
+        tiempos.append(time.perf_counter() - t0)
+    plt.close(figure)
+    return tiempos
+
+
+def lectura(epoch, i):
+    return (epoch, *valores(i), None, None, None, None, None, None, 1, "sim")
+
+
+def medir_live(n, ticks):
+    figure, axs = plt.subplots(2, 1, figsize=(8, 10), sharex=True)
+    plot = graficos.LivePlot(figure, axs)
+    start = time.time() - n
+    cache = buffer_circular.HotCache(n)
+    cache.load_rows([lectura(start + i, i) for i in range(n)])
+    figure.canvas.draw()
+    tiempos = []
+    for k in range(ticks):
+        i = n + k
+        cache.load_rows([lectura(start + i, i)])
+        t0 = time.perf_counter()
+        plot.update(*cache.series(n))
+        tiempos.append(time.perf_counter() - t0)
+    plt.close(figure)
+    return tiempos
+
+
+def resumen(nombre, n, tiempos):
+    ms = sorted(t * 1000 for t in tiempos)
+    print(f"{nombre:>10} {n:>8} {sum(ms) / len(ms):>10.2f} {ms[len(ms) // 2]:>10.2f} {ms[-1]:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de redibujado de gráficos")
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--puntos", type=int, nargs="+", default=[20, 1000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'ruta':>10} {'puntos':>8} {'media ms':>10} {'p50 ms':>10} {'máx ms':>10}")
+    for n in args.puntos:
+        # Con 100k puntos la ruta original tarda segundos por tick
+        ticks = args.ticks if n <= 1000 else max(args.ticks // 10, 2)
+        resumen("original", n, medir_original(n, ticks))
+        resumen("LivePlot", n, medir_live(n, args.ticks))
@@ -0,0 +1,79 @@
+# Costo de la instrumentación y del log por mensaje
+#
+# Uso: python benchmarks/bench_metricas.py --mensajes 100000
+#
+# Mide cuánto cuesta registrar un valor en un histograma y un contador, y el
+# costo por mensaje de TCPServer.process_lines con una línea por recv (una placa
+# a su ritmo normal) según el nivel de log: DEBUG escribe una línea por mensaje
+# como hacían los print, INFO no escribe nada. El log va a un archivo, que es
+# más barato que una terminal.
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import metricas
+import monitorpi
+
+
+class ColaNula:
+    def put(self, batch, block=True):
+        return True
+
+
+def medir_registro(n):
+    histogram = metricas.Histogram("bench_seconds", "")
+    counter = metricas.Counter("bench_total", "", "device")
+    values = [random.lognormvariate(-7, 1.5) for _ in range(n)]
+    t0 = time.perf_counter()
+    for value in values:
+        histogram.record(value)
+    t_hist = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        counter.inc(1, "esp32-1")
+    t_counter = time.perf_counter() - t0
+    return t_hist / n, t_counter / n
+
+
+def medir_mensajes(n, level, log_file):
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter(monitorpi.LOG_FORMAT))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    server = monitorpi.TCPServer.__new__(monitorpi.TCPServer)
+    # Solo los atributos que usa queue_readings: sin alertas, caché ni difusión
+    server.data_queue = ColaNula()
+    server.cache = None
+    server.alerts = None
+    server.stream = None
+    server.loop = None
+    server.identified = {"esp32-1"}
+    lines = [b"DATA 21.50 55.20"]
+    t0 = time.perf_counter()
+    for _ in range(n):
+        server.process_lines(lines, "esp32-1")
+    elapsed = time.perf_counter() - t0
+    root.removeHandler(handler)
+    handler.close()
+    return elapsed / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de métricas y log")
+    parser.add_argument("--mensajes", type=int, default=100000)
+    args = parser.parse_args()
+
+    t_hist, t_counter = medir_registro(args.mensajes)
+    print(f"Histogram.record: {t_hist * 1e9:.0f} ns, Counter.inc: {t_counter * 1e9:.0f} ns")
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "monitor.log")
+        for level in ("DEBUG", "INFO"):
+            per_message = medir_mensajes(args.mensajes, level, log_file)
+            print(f"process_lines con log {level:>5}: {per_message * 1e6:.2f} µs/mensaje")
@@ -0,0 +1,128 @@
+# Rendimiento del parser de líneas: versión original (str + split por mensaje)
+# vs LineFramer + parse_lines (bytearray reutilizable, lotes de líneas)
+#
+# Uso: python benchmarks/bench_protocolo.py --mb 8
+#
+# El flujo sintético se entrega en trozos de tamaño fijo a través de un socket
+# falso, igual que llegaría por recv(). También se verifica que un carácter
+# UTF-8 multibyte partido entre dos trozos no rompa la lectura.
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import protocolo
+
+
+# Socket falso que entrega el flujo en trozos de chunk_size bytes
+class FakeSocket:
+    def __init__(self, data, chunk_size):
+        self.view = memoryview(data)
+        self.pos = 0
+        self.chunk_size = chunk_size
+
+    def recv(self, size):
+        n = min(size, self.chunk_size)
+        data = bytes(self.view[self.pos:self.pos + n])
+        self.pos += len(data)
+        return data
+
+    def recv_into(self, buffer):
+        n = min(len(buffer), self.chunk_size, len(self.view) - self.pos)
+        buffer[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def generar_flujo(megabytes, stats_cada=10, unicode_cada=0):
+    lines = []
+    size = 0
+    i = 0
+    while size < megabytes * 1024 * 1024:
+        if unicode_cada and i % unicode_cada == 0:
+            line = "LOG calibración ñandú º\n".encode()
+        elif i % stats_cada == 0:
+            line = b"STATS 23.41 24.10 22.98 55.20 56.00 54.80\n"
+        else:
+            line = f"DATA {20 + i % 700 / 100:.2f} {50 + i % 300 / 100:.2f}\n".encode()
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return b"".join(lines)
+
+
+def parser_original(sock, buffer_size):
+    # Copia de TCPServer.handle_client/process_message antes de protocolo.py
+    lecturas = 0
+    otros = 0
+    buffer = ""
+    while True:
+        data = sock.recv(buffer_size)
+        if not data:
+            break
+        buffer += data.decode()
+        while '\n' in buffer:
+            message, buffer = buffer.split('\n', 1)
+            message = message.strip()
+            if not message:
+                continue
+            if message.startswith("DATA"):
+                _, temp_str, hum_str = message.split()
+                float(temp_str), float(hum_str)
+                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                lecturas += 1
+            elif message.startswith("STATS"):
+                parts = message.split()
+                [float(p) for p in parts[1:]]
+                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                lecturas += 1
+            else:
+                otros += 1
+    return lecturas, otros
+
+
+def parser_nuevo(sock, buffer_size):
+    lecturas = 0
+    otros = 0
+    framer = protocolo.LineFramer(buffer_size)
+    while framer.recv_into(sock):
+        lines, _ = framer.messages()
+        if lines:
+            readings, others = protocolo.parse_lines(lines, time.time_ns())
+            lecturas += len(readings)
+            otros += len(others)
+    return lecturas, otros
+
+
+def medir(nombre, parser, data, chunk_size, buffer_size):
+    t0 = time.perf_counter()
+    try:
+        resultado = parser(FakeSocket(data, chunk_size), buffer_size)
+    except UnicodeDecodeError as e:
+        return f"{nombre:>9} {chunk_size:>7} {'error: ' + str(e)[:40]}"
+    elapsed = time.perf_counter() - t0
+    mb = len(data) / 1024 / 1024
+    return f"{nombre:>9} {chunk_size:>7} {mb / elapsed:>8.1f} {resultado[0] / elapsed:>12.0f} {resultado[0]:>10}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del parser de líneas DATA/STATS")
+    parser.add_argument("--mb", type=float, default=8)
+    args = parser.parse_args()
+
+    data = generar_flujo(args.mb)
+    print(f"Flujo de {len(data) / 1024 / 1024:.1f} MB")
+    print(f"{'parser':>9} {'trozo':>7} {'MB/s':>8} {'lecturas/s':>12} {'lecturas':>10}")
+    for chunk_size in (1024, 16 * 1024, 64 * 1024):
+        # El parser original siempre lee de a 1024 bytes (BUFFER_SIZE)
+        print(medir("original", parser_original, data, chunk_size, 1024))
+        print(medir("nuevo", parser_nuevo, data, chunk_size, protocolo.RECV_BUFFER_SIZE))
+
+    # Un carácter multibyte partido entre dos recv
+    data = generar_flujo(0.1, unicode_cada=7)
+    print("\nFlujo con líneas UTF-8 multibyte")
+    print(medir("original", parser_original, data, 1024, 1024))
+    print(medir("nuevo", parser_nuevo, data, 1024, protocolo.RECV_BUFFER_SIZE))
@@ -0,0 +1,160 @@
+# Prueba de carga: servidor con un hilo por conexión vs servidor asyncio
+#
+# Uso: python benchmarks/bench_servidor.py --clientes 200 --mensajes 500
+#
+# El servidor corre en un proceso hijo para medir su memoria (RSS) sin contar
+# la de los clientes simulados. Los mensajes por segundo se miden desde el
+# primer hasta el último mensaje puesto en la cola por el servidor.
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+HOST = "127.0.0.1"
+
+
+def rss_kb():
+    # Memoria residente del proceso actual en KB (Linux)
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+# Cola que solo cuenta los mensajes recibidos
+class CountingQueue:
+    def __init__(self):
+        self.count = 0
+        self.first = None
+        self.last = None
+
+    def put(self, batch, block=True):
+        # Nunca se llena: el servidor no tiene que pausar la lectura
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.count += len(batch)
+        return True
+
+
+def servidor_hijo(modo, port, conn):
+    # Los prints por mensaje del servidor no deben medir la velocidad de la terminal
+    sys.stdout = open(os.devnull, "w")
+    import monitorpi
+
+    data_queue = CountingQueue()
+    server_class = monitorpi.AsyncTCPServer if modo == "asyncio" else monitorpi.TCPServer
+    server = server_class(data_queue, host=HOST, port=port)
+    server.daemon = True
+    server.start()
+    time.sleep(0.2)
+    conn.send(rss_kb())
+    while True:
+        request = conn.recv()
+        if request == "rss":
+            conn.send((rss_kb(), threading.active_count()))
+        elif request == "count":
+            conn.send((data_queue.count, data_queue.first, data_queue.last))
+        elif request == "exit":
+            conn.send(None)
+            # Los hilos de clientes del servidor con hilos no terminan solos
+            os._exit(0)
+
+
+async def abrir_clientes(num_clientes, port):
+    writers = []
+    for i in range(num_clientes):
+        for _ in range(50):
+            try:
+                reader, writer = await asyncio.open_connection(HOST, port)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        else:
+            raise RuntimeError("no se pudo conectar al servidor")
+        writer.write(f"HELLO sim-{i}\n".encode())
+        writers.append(writer)
+    return writers
+
+
+async def enviar(writers, num_mensajes):
+    payload = b"DATA 23.41 55.20\n" * 100
+
+    async def cliente(writer):
+        restantes = num_mensajes
+        while restantes > 0:
+            n = min(100, restantes)
+            writer.write(payload[:17 * n])
+            await writer.drain()
+            restantes -= n
+
+    await asyncio.gather(*(cliente(w) for w in writers))
+
+
+def medir(modo, num_clientes, num_mensajes, port):
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=servidor_hijo, args=(modo, port, child))
+    proc.start()
+    rss_base = parent.recv()
+
+    loop = asyncio.new_event_loop()
+    t0 = time.perf_counter()
+    writers = loop.run_until_complete(abrir_clientes(num_clientes, port))
+    connect_time = time.perf_counter() - t0
+    time.sleep(0.5)
+    parent.send("rss")
+    rss_conn, hilos = parent.recv()
+
+    total = num_clientes * num_mensajes
+    loop.run_until_complete(enviar(writers, num_mensajes))
+    deadline = time.time() + 120
+    while True:
+        parent.send("count")
+        count, first, last = parent.recv()
+        if count >= total or time.time() > deadline:
+            break
+        time.sleep(0.1)
+
+    for writer in writers:
+        writer.close()
+    loop.close()
+    parent.send("exit")
+    parent.recv()
+    proc.join()
+
+    elapsed = (last - first) if count > 1 else float("nan")
+    return {
+        "modo": modo,
+        "clientes": num_clientes,
+        "recibidos": count,
+        "esperados": total,
+        "conexion_s": connect_time,
+        "msg_por_s": count / elapsed if elapsed else float("nan"),
+        "hilos": hilos,
+        "rss_base_kb": rss_base,
+        "kb_por_conexion": (rss_conn - rss_base) / num_clientes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor TCP")
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--mensajes", type=int, default=500, help="mensajes DATA por cliente")
+    parser.add_argument("--modo", choices=["asyncio", "threaded", "ambos"], default="ambos")
+    parser.add_argument("--port", type=int, default=18888)
+    args = parser.parse_args()
+
+    modos = ["threaded", "asyncio"] if args.modo == "ambos" else [args.modo]
+    print(f"{'modo':>9} {'clientes':>8} {'recibidos':>10} {'conexión s':>10} {'msg/s':>10} "
+          f"{'hilos':>6} {'KB/conexión':>11}")
+    for i, modo in enumerate(modos):
+        r = medir(modo, args.clientes, args.mensajes, args.port + i)
+        print(f"{r['modo']:>9} {r['clientes']:>8} {r['recibidos']:>10} {r['conexion_s']:>10.2f} "
+              f"{r['msg_por_s']:>10.0f} {r['hilos']:>6} {r['kb_por_conexion']:>11.1f}")
@@ -0,0 +1,96 @@
+# Comparación de escritura en SQLite: commit por fila vs hilo escritor por lotes
+#
+# Uso: python benchmarks/bench_sqlite.py --filas 20000
+#
+# "Bloqueo de la interfaz" es el tiempo que el hilo de la interfaz pasa dentro de
+# process_data_queue. Antes insertaba cada lectura con su propio commit; con
+# DataBaseWriter solo vacía la cola de lotes ya guardados.
+import argparse
+import os
+import queue
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cola
+from lecturas import ReadingBatch
+from monitorpi import DataBase, DataBaseWriter, DB_BATCH_SIZE, DB_FLUSH_MS
+
+
+def lecturas(n):
+    timestamp = time.time()
+    for i in range(n):
+        yield (timestamp, 20.0 + i % 10, 50.0, None, None, None, None, None, None, 1, f"sim-{i % 20}")
+
+
+def por_fila(db_file, n, ticks):
+    # Ruta original: el timer de la interfaz inserta y hace commit de cada fila
+    db = DataBase(db_file, wal=False, synchronous=None)
+    rows = list(lecturas(n))
+    por_tick = max(n // ticks, 1)
+    stalls = []
+    t0 = time.perf_counter()
+    for i in range(0, n, por_tick):
+        t_tick = time.perf_counter()
+        for row in rows[i:i + por_tick]:
+            db.insert_data(*row[:9], mode=row[9], device_id=row[10])
+        stalls.append(time.perf_counter() - t_tick)
+    total = time.perf_counter() - t0
+    db.conn.close()
+    return total, stalls
+
+
+def por_lotes(db_file, n, ticks, batch_size, flush_ms, synchronous):
+    data_queue = cola.IngestQueue(max(n, 1))
+    ui_queue = queue.Queue()
+    DataBase(db_file, synchronous=synchronous).conn.close()
+    writer = DataBaseWriter(db_file, data_queue, ui_queue, batch_size=batch_size, flush_ms=flush_ms,
+                            synchronous=synchronous)
+    writer.start()
+    rows = list(lecturas(n))
+    por_tick = max(n // ticks, 1)
+    # Lotes por dispositivo, como los arma el parser del servidor
+    lotes = [ReadingBatch.from_rows(rows[i:i + por_tick]) for i in range(0, n, por_tick)]
+    stalls = []
+    t0 = time.perf_counter()
+    for batches in lotes:
+        # El servidor pone las lecturas en la cola
+        for batch in batches:
+            data_queue.put(batch)
+        # Tick de la interfaz: solo vacía los lotes ya guardados
+        t_tick = time.perf_counter()
+        while True:
+            try:
+                ui_queue.get_nowait()
+            except queue.Empty:
+                break
+        stalls.append(time.perf_counter() - t_tick)
+    writer.stop()
+    writer.join()
+    total = time.perf_counter() - t0
+    return total, stalls
+
+
+def resumen(nombre, n, total, stalls):
+    stalls_ms = sorted(s * 1000 for s in stalls)
+    print(f"{nombre:>28} {n / total:>10.0f} {sum(stalls_ms):>12.1f} {stalls_ms[-1]:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de escritura en SQLite")
+    parser.add_argument("--filas", type=int, default=20000)
+    parser.add_argument("--ticks", type=int, default=20, help="ticks del timer de la interfaz simulados")
+    parser.add_argument("--batch-size", type=int, default=DB_BATCH_SIZE)
+    parser.add_argument("--flush-ms", type=int, default=DB_FLUSH_MS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'ruta':>28} {'filas/s':>10} {'bloqueo ms':>12} {'máx tick ms':>12}")
+        total, stalls = por_fila(os.path.join(tmp, "fila.db"), args.filas, args.ticks)
+        resumen("commit por fila", args.filas, total, stalls)
+        for synchronous in ("FULL", "NORMAL", "OFF"):
+            total, stalls = por_lotes(os.path.join(tmp, f"lotes_{synchronous}.db"), args.filas, args.ticks,
+                                      args.batch_size, args.flush_ms, synchronous)
+            resumen(f"lotes WAL synchronous={synchronous}", args.filas, total, stalls)
@@ -0,0 +1,337 @@
+# Flota de placas ESP32 simuladas para probar el servidor sin hardware
+#
+# Uso: python benchmarks/simulador_esp32.py --placas 50 --freq-ms 100 --port 8888
+#
+# Cada placa imita a send_data_task y tcp_client_receive_task de bme688.c:
+# se presenta con "HELLO <mac> BIN1 ACK1", pasa al protocolo binario si el
+# servidor responde "PROTO BIN1", queda inactiva hasta recibir START y obedece
+# STOP, MODE1, MODE2, SET_FREQ y SET_WINDOW, confirmando con "ACK <n> OK|ERR"
+# los que llegan como "CMD <n> <comando>". En modo 1 envía "DATA t h" (o registros
+# DATA agrupados en tramas de 1000/freq lecturas, como mucho 16); en modo 2
+# toma ventana/freq lecturas y envía un "STATS" con promedio, máximo y mínimo.
+#
+# Diferencias con el firmware, necesarias para simular cientos de placas en un
+# solo proceso:
+#   - Las lecturas siguen un horario absoluto (cada freq ms con --jitter de
+#     variación); una placa despierta como mucho cada TICK_S y envía de una vez
+#     todo lo que venció, con el device_ms de cada lectura. --freq-ms acepta
+#     fracciones de ms para cargas más altas que las del firmware.
+#   - Si el envío queda bloqueado (el servidor no lee) la placa deja de tomar
+#     lecturas, como el firmware que espera en send(); si se atrasa más de
+#     MAX_ATRASO_S las lecturas atrasadas se cuentan como omitidas en vez de
+#     enviarse en ráfaga.
+#   - --autostart empieza a medir sin esperar START.
+#   - --sordas N: las primeras N placas anuncian ACK1 pero ignoran los
+#     comandos, como una placa colgada con la conexión abierta.
+#
+# Al terminar (--duracion, Ctrl+C o SIGTERM) escribe un resumen; con --json es
+# una sola línea JSON, que es lo que usa bench_flota.py.
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import protocolo
+
+TICK_S = 0.005          # Una placa despierta como mucho cada 5 ms
+MAX_ATRASO_S = 1.0      # Atraso máximo antes de omitir lecturas
+BIN_MAX_LOTE = 16       # Registros DATA por trama como máximo, como en el firmware
+RECONEXION_S = 1.0      # Espera antes de reconectar si el servidor cierra la conexión
+
+
+class PlacaSimulada:
+    def __init__(self, index, host, port, freq_ms=1000, ventana_ms=5000, modo=1, jitter=0.0,
+                 binario=True, autostart=False, semilla=None, sorda=False):
+        self.host = host
+        self.port = port
+        self.random = random.Random(None if semilla is None else semilla + index)
+        self.mac = "246f28%06x" % (index & 0xFFFFFF)
+        # Estado del firmware
+        self.monitoreo_activo = autostart
+        self.modo_operacion = modo
+        self.frecuencia_muestreo = freq_ms
+        self.ventana_tiempo = ventana_ms
+        self.soporta_binario = binario
+        self.sorda = sorda
+        self.protocolo_binario = False
+        self.bin_records = []
+        self.bin_seq = 0
+        self.ventana = None     # Lecturas de la ventana de modo 2 en curso
+        self.jitter = jitter
+        self.boot = time.monotonic() - self.random.uniform(0, 3600)
+        self.temperatura = self.random.uniform(18.0, 26.0)
+        self.humedad = self.random.uniform(40.0, 70.0)
+        self.writer = None
+        # Contadores
+        self.data_enviadas = 0
+        self.stats_enviadas = 0
+        self.omitidas = 0
+        self.bytes_enviados = 0
+        self.comandos = {}
+        self.conexiones = 0
+
+    def leer_sensor(self):
+        # Caminata aleatoria acotada, para que los promedios y extremos varíen
+        self.temperatura = min(max(self.temperatura + self.random.gauss(0, 0.05), -40.0), 85.0)
+        self.humedad = min(max(self.humedad + self.random.gauss(0, 0.1), 0.0), 100.0)
+        return self.temperatura, self.humedad
+
+    def device_ms(self, t):
+        return int((t - self.boot) * 1000) & 0xFFFFFFFF
+
+    def intervalo(self):
+        periodo = self.frecuencia_muestreo / 1000.0
+        if self.jitter:
+            periodo *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(periodo, 0.0)
+
+    def lote_binario(self):
+        return min(max(int(1000 / self.frecuencia_muestreo), 1), BIN_MAX_LOTE)
+
+    def vaciar_binario(self, salida):
+        if self.bin_records:
+            salida.append(protocolo.encode_frame(protocolo.KIND_DATA, self.bin_records))
+            self.bin_records = []
+
+    def tomar_lectura(self, t, salida):
+        # Una vuelta de send_data_task con el monitoreo activo
+        temperatura, humedad = self.leer_sensor()
+        if self.ventana is None and self.modo_operacion == 1:
+            if self.protocolo_binario:
+                self.bin_records.append((self.bin_seq, self.device_ms(t), round(temperatura * 100),
+                                         round(humedad * 100)))
+                self.bin_seq = (self.bin_seq + 1) & 0xFFFFFFFF
+                if len(self.bin_records) >= self.lote_binario():
+                    self.vaciar_binario(salida)
+            else:
+                salida.append(b"DATA %.2f %.2f\n" % (temperatura, humedad))
+            self.data_enviadas += 1
+            return
+        if self.ventana is None:
+            # Empieza una ventana de modo 2; el firmware la completa aunque cambie el modo
+            self.vaciar_binario(salida)
+            self.ventana = ([], max(int(self.ventana_tiempo // self.frecuencia_muestreo), 1))
+        lecturas, total = self.ventana
+        lecturas.append((temperatura, humedad))
+        if len(lecturas) < total:
+            return
+        self.ventana = None
+        temps = [lectura[0] for lectura in lecturas]
+        hums = [lectura[1] for lectura in lecturas]
+        valores = (sum(temps) / total, max(temps), min(temps), sum(hums) / total, max(hums), min(hums))
+        if self.protocolo_binario:
+            record = (self.bin_seq, self.device_ms(t)) + tuple(round(v * 100) for v in valores)
+            self.bin_seq = (self.bin_seq + 1) & 0xFFFFFFFF
+            salida.append(protocolo.encode_frame(protocolo.KIND_STATS, [record]))
+        else:
+            salida.append(b"STATS %.2f %.2f %.2f %.2f %.2f %.2f\n" % valores)
+        self.stats_enviadas += 1
+
+    def procesar_comando(self, command):
+        # Mismos comandos que procesar_comando() del firmware; False si no se conoce
+        nombre = command.split(" ", 1)[0] if command else ""
+        self.comandos[nombre] = self.comandos.get(nombre, 0) + 1
+        if command == "START":
+            self.monitoreo_activo = True
+        elif command == "STOP":
+            self.monitoreo_activo = False
+        elif command.startswith("SET_FREQ "):
+            freq = _atoi(command[9:])
+            if freq > 0:
+                self.frecuencia_muestreo = freq
+        elif command == "MODE1":
+            self.modo_operacion = 1
+        elif command == "MODE2":
+            self.modo_operacion = 2
+        elif command == "PROTO BIN1":
+            self.protocolo_binario = self.soporta_binario
+        elif command.startswith("SET_WINDOW "):
+            window = _atoi(command[11:])
+            if window > 0:
+                self.ventana_tiempo = window
+        else:
+            return False
+        return True
+
+    async def recibir(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if self.sorda:
+                continue
+            command = line.decode(errors='replace').rstrip("\r\n")
+            # "CMD <n> <comando>" -> "ACK <n> OK|ERR", como tcp_client_receive_task
+            partes = command.split(" ", 2)
+            if len(partes) == 3 and partes[0] == "CMD" and partes[1].isdigit():
+                conocido = self.procesar_comando(partes[2])
+                self.writer.write(b"ACK %s %s\n" % (partes[1].encode(), b"OK" if conocido else b"ERR"))
+            else:
+                self.procesar_comando(command)
+
+    async def enviar(self):
+        proxima = time.monotonic()
+        while True:
+            if not self.monitoreo_activo and self.ventana is None:
+                salida = []
+                self.vaciar_binario(salida)
+                if salida:
+                    await self.escribir(salida)
+                await asyncio.sleep(0.1)
+                proxima = time.monotonic()
+                continue
+            ahora = time.monotonic()
+            if ahora - proxima > MAX_ATRASO_S:
+                # Bloqueada en send(): estas lecturas nunca se tomaron
+                self.omitidas += int((ahora - proxima) * 1000 / self.frecuencia_muestreo)
+                proxima = ahora
+            salida = []
+            while proxima <= ahora and (self.monitoreo_activo or self.ventana is not None):
+                self.tomar_lectura(proxima, salida)
+                proxima += self.intervalo()
+            if salida:
+                await self.escribir(salida)
+            espera = proxima - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(max(espera, TICK_S))
+
+    async def escribir(self, salida):
+        data = b"".join(salida)
+        self.writer.write(data)
+        self.bytes_enviados += len(data)
+        await self.writer.drain()
+
+    async def run(self):
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(RECONEXION_S)
+                continue
+            self.conexiones += 1
+            # Cada conexión empieza en texto, como después de un reinicio de la tarea
+            self.protocolo_binario = False
+            self.bin_records = []
+            hello = f"HELLO {self.mac} BIN1 ACK1\n" if self.soporta_binario else f"HELLO {self.mac} ACK1\n"
+            self.writer.write(hello.encode())
+            tasks = [asyncio.ensure_future(self.recibir(reader)), asyncio.ensure_future(self.enviar())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self.writer.close()
+            for task in tasks:
+                if not task.cancelled() and task.exception() is not None \
+                        and not isinstance(task.exception(), OSError):
+                    raise task.exception()
+            await asyncio.sleep(RECONEXION_S)
+
+    def resumen(self):
+        return {
+            "id": self.mac,
+            "data": self.data_enviadas,
+            "stats": self.stats_enviadas,
+            "omitidas": self.omitidas,
+            "bytes": self.bytes_enviados,
+            "conexiones": self.conexiones,
+            "comandos": self.comandos,
+        }
+
+
+def _atoi(text):
+    # atoi() de C: dígitos iniciales, 0 si no hay
+    text = text.strip()
+    digits = ""
+    for i, char in enumerate(text):
+        if char.isdigit() or (i == 0 and char in "+-"):
+            digits += char
+        else:
+            break
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+def crear_flota(args):
+    return [PlacaSimulada(i, args.host, args.port, freq_ms=args.freq_ms, ventana_ms=args.ventana_ms,
+                          modo=args.modo, jitter=args.jitter, binario=not args.texto,
+                          autostart=args.autostart, semilla=args.semilla, sorda=i < args.sordas)
+            for i in range(args.placas)]
+
+
+async def correr_flota(placas, duracion, conexiones_por_s=0):
+    loop = asyncio.get_running_loop()
+    detener = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, detener.set)
+    tasks = []
+    for placa in placas:
+        tasks.append(asyncio.ensure_future(placa.run()))
+        if conexiones_por_s:
+            # Conectar de a poco, como placas que arrancan en distintos momentos
+            await asyncio.sleep(1 / conexiones_por_s)
+    t0 = time.monotonic()
+    esperar = [asyncio.ensure_future(detener.wait())] + tasks
+    try:
+        await asyncio.wait(esperar, timeout=duracion or None, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in esperar:
+            task.cancel()
+        await asyncio.gather(*esperar, return_exceptions=True)
+    return time.monotonic() - t0
+
+
+def resumen_flota(placas, duracion):
+    resumenes = [placa.resumen() for placa in placas]
+    total = {key: sum(r[key] for r in resumenes) for key in ("data", "stats", "omitidas", "bytes", "conexiones")}
+    comandos = {}
+    for r in resumenes:
+        for nombre, count in r["comandos"].items():
+            comandos[nombre] = comandos.get(nombre, 0) + count
+    total["comandos"] = comandos
+    total["placas"] = len(placas)
+    total["duracion_s"] = duracion
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flota de placas ESP32 simuladas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--placas", type=int, default=10)
+    parser.add_argument("--freq-ms", type=float, default=1000, help="ms entre lecturas (SET_FREQ inicial)")
+    parser.add_argument("--ventana-ms", type=int, default=5000, help="ventana del modo 2 (SET_WINDOW inicial)")
+    parser.add_argument("--modo", type=int, choices=[1, 2], default=1)
+    parser.add_argument("--jitter", type=float, default=0.05,
+                        help="variación aleatoria de cada intervalo, como fracción de freq")
+    parser.add_argument("--texto", action="store_true", help="firmware sin protocolo binario (HELLO sin BIN1)")
+    parser.add_argument("--autostart", action="store_true", help="empezar a enviar sin esperar START")
+    parser.add_argument("--sordas", type=int, default=0, help="placas que no responden a los comandos")
+    parser.add_argument("--conexiones-por-s", type=float, default=0,
+                        help="ritmo de conexión de las placas; 0 las conecta todas de una vez")
+    parser.add_argument("--duracion", type=float, default=0, help="segundos; 0 hasta Ctrl+C")
+    parser.add_argument("--semilla", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="resumen como una línea JSON")
+    args = parser.parse_args()
+    if args.freq_ms <= 0 or not math.isfinite(args.freq_ms):
+        parser.error("--freq-ms debe ser mayor que 0")
+
+    placas = crear_flota(args)
+    duracion = asyncio.run(correr_flota(placas, args.duracion, args.conexiones_por_s))
+    resumen = resumen_flota(placas, duracion)
+    if args.json:
+        print(json.dumps(resumen), flush=True)
+    else:
+        print(f"{resumen['placas']} placas durante {duracion:.1f} s: {resumen['data']} DATA, "
+              f"{resumen['stats']} STATS, {resumen['omitidas']} omitidas, {resumen['bytes']} bytes, "
+              f"{resumen['conexiones']} conexiones, comandos {resumen['comandos']}")
@@ -0,0 +1,261 @@
+# Bitácora en disco entre el servidor TCP y el hilo escritor
+#
+# Con IngestQueue las lecturas que esperan al escritor están solo en memoria:
+# si el proceso muere, o si SQLite falla justo al cerrar, se pierden, y con la
+# política block un SQLite bloqueado frena la lectura de los sockets.
+# SpoolQueue tiene la misma interfaz pero cada lote se agrega, apenas se
+# recibe, a un registro de solo agregado repartido en segmentos de
+# SPOOL_SEGMENT_SIZE bytes mapeados en memoria (mmap): escribir es copiar unos
+# cientos de bytes, sin syscalls. El escritor lee los lotes desde los mismos
+# segmentos y guarda en SQLite, en la misma transacción que las lecturas, hasta
+# dónde llegó (checkpoint); los segmentos anteriores al checkpoint se borran.
+#
+# Al arrancar se retoma desde el checkpoint de la base de datos: lo que siga en
+# los segmentos se vuelve a encolar y se escribe una sola vez. Lo escrito en el
+# mmap sobrevive a que el proceso muera; ante un corte de luz se conserva
+# hasta el último sync() (cada SPOOL_SYNC_S, desde el hilo escritor).
+#
+# Cada registro es una cabecera RECORD (crc32, lecturas, largo del device_id,
+# time_ns al agregarlo), el device_id en UTF-8 y las lecturas en READING_DTYPE
+# tal como están en memoria. La cabecera se escribe al final: un registro a
+# medio escribir queda con la cabecera en cero, que marca el fin de los datos.
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import cola
+import metricas
+from lecturas import READING_DTYPE, ReadingBatch
+
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024   # Bytes por segmento (~340000 lecturas)
+SPOOL_SIZE = 5000000                    # Lecturas pendientes como máximo (~250 MB en disco)
+SPOOL_SYNC_S = 1.0                      # Cada cuánto se hace msync de los segmentos nuevos
+SEGMENT_SUFFIX = ".seg"
+RECORD = struct.Struct("<IIHq")         # crc32, lecturas, largo del device_id, time_ns
+NO_DEVICE = 0xFFFF                      # Largo del device_id cuando es None
+
+log = logging.getLogger(__name__)
+
+
+class SpoolQueue(cola.IngestQueue):
+    # Llena, espera como "block" (y con put(block=False) pausa al productor igual)
+    policies = ("spool",)
+
+    def __init__(self, directory, checkpoint=None, maxsize=SPOOL_SIZE, segment_size=SPOOL_SEGMENT_SIZE,
+                 sync_interval=SPOOL_SYNC_S):
+        # checkpoint: (segmento, offset) guardado en la base de datos, None si no hay
+        cola.IngestQueue.__init__(self, maxsize, "spool")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        self.segments = {}      # índice -> mmap de los segmentos que aún no se confirmaron
+        self.ends = {}          # índice -> fin de los datos de los segmentos ya cerrados
+        self.recovered = 0
+        self.synced_index = 0
+        self.synced_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._recover(checkpoint)
+        metricas.REGISTRY.gauge("spool_segments", "Segmentos de la bitácora en disco", lambda: len(self.segments))
+
+    def _path(self, index):
+        return os.path.join(self.directory, f"{index:010d}{SEGMENT_SUFFIX}")
+
+    def _map(self, index, create=False):
+        with open(self._path(index), "w+b" if create else "r+b") as f:
+            if create:
+                f.truncate(self.segment_size)
+            return mmap.mmap(f.fileno(), 0)
+
+    def _recover(self, checkpoint):
+        indices = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                         if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        start, offset = checkpoint if checkpoint else (indices[0] if indices else 0, 0)
+        read_pos = None
+        for index in indices:
+            if index < start:
+                # Ya estaba confirmado en la base de datos
+                os.remove(self._path(index))
+                continue
+            mm = self._map(index)
+            begin = offset if index == start else 0
+            end, count = self._scan(mm, begin, index)
+            self.segments[index] = mm
+            self.ends[index] = end
+            self.depth += count
+            if read_pos is None:
+                read_pos = (index, begin)
+        # Siempre se escribe en un segmento nuevo, nunca después de un registro a medio escribir
+        self.write_index = max(indices + [start - 1]) + 1
+        self.write_offset = 0
+        self.segments[self.write_index] = self._map(self.write_index, create=True)
+        self.read_pos = read_pos or (self.write_index, 0)
+        self.synced_index = self.write_index
+        self.recovered = self.depth
+        if self.depth:
+            log.info("Bitácora: %d lecturas sin guardar de la ejecución anterior en %d segmento(s)",
+                     self.depth, len(self.segments) - 1)
+
+    def _scan(self, mm, offset, index):
+        # Recorre los registros válidos desde offset: (fin de los datos, lecturas)
+        count = 0
+        while offset + RECORD.size <= len(mm):
+            crc, n, length, _ = RECORD.unpack_from(mm, offset)
+            if n == 0:
+                break
+            size = RECORD.size + (0 if length == NO_DEVICE else length) + n * READING_DTYPE.itemsize
+            if offset + size > len(mm) or zlib.crc32(mm[offset + 4:offset + size]) != crc:
+                log.warning("Bitácora: registro incompleto en el segmento %d (offset %d), se descarta lo que "
+                            "sigue en ese segmento", index, offset)
+                break
+            count += n
+            offset += size
+        return offset, count
+
+    def put(self, batch, block=True):
+        # Agrega el lote al final de la bitácora; si está llena espera o, con
+        # block=False, lo agrega igual y devuelve False (como IngestQueue.put)
+        now = time.time_ns()
+        with self.lock:
+            while self.depth >= self.maxsize and not self.closed:
+                if not block:
+                    self._pause()
+                    break
+                t0 = time.monotonic()
+                self.not_full.wait()
+                self.blocked_s += time.monotonic() - t0
+            if self.closed:
+                self.dropped += len(batch)
+                return True
+            self._append(batch, now)
+            self.put_count += len(batch)
+            self.max_depth = max(self.max_depth, self.depth)
+            self.not_empty.notify()
+            return not self.paused
+
+    def _append(self, batch, now):
+        device = b"" if batch.device_id is None else batch.device_id.encode()
+        length = NO_DEVICE if batch.device_id is None else len(device)
+        # Un lote que no entra en un segmento vacío se parte
+        fits = (self.segment_size - RECORD.size - len(device)) // READING_DTYPE.itemsize
+        for start in range(0, len(batch), fits):
+            data = batch.data[start:start + fits]
+            size = RECORD.size + len(device) + len(data) * READING_DTYPE.itemsize
+            if self.write_offset + size > self.segment_size:
+                self._roll()
+            mm = self.segments[self.write_index]
+            offset = self.write_offset
+            payload = data.tobytes()
+            header = RECORD.pack(0, len(data), length, now)
+            mm[offset + RECORD.size:offset + RECORD.size + len(device)] = device
+            mm[offset + RECORD.size + len(device):offset + size] = payload
+            crc = zlib.crc32(payload, zlib.crc32(device, zlib.crc32(header[4:])))
+            RECORD.pack_into(mm, offset, crc, len(data), length, now)
+            self.write_offset += size
+            self.depth += len(data)
+
+    def _roll(self):
+        self.ends[self.write_index] = self.write_offset
+        self.write_index += 1
+        self.write_offset = 0
+        self.segments[self.write_index] = self._map(self.write_index, create=True)
+
+    def _read(self):
+        # Siguiente registro desde read_pos: (ReadingBatch, time_ns al agregarlo)
+        index, offset = self.read_pos
+        while index != self.write_index and offset >= self.ends[index]:
+            index += 1
+            offset = 0
+        mm = self.segments[index]
+        _, n, length, appended = RECORD.unpack_from(mm, offset)
+        offset += RECORD.size
+        device_id = None
+        if length != NO_DEVICE:
+            device_id = mm[offset:offset + length].decode()
+            offset += length
+        # Copia: el segmento se cierra y se borra después del checkpoint
+        data = np.frombuffer(mm, READING_DTYPE, n, offset).copy()
+        self.read_pos = (index, offset + n * READING_DTYPE.itemsize)
+        self.depth -= n
+        return ReadingBatch(data, device_id), appended
+
+    def get_batch(self, max_items, timeout=None):
+        # Como IngestQueue.get_batch, pero de a registros enteros: se devuelve al
+        # menos uno aunque tenga más de max_items lecturas
+        with self.lock:
+            if not self.depth and not self.closed:
+                self.not_empty.wait(timeout)
+            if not self.depth or max_items <= 0:
+                return []
+            batches = []
+            count = 0
+            now = time.time_ns()
+            oldest = None
+            while self.depth and count < max_items:
+                batch, appended = self._read()
+                n = len(batch)
+                wait = max(now - appended, 0) / 1e9
+                if oldest is None:
+                    oldest = wait
+                count += n
+                self.latency_sum += wait * n
+                cola.QUEUE_WAIT.record(wait, n)
+                batches.append(batch)
+            self.latency_max = max(self.latency_max, oldest)
+            self.get_count += count
+            self.not_full.notify_all()
+            resume = self._resumed()
+        if resume is not None:
+            resume()
+        return batches
+
+    def drained(self):
+        with self.lock:
+            return self.closed and not self.depth
+
+    def position(self):
+        # Hasta dónde se entregó al escritor: lo que se guarda como checkpoint
+        with self.lock:
+            return self.read_pos
+
+    def checkpoint(self, position):
+        # Lo anterior a position ya está en la base de datos: se borran esos segmentos
+        with self.lock:
+            for index in sorted(self.segments):
+                if index >= position[0]:
+                    break
+                self.segments.pop(index).close()
+                self.ends.pop(index, None)
+                os.remove(self._path(index))
+
+    def sync(self):
+        # msync de los segmentos escritos desde el último sync; se llama desde el
+        # hilo escritor (el mismo que borra segmentos en checkpoint)
+        if time.monotonic() - self.synced_at < self.sync_interval:
+            return
+        with self.lock:
+            maps = [mm for index, mm in self.segments.items() if index >= self.synced_index]
+            self.synced_index = self.write_index
+        for mm in maps:
+            mm.flush()
+        self.synced_at = time.monotonic()
+
+    def close_segments(self):
+        # Al terminar, después de que el escritor vació la cola
+        self.sync_interval = 0
+        self.sync()
+        with self.lock:
+            for mm in self.segments.values():
+                mm.close()
+            self.segments.clear()
+
+    def stats(self):
+        stats = cola.IngestQueue.stats(self)
+        with self.lock:
+            stats["recovered"] = self.recovered
+            stats["segments"] = len(self.segments)
+        return stats
@@ -11,9 +11,11 @@
 #include "esp_log.h"
 #include "esp_netif.h"
 #include "esp_system.h"
+#include "esp_timer.h"
 #include "esp_wifi.h"
 #include "freertos/FreeRTOS.h"
 #include "freertos/event_groups.h"
+#include "freertos/semphr.h"
 #include "freertos/task.h"
 #include "lwip/err.h"
 #include "lwip/netdb.h"
@@ -48,12 +50,39 @@
 #define SERVER_IP "192.168.4.1"  // Dirección IP de la Raspberry Pi
 #define SERVER_PORT 8888         // Puerto donde está escuchando el servidor en la Raspberry Pi
 
+// Protocolo binario (ver protocolo.py en la Raspberry Pi)
+#define BIN_MAGIC 0xB5
+#define BIN_KIND_DATA 1
+#define BIN_KIND_STATS 2
+#define BIN_MAX_LOTE 16  // Registros DATA por trama como máximo
+
+typedef struct __attribute__((packed)) {
+    uint8_t magic;
+    uint8_t kind;
+    uint16_t count;
+} bin_header_t;
+
+typedef struct __attribute__((packed)) {
+    uint32_t seq;
+    uint32_t device_ms;
+    int16_t temp;  // centésimas de grado
+    uint16_t hum;  // centésimas de %
+} bin_data_t;
+
+typedef struct __attribute__((packed)) {
+    uint32_t seq;
+    uint32_t device_ms;
+    int16_t valores[6];  // temp avg/max/min, hum avg/max/min en centésimas
+} bin_stats_t;
+
 // WiFi event group
 static EventGroupHandle_t s_wifi_event_group;
 const int WIFI_CONNECTED_BIT = BIT0;
 
 // TCP socket
 static int sock = -1;
+// send() desde dos tareas: los datos y los ACK de los comandos
+static SemaphoreHandle_t envio_mutex = NULL;
 
 esp_err_t ret = ESP_OK;
 esp_err_t ret2 = ESP_OK;
@@ -66,6 +95,12 @@ volatile bool monitoreo_activo = false;
 volatile int modo_operacion = 1;         // 1: Modo Datos en Bruto, 2: Modo Datos Procesados
 volatile int frecuencia_muestreo = 1000; // en milisegundos
 volatile int ventana_tiempo = 5000;      // en milisegundos
+volatile bool protocolo_binario = false; // Se activa cuando el servidor responde "PROTO BIN1"
+
+// Trama binaria en construcción
+static uint8_t bin_buffer[sizeof(bin_header_t) + BIN_MAX_LOTE * sizeof(bin_data_t)];
+static int bin_count = 0;
+static uint32_t bin_seq = 0;
 
 static const char *TAG = "ESP32_TCP_CLIENT";
 
@@ -518,6 +553,14 @@ void tcp_client_task(void *pvParameters) {
 
         ESP_LOGI(TAG, "Conectado al servidor");
 
+        // Presentarse con la MAC para que el servidor pueda distinguir cada placa
+        uint8_t mac[6];
+        esp_wifi_get_mac(WIFI_IF_STA, mac);
+        char hello[40];
+        int hello_len = snprintf(hello, sizeof(hello), "HELLO %02x%02x%02x%02x%02x%02x BIN1 ACK1\n",
+                                 mac[0], mac[1], mac[2], mac[3], mac[4], mac[5]);
+        send(sock, hello, hello_len, 0);
+
         // Aquí puedes agregar código para enviar/recibir datos
         xTaskCreate(tcp_client_receive_task, "tcp_client_receive_task", 4096, NULL, 5, NULL);
         xTaskCreate(send_data_task, "send_data_task", 4096, NULL, 5, NULL);
@@ -528,6 +571,50 @@ void tcp_client_task(void *pvParameters) {
     vTaskDelete(NULL);
 }
 
+// Aplica un comando del servidor; false si no se conoce
+static bool procesar_comando(const char *command) {
+    if (strcmp(command, "START") == 0) {
+        monitoreo_activo = true;
+        ESP_LOGI(TAG, "Monitoreo iniciado");
+    } else if (strcmp(command, "STOP") == 0) {
+        monitoreo_activo = false;
+        ESP_LOGI(TAG, "Monitoreo detenido");
+    } else if (strncmp(command, "SET_FREQ ", 9) == 0) {
+        int freq = atoi(command + 9);
+        if (freq > 0) {
+            frecuencia_muestreo = freq;
+            ESP_LOGI(TAG, "Frecuencia de muestreo establecida en %d ms", frecuencia_muestreo);
+        }
+    } else if (strcmp(command, "MODE1") == 0) {
+        modo_operacion = 1;
+        ESP_LOGI(TAG, "Modo 1 (Datos en Bruto) activado");
+    } else if (strcmp(command, "MODE2") == 0) {
+        modo_operacion = 2;
+        ESP_LOGI(TAG, "Modo 2 (Datos Procesados) activado");
+    } else if (strcmp(command, "PROTO BIN1") == 0) {
+        protocolo_binario = true;
+        ESP_LOGI(TAG, "Protocolo binario activado");
+    } else if (strncmp(command, "SET_WINDOW ", 11) == 0) {
+        int window = atoi(command + 11);
+        if (window > 0) {
+            ventana_tiempo = window;
+            ESP_LOGI(TAG, "Ventana de tiempo establecida en %d ms", ventana_tiempo);
+        }
+    } else {
+        ESP_LOGW(TAG, "Comando desconocido: %s", command);
+        return false;
+    }
+    return true;
+}
+
+// send() con el socket compartido entre send_data_task y tcp_client_receive_task
+static int enviar(const void *data, int len) {
+    xSemaphoreTake(envio_mutex, portMAX_DELAY);
+    int err = send(sock, data, len, 0);
+    xSemaphoreGive(envio_mutex);
+    return err;
+}
+
 void tcp_client_receive_task(void *pvParameters) {
     char rx_buffer[128];
     char recv_buffer[256];  // Buffer para acumular datos
@@ -567,33 +654,25 @@ void tcp_client_receive_task(void *pvParameters) {
 
                 ESP_LOGI(TAG, "Comando recibido: %s", command);
 
-                // Procesar comando
-                if (strcmp(command, "START") == 0) {
-                    monitoreo_activo = true;
-                    ESP_LOGI(TAG, "Monitoreo iniciado");
-                } else if (strcmp(command, "STOP") == 0) {
-                    monitoreo_activo = false;
-                    ESP_LOGI(TAG, "Monitoreo detenido");
-                } else if (strncmp(command, "SET_FREQ ", 9) == 0) {
-                    int freq = atoi(command + 9);
-                    if (freq > 0) {
-                        frecuencia_muestreo = freq;
-                        ESP_LOGI(TAG, "Frecuencia de muestreo establecida en %d ms", frecuencia_muestreo);
+                // "CMD <n> <comando>": el servidor espera "ACK <n> OK" (o ERR si no se conoce)
+                unsigned long ack_id = 0;
+                bool confirmar = false;
+                if (strncmp(command, "CMD ", 4) == 0) {
+                    char *fin;
+                    ack_id = strtoul(command + 4, &fin, 10);
+                    if (*fin == ' ') {
+                        confirmar = true;
+                        command = fin + 1;
                     }
-                } else if (strcmp(command, "MODE1") == 0) {
-                    modo_operacion = 1;
-                    ESP_LOGI(TAG, "Modo 1 (Datos en Bruto) activado");
-                } else if (strcmp(command, "MODE2") == 0) {
-                    modo_operacion = 2;
-                    ESP_LOGI(TAG, "Modo 2 (Datos Procesados) activado");
-                } else if (strncmp(command, "SET_WINDOW ", 11) == 0) {
-                    int window = atoi(command + 11);
-                    if (window > 0) {
-                        ventana_tiempo = window;
-                        ESP_LOGI(TAG, "Ventana de tiempo establecida en %d ms", ventana_tiempo);
+                }
+
+                bool conocido = procesar_comando(command);
+                if (confirmar) {
+                    char ack[32];
+                    int ack_len = snprintf(ack, sizeof(ack), "ACK %lu %s\n", ack_id, conocido ? "OK" : "ERR");
+                    if (enviar(ack, ack_len) < 0) {
+                        ESP_LOGE(TAG, "Error al enviar ACK: errno %d", errno);
                     }
-                } else {
-                    ESP_LOGW(TAG, "Comando desconocido: %s", command);
                 }
 
                 // Mover al inicio de la siguiente línea
@@ -615,10 +694,70 @@ void tcp_client_receive_task(void *pvParameters) {
     vTaskDelete(NULL);
 }
 
+static uint32_t device_ms(void) {
+    return (uint32_t)(esp_timer_get_time() / 1000);
+}
+
+// Envía la trama DATA acumulada, si hay registros pendientes
+static void enviar_lote_binario(void) {
+    if (bin_count == 0) {
+        return;
+    }
+    bin_header_t *header = (bin_header_t *)bin_buffer;
+    header->magic = BIN_MAGIC;
+    header->kind = BIN_KIND_DATA;
+    header->count = bin_count;
+    int len = sizeof(bin_header_t) + bin_count * sizeof(bin_data_t);
+    int err = enviar(bin_buffer, len);
+    if (err < 0) {
+        ESP_LOGE(TAG, "Error al enviar datos: errno %d", errno);
+    }
+    bin_count = 0;
+}
+
+// Agrega una lectura a la trama; se envía aproximadamente una trama por segundo
+static void agregar_lectura_binaria(float temperatura, float humedad) {
+    bin_data_t *record = (bin_data_t *)(bin_buffer + sizeof(bin_header_t)) + bin_count;
+    record->seq = bin_seq++;
+    record->device_ms = device_ms();
+    record->temp = (int16_t)lroundf(temperatura * 100);
+    record->hum = (uint16_t)lroundf(humedad * 100);
+    bin_count++;
+
+    int lote = 1000 / frecuencia_muestreo;
+    if (lote < 1) lote = 1;
+    if (lote > BIN_MAX_LOTE) lote = BIN_MAX_LOTE;
+    if (bin_count >= lote) {
+        enviar_lote_binario();
+    }
+}
+
+static void enviar_stats_binario(float valores[6]) {
+    struct __attribute__((packed)) {
+        bin_header_t header;
+        bin_stats_t record;
+    } trama;
+    trama.header.magic = BIN_MAGIC;
+    trama.header.kind = BIN_KIND_STATS;
+    trama.header.count = 1;
+    trama.record.seq = bin_seq++;
+    trama.record.device_ms = device_ms();
+    for (int i = 0; i < 6; i++) {
+        trama.record.valores[i] = (int16_t)lroundf(valores[i] * 100);
+    }
+    int err = enviar(&trama, sizeof(trama));
+    if (err < 0) {
+        ESP_LOGE(TAG, "Error al enviar datos: errno %d", errno);
+    }
+}
+
 void send_data_task(void *pvParameters) {
     while (1) {
         if (monitoreo_activo) {
-            if (modo_operacion == 1) {
+            if (modo_operacion == 1 && protocolo_binario) {
+                agregar_lectura_binaria(leer_temperatura(), leer_humedad());
+                vTaskDelay(frecuencia_muestreo / portTICK_PERIOD_MS);
+            } else if (modo_operacion == 1) {
                 // Leer datos del sensor
                 float temperatura = leer_temperatura();
                 float humedad = leer_humedad();
@@ -626,12 +765,14 @@ void send_data_task(void *pvParameters) {
                 char data_buffer[128];
                 int len = snprintf(data_buffer, sizeof(data_buffer), "DATA %.2f %.2f\n", temperatura, humedad);
                 ESP_LOGI(TAG, "Enviando datos: %s", data_buffer);  // Mensaje de log
-                int err = send(sock, data_buffer, len, 0);
+                int err = enviar(data_buffer, len);
                 if (err < 0) {
                     ESP_LOGE(TAG, "Error al enviar datos: errno %d", errno);
                 }
                 vTaskDelay(frecuencia_muestreo / portTICK_PERIOD_MS);
             } else if (modo_operacion == 2) {
+                // No dejar lecturas del modo 1 esperando en la trama
+                enviar_lote_binario();
                 // Acumular datos durante ventana_tiempo
                 int num_lecturas = ventana_tiempo / frecuencia_muestreo;
                 float temp_total = 0, temp_max = -FLT_MAX, temp_min = FLT_MAX;
@@ -655,6 +796,12 @@ void send_data_task(void *pvParameters) {
                 float temp_promedio = temp_total / num_lecturas;
                 float hum_promedio = hum_total / num_lecturas;
 
+                if (protocolo_binario) {
+                    float valores[6] = {temp_promedio, temp_max, temp_min, hum_promedio, hum_max, hum_min};
+                    enviar_stats_binario(valores);
+                    continue;
+                }
+
                 // Enviar datos procesados
                 char data_buffer[256];
                 int len = snprintf(data_buffer, sizeof(data_buffer),
@@ -662,12 +809,13 @@ void send_data_task(void *pvParameters) {
                                    temp_promedio, temp_max, temp_min,
                                    hum_promedio, hum_max, hum_min);
                 ESP_LOGI(TAG, "Enviando datos: %s", data_buffer);  // Mensaje de log
-                int err = send(sock, data_buffer, len, 0);
+                int err = enviar(data_buffer, len);
                 if (err < 0) {
                     ESP_LOGE(TAG, "Error al enviar datos: errno %d", errno);
                 }
             }
         } else {
+            enviar_lote_binario();
             vTaskDelay(100 / portTICK_PERIOD_MS);
         }
     }
@@ -683,6 +831,8 @@ void app_main(void) {
     }
     ESP_ERROR_CHECK(ret);
 
+    envio_mutex = xSemaphoreCreateMutex();
+
     // Inicializar sensor
     ESP_ERROR_CHECK(sensor_init());
     bme_get_chipid();
@@ -0,0 +1,136 @@
+# Caché en memoria de las lecturas recientes, por dispositivo y por modo
+#
+# Cada combinación (dispositivo, modo) tiene un buffer circular de arreglos
+# NumPy de capacidad fija: el servidor escribe en él apenas procesa un lote y
+# la interfaz lee de él, sin pasar por SQLite. La base de datos solo se
+# consulta cuando se piden más lecturas de las que caben en el buffer.
+import threading
+
+import numpy as np
+
+from lecturas import MODE_FIELDS, ReadingBatch
+
+CACHE_CAPACITY = 3600  # Lecturas por dispositivo y modo (1 hora a 1 lectura por segundo)
+
+
+# Buffer circular de timestamps (float64) y valores (float32)
+class RingBuffer:
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, width), dtype=np.float32)
+        self.head = 0   # Próxima posición a escribir
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, timestamps, values):
+        n = len(timestamps)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            # Solo entran las últimas "capacity" lecturas
+            timestamps = timestamps[-self.capacity:]
+            values = values[-self.capacity:]
+            n = self.capacity
+        first = min(n, self.capacity - self.head)
+        self.timestamps[self.head:self.head + first] = timestamps[:first]
+        self.values[self.head:self.head + first] = values[:first]
+        rest = n - first
+        if rest:
+            self.timestamps[:rest] = timestamps[first:]
+            self.values[:rest] = values[first:]
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def last(self, n=None):
+        # Copia de las últimas n lecturas en orden cronológico
+        n = self.size if n is None else min(n, self.size)
+        start = (self.head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.timestamps[start:start + n].copy(), self.values[start:start + n].copy()
+        index = np.arange(start, start + n) % self.capacity
+        return self.timestamps[index], self.values[index]
+
+
+class HotCache:
+    def __init__(self, capacity=CACHE_CAPACITY):
+        self.capacity = capacity
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def add(self, batch):
+        # Agrega un ReadingBatch (el mismo que va a la cola de datos), copiando las
+        # columnas de cada modo a su buffer
+        data = batch.data
+        modes = data["mode"]
+        with self.lock:
+            for mode, names in MODE_FIELDS.items():
+                rows = data[modes == mode]
+                if not len(rows):
+                    continue
+                buffer = self.buffers.get((batch.device_id, mode))
+                if buffer is None:
+                    buffer = self.buffers[(batch.device_id, mode)] = RingBuffer(self.capacity, len(names))
+                values = np.column_stack([rows[name] for name in names])
+                buffer.extend(rows["timestamp"] / 1e9, values)
+
+    def load_rows(self, rows):
+        # Carga filas leídas de SQLite, p. ej. al iniciar
+        for batch in ReadingBatch.from_rows(rows):
+            self.add(batch)
+
+    def devices(self):
+        with self.lock:
+            return sorted({device_id for device_id, _ in self.buffers}, key=str)
+
+    def last(self, device_id, mode, n=None):
+        with self.lock:
+            buffer = self.buffers.get((device_id, mode))
+            if buffer is None:
+                width = len(MODE_FIELDS[mode])
+                return np.zeros(0), np.zeros((0, width), dtype=np.float32)
+            return buffer.last(n)
+
+    def series(self, n, device_id=None, db=None):
+        # Últimos n puntos (timestamp, temperatura, humedad) para graficar; en modo 2
+        # se usa el promedio. Sin device_id se mezclan todos los dispositivos.
+        # Si el caché tiene menos de n puntos y se pasa db, se completa con SQLite.
+        parts = []
+        evicted = False
+        with self.lock:
+            for (buffer_device, mode), buffer in self.buffers.items():
+                if device_id is not None and buffer_device != device_id:
+                    continue
+                timestamps, values = buffer.last(n)
+                # Temperatura y humedad (o sus promedios) son las columnas 0 y 1 / 0 y 3
+                hum_column = 1 if mode == 1 else 3
+                parts.append((timestamps, values[:, 0], values[:, hum_column]))
+                evicted = evicted or buffer.size == buffer.capacity
+        if parts:
+            timestamps = np.concatenate([p[0] for p in parts])
+            temperatures = np.concatenate([p[1] for p in parts])
+            humidities = np.concatenate([p[2] for p in parts])
+            if len(parts) > 1:
+                order = np.argsort(timestamps, kind='stable')[-n:]
+                timestamps, temperatures, humidities = timestamps[order], temperatures[order], humidities[order]
+        else:
+            timestamps = np.zeros(0)
+            temperatures = humidities = np.zeros(0, dtype=np.float32)
+
+        # Historia anterior al caché: solo si algún buffer ya descartó lecturas
+        missing = n - len(timestamps)
+        if db is not None and missing > 0 and evicted:
+            rows = db.fetch_last_data(missing, device_id=device_id, before=timestamps[0])
+            if rows:
+                # Una sola conversión de las tuplas a un arreglo (None -> NaN)
+                old = np.array([row[:10] for row in rows], dtype=float)
+                raw = old[:, 9] == 1
+                old_ts = old[:, 0]
+                old_temp = np.where(raw, old[:, 1], old[:, 3])
+                old_hum = np.where(raw, old[:, 2], old[:, 6])
+                timestamps = np.concatenate((old_ts, timestamps))
+                temperatures = np.concatenate((old_temp, temperatures))
+                humidities = np.concatenate((old_hum, humidities))
+        return timestamps, temperatures, humidities
@@ -0,0 +1,321 @@
+# Cola de ingesta acotada entre el servidor TCP y el hilo escritor
+#
+# queue.Queue sin límite deja crecer la memoria sin control si SQLite se
+# atrasa (disco lento, ráfaga de muchas placas). IngestQueue tiene una
+# capacidad fija en lecturas y una política para cuando se llena:
+#
+#   block        el productor espera: el servidor deja de leer los sockets y
+#                la presión llega por TCP hasta las placas. El servidor con
+#                hilos espera en put(); el event loop del servidor asyncio no
+#                puede esperar (atiende todas las conexiones y los comandos):
+#                con put(block=False) el lote entra igual, por encima de la
+#                capacidad, put() devuelve False y el servidor pausa la lectura
+#                de los sockets hasta que el consumidor baja la cola a
+#                QUEUE_RESUME_FRACTION de la capacidad y llama a on_resume
+#   drop_oldest  se descartan las lecturas más antiguas
+#   coalesce     las lecturas en bruto (modo 1) más antiguas se resumen en
+#                una lectura tipo STATS (modo 2: promedio, máximo y mínimo)
+#                por dispositivo y por cada COALESCE_WINDOW_S segundos; si no
+#                hay nada que resumir se descartan las más antiguas
+#
+# Los elementos son lotes (ReadingBatch) tal como salen del parser; un lote
+# se parte solo si no entra completo o si hay que descartar parte de él. El
+# consumidor saca lecturas de a muchas con get_batch(). stats() devuelve
+# profundidad, descartes, lecturas resumidas, tiempo bloqueado y latencia en
+# cola, para cualquiera de las políticas.
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+
+import lecturas
+import metricas
+from lecturas import NS, ReadingBatch
+
+QUEUE_SIZE = 100000         # Lecturas (~4.5 MB en lotes de ReadingBatch)
+QUEUE_POLICY = "block"
+POLICIES = ("block", "drop_oldest", "coalesce")
+COALESCE_FRACTION = 0.25    # Parte de la cola que se resume de una vez al llenarse
+COALESCE_WINDOW_S = 5.0     # Segundos por lectura resumida, como la ventana por defecto del ESP32
+QUEUE_RESUME_FRACTION = 0.5 # Marca inferior: un productor pausado vuelve a leer con la cola a esta fracción
+
+log = logging.getLogger(__name__)
+QUEUE_WAIT = metricas.REGISTRY.histogram("queue_wait_seconds", "Tiempo de cada lectura en la cola de ingesta")
+
+
+def coalesce_batches(batches, window=COALESCE_WINDOW_S):
+    # Resume las lecturas de modo 1 (y las ya resumidas por la cola) en una lectura
+    # de modo 2 por dispositivo y por ventana de tiempo, con el timestamp de la
+    # última; "samples" guarda cuántas lecturas en bruto resume, para poder volver
+    # a combinarla. Las lecturas STATS de las placas se devuelven tal cual.
+    # Todos los dispositivos se agrupan de una vez con una clave (dispositivo,
+    # ventana); devuelve un lote por dispositivo
+    if not batches:
+        return []
+    window_ns = int(window * NS)
+    codes = {}
+    for batch in batches:
+        codes.setdefault(batch.device_id, len(codes))
+    data = lecturas.concatenate([batch.data for batch in batches])
+    device = np.repeat([codes[batch.device_id] for batch in batches], [len(batch) for batch in batches])
+    mergeable = (data["mode"] == 1) | (data["samples"] > 0)
+    parts = [data[~mergeable]]
+    devices = [device[~mergeable]]
+    data = data[mergeable]
+    device = device[mergeable]
+    if len(data):
+        weights, temp, temp_max, temp_min, hum, hum_max, hum_min = lecturas.summary_columns(data)
+        buckets = data["timestamp"] // window_ns
+        first = buckets.min()
+        keys, inverse = np.unique(device * (buckets.max() - first + 1) + (buckets - first), return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        starts = np.searchsorted(inverse[order], np.arange(len(keys)))
+        n = np.bincount(inverse, weights=weights)
+        merged = ReadingBatch.empty(len(keys)).data
+        merged["timestamp"] = np.maximum.reduceat(data["timestamp"][order], starts)
+        merged["temp_avg"] = np.bincount(inverse, weights=temp * weights) / n
+        merged["temp_max"] = np.fmax.reduceat(temp_max[order], starts)
+        merged["temp_min"] = np.fmin.reduceat(temp_min[order], starts)
+        merged["hum_avg"] = np.bincount(inverse, weights=hum * weights) / n
+        merged["hum_max"] = np.fmax.reduceat(hum_max[order], starts)
+        merged["hum_min"] = np.fmin.reduceat(hum_min[order], starts)
+        merged["mode"] = 2
+        merged["samples"] = n
+        parts.append(merged)
+        devices.append(device[order][starts])
+    # Un lote por dispositivo, en el orden en que aparecieron, y dentro de cada uno
+    # por tiempo: los STATS de las placas quedan entre las lecturas resumidas
+    data = lecturas.concatenate(parts)
+    device = np.concatenate(devices)
+    order = np.lexsort((data["timestamp"], device))
+    bounds = np.searchsorted(device[order], np.arange(len(codes) + 1))
+    return [ReadingBatch(data[order[bounds[code]:bounds[code + 1]]], device_id)
+            for device_id, code in codes.items() if bounds[code + 1] > bounds[code]]
+
+
+# Cola de lotes (ReadingBatch); la capacidad y todos los contadores son en lecturas
+class IngestQueue:
+    policies = POLICIES  # Las que acepta __init__; las subclases tienen las suyas
+
+    def __init__(self, maxsize=QUEUE_SIZE, policy=QUEUE_POLICY):
+        if policy not in self.policies:
+            raise ValueError(f"Política desconocida: {policy} (opciones: {', '.join(self.policies)})")
+        self.maxsize = max(maxsize, 1)
+        self.policy = policy
+        self.items = collections.deque()
+        self.enqueued_at = collections.deque()  # time.monotonic() de cada lote, para la latencia
+        self.depth = 0                          # Lecturas en la cola
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.closed = False
+        # Productor sin espera (put(block=False)) pausado con la cola llena; on_resume()
+        # se llama desde el consumidor cuando puede seguir
+        self.paused = False
+        self.paused_at = 0.0
+        self.on_resume = None
+        # Contadores
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.blocked_s = 0.0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        registry = metricas.REGISTRY
+        registry.gauge("queue_depth", "Lecturas esperando al escritor", self.__len__)
+        registry.gauge("queue_capacity", "Capacidad de la cola de ingesta", lambda: self.maxsize)
+        registry.gauge("queue_dropped_total", "Lecturas descartadas con la cola llena",
+                       lambda: self.dropped, "counter")
+        registry.gauge("queue_coalesced_total", "Lecturas en bruto resumidas con la cola llena",
+                       lambda: self.coalesced, "counter")
+        registry.gauge("queue_blocked_seconds_total", "Tiempo que esperaron los productores con la cola llena",
+                       lambda: self.blocked_s, "counter")
+
+    def __len__(self):
+        with self.lock:
+            return self.depth
+
+    def _append(self, batch, now):
+        self.items.append(batch)
+        self.enqueued_at.append(now)
+        self.depth += len(batch)
+
+    def _popleft(self):
+        batch = self.items.popleft()
+        self.depth -= len(batch)
+        return batch, self.enqueued_at.popleft()
+
+    def put(self, batch, block=True):
+        # Agrega un lote de lecturas aplicando la política si no hay espacio.
+        # Devuelve False si un productor sin espera (block=False) debe pausarse
+        now = time.monotonic()
+        with self.lock:
+            if self.closed:
+                self.dropped += len(batch)
+                return True
+            while len(batch):
+                space = self.maxsize - self.depth
+                if space <= 0:
+                    if self.policy == "block" and not block:
+                        # El lote ya se leyó del socket: entra completo y el productor se pausa
+                        self._pause()
+                        space = len(batch)
+                    elif self.policy == "block":
+                        t0 = time.monotonic()
+                        self.not_full.wait()
+                        self.blocked_s += time.monotonic() - t0
+                        if self.closed:
+                            self.dropped += len(batch)
+                            return True
+                        continue
+                    else:
+                        space = self._make_room(len(batch))
+                chunk = batch if space >= len(batch) else batch[:space]
+                batch = batch[len(chunk):]
+                self._append(chunk, now)
+                self.put_count += len(chunk)
+                self.max_depth = max(self.max_depth, self.depth)
+                # Antes de volver a esperar espacio hay que despertar al consumidor
+                self.not_empty.notify()
+            return not self.paused
+
+    def _pause(self):
+        if not self.paused:
+            self.paused = True
+            self.paused_at = time.monotonic()
+
+    def _resumed(self):
+        # Con el lock tomado, después de sacar lecturas: on_resume si el productor
+        # pausado ya puede seguir (se llama fuera del lock), si no None
+        if self.paused and self.depth <= self.maxsize * QUEUE_RESUME_FRACTION:
+            self.paused = False
+            self.blocked_s += time.monotonic() - self.paused_at
+            return self.on_resume
+        return None
+
+    def _take_front(self, count):
+        # Saca las primeras count lecturas (partiendo el último lote si hace falta)
+        batches = []
+        times = []
+        while count > 0 and self.items:
+            batch, enqueued = self._popleft()
+            if len(batch) > count:
+                self.items.appendleft(batch[count:])
+                self.enqueued_at.appendleft(enqueued)
+                self.depth += len(batch) - count
+                batch = batch[:count]
+            batches.append(batch)
+            times.append(enqueued)
+            count -= len(batch)
+        return batches, times
+
+    def _make_room(self, needed):
+        # drop_oldest / coalesce con la cola llena; devuelve el espacio libre
+        if self.policy == "coalesce":
+            # El tramo a resumir empieza después de las lecturas de modo 2 del frente
+            # (STATS de las placas o resúmenes anteriores, que se combinan si caen en
+            # la misma ventana) e incluye una parte fija de lecturas en bruto
+            start = 0
+            for batch in self.items:
+                raw = np.flatnonzero(batch.data["mode"] == 1)
+                if len(raw):
+                    start += int(raw[0])
+                    break
+                start += len(batch)
+            count = min(self.depth, start + max(int(self.maxsize * COALESCE_FRACTION), needed, 2))
+            saved = self._coalesce_front(count)
+            if saved is not None:
+                if not self.coalesced:
+                    log.warning("Cola de ingesta llena (%d lecturas): se resumen las lecturas en bruto "
+                                "más antiguas", self.maxsize)
+                self.coalesced += saved
+                return self.maxsize - self.depth
+        dropped, _ = self._take_front(needed)
+        if not self.dropped:
+            log.warning("Cola de ingesta llena (%d lecturas): se descartan las más antiguas", self.maxsize)
+        self.dropped += lecturas.count(dropped)
+        return self.maxsize - self.depth
+
+    def _coalesce_front(self, count):
+        # Resume las primeras count lecturas en su lugar; devuelve cuántas lecturas
+        # se ahorraron o None si no se pudo resumir nada
+        oldest, times = self._take_front(count)
+        merged = coalesce_batches(oldest)
+        saved = count - lecturas.count(merged)
+        if saved <= 0:
+            merged = oldest
+        else:
+            times = [times[0]] * len(merged)
+        for batch, enqueued in zip(reversed(merged), reversed(times)):
+            self.items.appendleft(batch)
+            self.enqueued_at.appendleft(enqueued)
+            self.depth += len(batch)
+        return saved if saved > 0 else None
+
+    def get_batch(self, max_items, timeout=None):
+        # Lotes con hasta max_items lecturas en total; espera como máximo timeout
+        # segundos a que haya alguna. Devuelve [] si se cumple el plazo o si la
+        # cola está cerrada y vacía
+        with self.lock:
+            if not self.items and not self.closed:
+                self.not_empty.wait(timeout)
+            if not self.items:
+                return []
+            batches, times = self._take_front(max_items)
+            resume = self._resumed()
+            now = time.monotonic()
+            count = 0
+            for batch, enqueued in zip(batches, times):
+                n = len(batch)
+                count += n
+                self.latency_sum += (now - enqueued) * n
+                QUEUE_WAIT.record(now - enqueued, n)
+            # El más antiguo es el que más esperó
+            self.latency_max = max(self.latency_max, now - times[0])
+            self.get_count += count
+            self.not_full.notify_all()
+        if resume is not None:
+            resume()
+        return batches
+
+    # Para el escritor: en memoria no hay nada que confirmar ni sincronizar
+    # (bitacora.SpoolQueue guarda su posición junto con las lecturas)
+    def position(self):
+        return None
+
+    def checkpoint(self, position):
+        pass
+
+    def sync(self):
+        pass
+
+    def close(self):
+        # Ya no se aceptan lecturas; el consumidor vacía lo que quede
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def drained(self):
+        with self.lock:
+            return self.closed and not self.items
+
+    def stats(self):
+        with self.lock:
+            return {
+                "policy": self.policy,
+                "capacity": self.maxsize,
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "put": self.put_count,
+                "got": self.get_count,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "blocked_s": self.blocked_s,
+                "latency_avg_ms": self.latency_sum / self.get_count * 1000 if self.get_count else 0.0,
+                "latency_max_ms": self.latency_max * 1000,
+            }
@@ -0,0 +1,378 @@
+# Envío de comandos a las placas sin bloquear y con confirmación
+#
+# START, STOP, MODE1, MODE2, SET_FREQ y SET_WINDOW se encolan por dispositivo y
+# se escriben desde un event loop; quien los pide (la interfaz, el canal de
+# control) recibe un CommandRequest y sigue de largo. Un comando puede ir a un
+# dispositivo, a una lista de ellos o a todos los conectados (None).
+#
+# Las placas que se presentan con "HELLO <id> ... ACK1" reciben
+# "CMD <n> <comando>" y responden "ACK <n> OK", o "ACK <n> ERR" si no conocen el
+# comando. Sin respuesta en COMMAND_TIMEOUT_S se reenvía hasta COMMAND_RETRIES
+# veces, también por la conexión nueva si la placa se reconectó. Cada placa
+# tiene un solo comando sin confirmar a la vez, así un reintento nunca se aplica
+# después de un comando posterior; como las placas se atienden en paralelo,
+# reconfigurar toda la flota tarda más o menos un ida y vuelta. Todos los
+# comandos son idempotentes: repetir uno cuya confirmación se perdió no cambia
+# nada. Las placas sin ACK1 (firmware anterior) reciben el comando tal cual y su
+# resultado es "sent".
+#
+# write(bytes) se llama desde el event loop y no debe bloquearlo: en el servidor
+# asyncio es transport.write; en el servidor con hilos, SocketWriter.write.
+import asyncio
+import collections
+import itertools
+import logging
+import socket
+import threading
+import time
+
+import metricas
+
+COMMAND_TIMEOUT_S = 2.0   # Espera del ACK antes de reenviar
+COMMAND_RETRIES = 2       # Reenvíos antes de dar el comando por perdido
+WRITE_BUFFER_LIMIT = 64 * 1024  # Bytes sin enviar por conexión antes de cerrarla (SocketWriter)
+# Resultado de un comando en cada dispositivo
+RESULTS = ("ok", "error", "sent", "timeout", "offline", "cancelled")
+
+log = logging.getLogger("monitorpi")
+COMMANDS = metricas.REGISTRY.counter("commands_total", "Comandos a placas terminados, por resultado", "result")
+COMMAND_RETRIES_SENT = metricas.REGISTRY.counter("command_retries_total", "Comandos reenviados por falta de ACK")
+ACK_SECONDS = metricas.REGISTRY.histogram("command_ack_seconds", "Desde el primer envío de un comando hasta el ACK")
+
+
+# Un comando pedido para uno o varios dispositivos. results se completa en el
+# event loop del despachador; callback(request) se llama ahí cuando están todos
+class CommandRequest:
+    def __init__(self, command, device_ids=None, callback=None):
+        self.command = command
+        self.device_ids = device_ids
+        self.callback = callback
+        self.targets = None     # Dispositivos a los que se envió, al encolarlo
+        self.results = {}
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return f"CommandRequest({self.command!r}, {len(self.results)}/{len(self.targets or ())} terminados)"
+
+    def wait(self, timeout=None):
+        # Resultados por dispositivo; los que no terminaron a tiempo no aparecen
+        self.done.wait(timeout)
+        return dict(self.results)
+
+    def finish(self, device_id, result):
+        COMMANDS.inc(1, result)
+        self.results[device_id] = result
+        if len(self.results) == len(self.targets):
+            self.complete()
+
+    def complete(self):
+        self.elapsed = time.monotonic() - self.started
+        self.done.set()
+        if self.callback is not None:
+            try:
+                self.callback(self)
+            except Exception as e:
+                log.error("Error en el callback del comando %s: %s", self.command, e)
+
+
+# Escritura sin bloquear a un socket del servidor con hilos, como transport.write:
+# lo que el socket no acepta queda en un buffer que se envía desde el loop del
+# despachador cuando hay lugar. Una placa que no lee (buffer lleno o conexión
+# medio muerta) no frena los comandos de las demás: pasado WRITE_BUFFER_LIMIT se
+# cierra su conexión. Todo lo que se escribe a la placa pasa por acá, así las
+# respuestas al HELLO no se mezclan con los comandos
+class SocketWriter:
+    def __init__(self, sock, loop, limit=WRITE_BUFFER_LIMIT):
+        self.sock = sock
+        self.loop = loop
+        self.limit = limit
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        # En el event loop
+        if self.closed:
+            raise ConnectionError("conexión cerrada")
+        if not self.buffer:
+            try:
+                sent = self.sock.send(data, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                sent = 0
+            if sent == len(data):
+                return
+            data = data[sent:]
+            self.loop.add_writer(self.sock.fileno(), self._flush)
+        self.buffer += data
+        if len(self.buffer) > self.limit:
+            log.warning("La placa no lee lo que se le envía (%d bytes pendientes): se cierra la conexión",
+                        len(self.buffer))
+            self._abort()
+
+    def send(self, data):
+        # Desde cualquier hilo: se escribe en el loop, en orden con los comandos
+        self.loop.call_soon_threadsafe(self._send, data)
+
+    def _send(self, data):
+        try:
+            self.write(data)
+        except OSError as e:
+            log.error("Error al enviar a la placa: %s", e)
+
+    def close(self):
+        # Desde el hilo de la conexión al terminar; el socket se cierra en el loop
+        # para que no quede registrado en el selector con el descriptor reusado
+        if self.loop.is_running():
+            try:
+                self.loop.call_soon_threadsafe(self._close)
+                return
+            except RuntimeError:
+                pass
+        self.closed = True
+        self.sock.close()
+
+    def _flush(self):
+        try:
+            sent = self.sock.send(self.buffer, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            log.error("Error al enviar comando: %s", e)
+            self._abort()
+            return
+        del self.buffer[:sent]
+        if not self.buffer:
+            self.loop.remove_writer(self.sock.fileno())
+
+    def _abort(self):
+        # El hilo de la conexión sale del recv() y hace el resto (detach, close)
+        self.buffer.clear()
+        self.loop.remove_writer(self.sock.fileno())
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _close(self):
+        self.closed = True
+        self.buffer.clear()
+        if self.sock.fileno() != -1:
+            self.loop.remove_writer(self.sock.fileno())
+        self.sock.close()
+
+
+# Estado de un dispositivo: cómo escribirle y sus comandos pendientes
+class _Device:
+    __slots__ = ("device_id", "write", "acks", "queue", "current", "tries", "sent_at", "timer")
+
+    def __init__(self, device_id, write, acks):
+        self.device_id = device_id
+        self.write = write      # None mientras está desconectado con un comando sin confirmar
+        self.acks = acks
+        self.queue = collections.deque()
+        self.current = None     # (n, CommandRequest) esperando su ACK
+        self.tries = 0
+        self.sent_at = 0.0
+        self.timer = None
+
+
+class CommandDispatcher:
+    def __init__(self, loop=None, timeout=COMMAND_TIMEOUT_S, retries=COMMAND_RETRIES):
+        # Sin loop (servidor con hilos) el despachador corre el suyo en un hilo aparte
+        self.thread = None
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=loop.run_forever, name="comandos", daemon=True)
+            self.thread.start()
+        self.loop = loop
+        self.timeout = timeout
+        self.retries = retries
+        self.devices = {}
+        self.ids = itertools.count(1)
+        # Dispositivos conectados -> write, al día apenas vuelven attach() y detach();
+        # self.devices solo se toca en el loop
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+
+    # Métodos públicos: se pueden llamar desde cualquier hilo, el trabajo se hace en el loop
+
+    def submit(self, command, device_ids=None, callback=None):
+        # device_ids: un id, una lista de ids o None para todos los conectados
+        if isinstance(device_ids, str):
+            device_ids = [device_ids]
+        request = CommandRequest(command, device_ids, callback)
+        if not self._call(self._submit, request):
+            request.targets = []
+            request.complete()
+        return request
+
+    def attach(self, device_id, write, acks=False):
+        # write(bytes) no debe bloquear el loop; acks: la placa anunció ACK1
+        with self.connections_lock:
+            self.connections[device_id] = write
+        self._call(self._attach, device_id, write, acks)
+
+    def detach(self, device_id, write):
+        with self.connections_lock:
+            # Un dispositivo reconectado puede haber reemplazado ya esta conexión
+            if self.connections.get(device_id) == write:
+                del self.connections[device_id]
+        self._call(self._detach, device_id, write)
+
+    def connected_devices(self):
+        # Los dispositivos a los que se les puede enviar comandos ahora
+        with self.connections_lock:
+            return list(self.connections)
+
+    def acknowledge(self, device_id, message):
+        # message: "ACK <n> OK" o "ACK <n> ERR" recibido de la placa
+        self._call(self._acknowledge, device_id, message)
+
+    def stop(self):
+        # Cancela los comandos pendientes; detiene el loop si es propio
+        with self.connections_lock:
+            self.connections.clear()
+        self._call(self._cancel_all)
+        if self.thread is not None:
+            self._call(self.loop.stop)
+
+    def _call(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+            return True
+        except RuntimeError:
+            # El event loop ya está cerrado
+            return False
+
+    # En el event loop
+
+    def _submit(self, request):
+        if request.device_ids is None:
+            targets = [device_id for device_id, device in self.devices.items() if device.write is not None]
+        else:
+            targets = list(dict.fromkeys(request.device_ids))
+        request.targets = targets
+        if not targets:
+            log.warning("No hay cliente conectado para enviar comandos.")
+            request.complete()
+            return
+        for device_id in targets:
+            device = self.devices.get(device_id)
+            if device is None or (device.write is None and device.current is None):
+                request.finish(device_id, "offline")
+                continue
+            device.queue.append(request)
+            if device.current is None:
+                self._next(device_id, device)
+        log.info("Comando enviado a %d dispositivo(s): %s", len(targets), request.command)
+
+    def _attach(self, device_id, write, acks):
+        device = self.devices.get(device_id)
+        if device is None:
+            self.devices[device_id] = _Device(device_id, write, acks)
+            return
+        # Reconexión con un comando sin confirmar: se reenvía por la conexión nueva
+        device.write = write
+        device.acks = acks
+        if device.current is not None:
+            if acks:
+                self._write(device, device.current[0], device.current[1].command)
+            else:
+                self._finish_current(device_id, device, "sent", write_plain=True)
+
+    def _detach(self, device_id, write):
+        device = self.devices.get(device_id)
+        # Un dispositivo reconectado puede haber reemplazado ya esta conexión
+        if device is None or device.write != write:
+            return
+        if device.current is None:
+            del self.devices[device_id]
+        else:
+            # El comando en curso sigue esperando (y su timeout corriendo) por si la placa vuelve
+            device.write = None
+
+    def _acknowledge(self, device_id, message):
+        parts = message.split()
+        device = self.devices.get(device_id)
+        if len(parts) != 3 or device is None or device.current is None or parts[1] != str(device.current[0]):
+            log.debug("ACK inesperado de %s: %s", device_id, message)
+            return
+        ACK_SECONDS.record(time.monotonic() - device.sent_at)
+        self._finish_current(device_id, device, "ok" if parts[2] == "OK" else "error")
+
+    def _next(self, device_id, device):
+        # Envía el siguiente comando encolado; las placas sin ACK1 no esperan confirmación
+        while device.queue:
+            request = device.queue.popleft()
+            if device.write is None:
+                request.finish(device_id, "offline")
+                continue
+            if not device.acks:
+                self._send_plain(device, request.command)
+                request.finish(device_id, "sent")
+                continue
+            n = next(self.ids)
+            device.current = (n, request)
+            device.tries = 0
+            device.sent_at = time.monotonic()
+            self._write(device, n, request.command)
+            return
+        if device.write is None:
+            del self.devices[device_id]
+
+    def _write(self, device, n, command):
+        device.tries += 1
+        if device.timer is not None:
+            device.timer.cancel()
+        device.timer = self.loop.call_later(self.timeout, self._expire, device, n)
+        try:
+            device.write(f"CMD {n} {command}\n".encode())
+        except Exception as e:
+            # Se reintenta al vencer el timeout, por esta conexión o por la siguiente
+            log.error("Error al enviar comando: %s", e)
+
+    def _send_plain(self, device, command):
+        try:
+            device.write(command.encode() + b"\n")
+        except Exception as e:
+            log.error("Error al enviar comando: %s", e)
+
+    def _expire(self, device, n):
+        device.timer = None
+        if device.current is None or device.current[0] != n:
+            return
+        device_id = device.device_id
+        if device.tries > self.retries:
+            log.warning("Sin ACK de %s para %s", device_id, device.current[1].command)
+            self._finish_current(device_id, device, "timeout")
+            return
+        COMMAND_RETRIES_SENT.inc()
+        if device.write is None:
+            # Desconectado: el intento cuenta igual, se reenvía si vuelve a tiempo
+            device.tries += 1
+            device.timer = self.loop.call_later(self.timeout, self._expire, device, n)
+        else:
+            self._write(device, n, device.current[1].command)
+
+    def _finish_current(self, device_id, device, result, write_plain=False):
+        _, request = device.current
+        device.current = None
+        if device.timer is not None:
+            device.timer.cancel()
+            device.timer = None
+        if write_plain:
+            self._send_plain(device, request.command)
+        request.finish(device_id, result)
+        self._next(device_id, device)
+
+    def _cancel_all(self):
+        for device_id, device in list(self.devices.items()):
+            if device.timer is not None:
+                device.timer.cancel()
+            if device.current is not None:
+                device.queue.appendleft(device.current[1])
+                device.current = None
+            while device.queue:
+                device.queue.popleft().finish(device_id, "cancelled")
+        self.devices.clear()
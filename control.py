@@ -0,0 +1,316 @@
+# Canal de control local entre el daemon de adquisición y sus clientes (la interfaz)
+#
+# El daemon escucha en CONTROL_HOST:CONTROL_PORT un protocolo de líneas de texto:
+#
+#   DEVICES                  -> "DEVICES <id> <id> ..." (dispositivos conectados)
+#   SEND <ids|*> <comando>   -> reenvía el comando a una placa, a varias
+#                               separadas por comas o a todas ("*"); responde
+#                               "OK" sin esperar a las placas
+#   SENDWAIT <ids|*> <comando> -> lo mismo, pero responde cuando todas lo
+#                               confirmaron o se agotaron los reintentos:
+#                               "RESULT <json>" con {"command", "seconds",
+#                               "results": {id: ok|error|sent|timeout|offline}}
+#   QUEUE                    -> "QUEUE <json>" con los contadores de la cola de ingesta
+#   ALERTS                   -> "ALERTS <json>" con las alertas activas [[dispositivo, regla], ...]
+#   SUBSCRIBE                -> desde ahí el daemon envía cada lote ya guardado
+#                               como "BATCH <json>", "DEVICES ..." cuando cambia
+#                               la lista de dispositivos y "ALERT <json>" con cada
+#                               cambio de estado de una alerta, apenas se evalúa
+#
+# Las lecturas viajan como listas JSON con la forma de las tuplas de lectura
+# (ReadingBatch.to_rows()): timestamp en segundos, 8 valores con null, modo y
+# dispositivo. La interfaz puede cerrarse y volver a abrirse sin que el daemon
+# deje de guardar datos.
+import asyncio
+import json
+import logging
+import queue
+import socket
+import threading
+
+import lecturas
+import metricas
+from lecturas import ReadingBatch
+
+CONTROL_HOST = "127.0.0.1"  # Solo conexiones locales
+CONTROL_PORT = 8889
+DEVICES_POLL_S = 1.0                 # Cada cuánto se revisa si cambió la lista de dispositivos
+MAX_SUBSCRIBER_BUFFER = 4 * 1024 * 1024  # Bytes pendientes antes de descartar lotes de un cliente lento
+MAX_LINE_SIZE = 64 * 1024            # Una línea de control más larga se descarta
+
+log = logging.getLogger(__name__)
+PUBLISHED_ALERTS = metricas.REGISTRY.counter("control_published_alerts_total",
+                                             "Alertas enviadas a los suscriptores del canal de control")
+PUBLISHED_BATCHES = metricas.REGISTRY.counter("control_published_batches_total",
+                                              "Lotes enviados a los suscriptores del canal de control")
+DROPPED_WRITES = metricas.REGISTRY.counter("control_dropped_writes_total",
+                                           "Envíos descartados a clientes de control lentos")
+
+
+def devices_line(devices):
+    return ("DEVICES " + " ".join(sorted(devices))).rstrip().encode() + b"\n"
+
+
+# Una conexión de control en el daemon
+class ControlProtocol(asyncio.Protocol):
+    def __init__(self, control):
+        self.control = control
+        self.transport = None
+        self.buffer = b""
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        if len(self.buffer) > MAX_LINE_SIZE:
+            self.buffer = b""
+        for line in lines:
+            line = line.strip()
+            if line:
+                self.control.handle_line(self, line.decode(errors='replace'))
+
+    def write(self, data):
+        # Un cliente que no lee no debe hacer crecer la memoria del daemon
+        if self.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+            self.dropped += 1
+            DROPPED_WRITES.inc()
+            if self.dropped == 1:
+                log.warning("Cliente de control lento: se descartan lotes hasta que se ponga al día")
+            return
+        self.dropped = 0
+        self.transport.write(data)
+
+    def connection_lost(self, exc):
+        self.control.subscribers.discard(self)
+
+
+# Servidor de control: reparte los lotes guardados a los suscriptores
+class ControlServer(threading.Thread):
+    def __init__(self, server, ui_queue, host=CONTROL_HOST, port=CONTROL_PORT, data_queue=None, alerts=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.server = server
+        self.ui_queue = ui_queue
+        self.data_queue = data_queue
+        self.alerts = alerts
+        if alerts is not None:
+            alerts.subscribe(self.publish_alerts)
+        self.host = host
+        self.port = port
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen()
+        self.server_socket.setblocking(False)
+        self.loop = asyncio.new_event_loop()
+        self.subscribers = set()
+        # Colas de consumidores en el mismo proceso (la interfaz con --gui)
+        self.local_queues = []
+        self.devices = []
+        self.running = True
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(
+                self.loop.create_server(lambda: ControlProtocol(self), sock=self.server_socket))
+            log.info("Canal de control escuchando en %s:%s", self.host, self.port)
+            self.loop.create_task(self.watch_devices())
+            threading.Thread(target=self.pump, daemon=True).start()
+            self.loop.run_forever()
+        finally:
+            # Cancelar watch_devices() antes de cerrar el loop
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def subscribe_queue(self):
+        # Cola con los lotes guardados para un consumidor del mismo proceso
+        local = queue.Queue()
+        self.local_queues.append(local)
+        return local
+
+    def handle_line(self, protocol, line):
+        command, _, rest = line.partition(" ")
+        command = command.upper()
+        if command == "DEVICES":
+            protocol.write(devices_line(self.server.connected_devices()))
+        elif command in ("SEND", "SENDWAIT"):
+            target, _, device_command = rest.partition(" ")
+            if not device_command:
+                protocol.write(f"ERROR uso: {command} <ids|*> <comando>\n".encode())
+                return
+            targets = None if target == "*" else [device_id for device_id in target.split(",") if device_id]
+            if command == "SEND":
+                self.server.send_command(device_command, targets)
+                protocol.write(b"OK\n")
+            else:
+                self.server.send_command(device_command, targets,
+                                         lambda request: self.publish_result(protocol, request))
+        elif command == "QUEUE":
+            if self.data_queue is None:
+                protocol.write(b"ERROR sin cola de ingesta\n")
+                return
+            stats = json.dumps(self.data_queue.stats(), separators=(',', ':'))
+            protocol.write(b"QUEUE " + stats.encode() + b"\n")
+        elif command == "ALERTS":
+            if self.alerts is None:
+                protocol.write(b"ERROR alertas desactivadas\n")
+                return
+            active = json.dumps(self.alerts.active_alerts(), separators=(',', ':'))
+            protocol.write(b"ALERTS " + active.encode() + b"\n")
+        elif command == "SUBSCRIBE":
+            self.subscribers.add(protocol)
+            protocol.write(devices_line(self.devices))
+        else:
+            protocol.write(b"ERROR comando desconocido\n")
+
+    def pump(self):
+        # Hilo aparte que espera los lotes del hilo escritor; la escritura a los
+        # suscriptores ocurre en el event loop
+        while self.running:
+            batch = self.ui_queue.get()
+            if batch is None:
+                break
+            for local in self.local_queues:
+                local.put(batch)
+            if self.subscribers:
+                try:
+                    self.loop.call_soon_threadsafe(self.publish, batch)
+                except RuntimeError:
+                    # El event loop ya está cerrado
+                    break
+
+    def publish(self, batch):
+        # Se serializa una sola vez para todos los suscriptores
+        payload = b"BATCH " + json.dumps(lecturas.to_rows(batch), separators=(',', ':')).encode() + b"\n"
+        PUBLISHED_BATCHES.inc()
+        for protocol in list(self.subscribers):
+            protocol.write(payload)
+
+    def publish_result(self, protocol, request):
+        # Callback de un SENDWAIT: se llama en el event loop del servidor TCP
+        result = {"command": request.command, "seconds": round(request.elapsed, 4), "results": request.results}
+        payload = b"RESULT " + json.dumps(result, separators=(',', ':')).encode() + b"\n"
+        try:
+            self.loop.call_soon_threadsafe(protocol.write, payload)
+        except RuntimeError:
+            pass
+
+    def publish_alerts(self, alerts):
+        # Suscriptor de AlertEngine: se llama en el hilo de ingesta, la escritura
+        # a los clientes ocurre en el event loop
+        if not self.subscribers or not self.running:
+            return
+        payload = b"ALERT " + json.dumps(alerts, separators=(',', ':')).encode() + b"\n"
+        try:
+            self.loop.call_soon_threadsafe(self._send_alerts, payload, len(alerts))
+        except RuntimeError:
+            pass
+
+    def _send_alerts(self, payload, count):
+        PUBLISHED_ALERTS.inc(count)
+        for protocol in list(self.subscribers):
+            protocol.write(payload)
+
+    async def watch_devices(self):
+        while self.running:
+            devices = sorted(self.server.connected_devices())
+            if devices != self.devices:
+                self.devices = devices
+                line = devices_line(devices)
+                for protocol in list(self.subscribers):
+                    protocol.write(line)
+            await asyncio.sleep(DEVICES_POLL_S)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        # Desbloquea el hilo de pump() y detiene el loop
+        self.ui_queue.put(None)
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError:
+            pass
+
+
+# Cliente del canal de control: la interfaz lo usa en lugar del servidor TCP
+# cuando corre en otro proceso. Expone connected_devices(), send_command() y
+# stop() como TCPServer, y deja los lotes recibidos en ui_queue
+class DaemonClient(threading.Thread):
+    def __init__(self, host=CONTROL_HOST, port=CONTROL_PORT, cache=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.cache = cache
+        self.ui_queue = queue.Queue()
+        self.devices = []
+        self.running = True
+        self.send_lock = threading.Lock()
+        self.sock = socket.create_connection((host, port))
+        self.sock.sendall(b"SUBSCRIBE\n")
+
+    def run(self):
+        buffer = b""
+        while self.running:
+            try:
+                data = self.sock.recv(64 * 1024)
+            except OSError:
+                data = b""
+            if not data:
+                if self.running:
+                    log.warning("Se perdió la conexión con el daemon de adquisición")
+                break
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                self.handle_line(line)
+
+    def handle_line(self, line):
+        if line.startswith(b"BATCH "):
+            batches = ReadingBatch.from_rows(json.loads(line[6:]))
+            if self.cache is not None:
+                for batch in batches:
+                    self.cache.add(batch)
+            self.ui_queue.put(batches)
+        elif line.startswith(b"ALERT "):
+            for alert in json.loads(line[6:]):
+                if alert["active"]:
+                    log.warning("Alerta %s en %s: %s=%s", alert["rule"], alert["device_id"], alert["field"],
+                                alert["value"])
+                else:
+                    log.info("Alerta %s en %s resuelta", alert["rule"], alert["device_id"])
+        elif line.startswith(b"DEVICES"):
+            self.devices = line.decode(errors='replace').split()[1:]
+        elif line.startswith(b"ERROR"):
+            log.warning("Daemon: %s", line.decode(errors='replace'))
+
+    def connected_devices(self):
+        return list(self.devices)
+
+    def send_command(self, command, device_id=None):
+        # device_id: un id, una lista de ids o None (todas); el daemon no hace esperar
+        if device_id is None:
+            target = "*"
+        elif isinstance(device_id, str):
+            target = device_id
+        else:
+            target = ",".join(device_id)
+        with self.send_lock:
+            try:
+                self.sock.sendall(f"SEND {target} {command}\n".encode())
+                log.info("Comando enviado: %s", command)
+            except OSError as e:
+                log.error("Error al enviar comando: %s", e)
+
+    def stop(self):
+        # Cierra solo la conexión; el daemon sigue funcionando
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
@@ -0,0 +1,309 @@
+# Lecturas en vivo para tableros remotos: Server-Sent Events y WebSocket locales
+#
+# La interfaz lee SQLite cada 2 s y el canal de control reparte los lotes recién
+# cuando el escritor los guardó. StreamServer recibe cada lote apenas se
+# decodifica (TCPServer.queue_readings, antes de la cola de ingesta) y lo
+# reparte a los suscriptores sin pasar por la base de datos:
+#
+#   GET /stream?device=a,b&mode=1&stride=10
+#
+# con "Accept: text/event-stream" o sin nada especial responde Server-Sent
+# Events (un "data: <json>" por envío, sirve con EventSource del navegador);
+# con "Upgrade: websocket" hace el handshake de RFC 6455 y envía un mensaje de
+# texto por envío. El JSON es una lista de lecturas con la forma de las tuplas
+# de lectura, igual que "BATCH" en el canal de control. Filtros opcionales:
+#
+#   device  dispositivos separados por comas (se puede repetir); todos si falta
+#   mode    1 o 2
+#   stride  una de cada N lecturas de cada dispositivo: las de número múltiplo
+#           de N entre las que el servidor repartió, así todos los suscriptores
+#           con el mismo stride ven las mismas lecturas
+#
+# Los lotes se juntan y se reparten cada STREAM_INTERVAL_S. El JSON se arma una
+# vez por lote y por combinación de mode y stride, y el mensaje una vez por
+# filtro distinto: cien tableros con el mismo filtro cuestan un json.dumps y
+# cien write(). Cada suscriptor tiene a lo sumo STREAM_BUFFER bytes sin enviar
+# (el buffer del transporte); un cliente que no lee a tiempo se desconecta, así
+# no retrasa a los demás ni hace crecer la memoria del daemon, y puede volver a
+# conectarse. Las lecturas de modo 2 calculadas por el servidor (--windows) no
+# pasan por aquí: se arman en el hilo escritor.
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import logging
+import socket
+import struct
+import threading
+import urllib.parse
+
+import numpy as np
+
+import metricas
+
+STREAM_HOST = "127.0.0.1"   # Solo conexiones locales
+STREAM_PORT = 8890
+STREAM_INTERVAL_S = 0.05            # Cada cuánto se reparten los lotes recibidos
+STREAM_BUFFER = 1024 * 1024         # Bytes sin enviar antes de desconectar a un suscriptor lento
+MAX_REQUEST_SIZE = 8 * 1024         # Cabeceras HTTP o mensajes del cliente más largos cierran la conexión
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+log = logging.getLogger(__name__)
+MESSAGES = metricas.REGISTRY.counter("stream_messages_total", "Mensajes enviados a suscriptores en vivo")
+EVICTED = metricas.REGISTRY.counter("stream_evicted_total", "Suscriptores en vivo desconectados por lentos")
+
+
+def websocket_frame(payload, opcode=0x1):
+    # Trama del servidor (sin máscara) con el bit FIN
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def parse_filter(query):
+    # Query string de /stream -> (dispositivos o None, modo o None, stride); ValueError si no es válido
+    params = urllib.parse.parse_qs(query)
+    devices = None
+    if "device" in params:
+        devices = frozenset(device for value in params["device"] for device in value.split(",") if device)
+    mode = None
+    if "mode" in params:
+        mode = int(params["mode"][-1])
+        if mode not in (1, 2):
+            raise ValueError("mode debe ser 1 o 2")
+    stride = int(params["stride"][-1]) if "stride" in params else 1
+    if stride < 1:
+        raise ValueError("stride debe ser mayor que 0")
+    return devices, mode, stride
+
+
+# Una conexión HTTP: primero la petición, después un suscriptor SSE o WebSocket
+class StreamProtocol(asyncio.Protocol):
+    def __init__(self, stream):
+        self.stream = stream
+        self.transport = None
+        self.buffer = b""
+        self.kind = None        # "sse" o "websocket" después del handshake
+        self.filter = None      # (kind, dispositivos, modo, stride)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        if len(self.buffer) > MAX_REQUEST_SIZE:
+            self.transport.close()
+            return
+        if self.kind is None:
+            if b"\r\n\r\n" in self.buffer:
+                request, _, self.buffer = self.buffer.partition(b"\r\n\r\n")
+                self.handle_request(request.decode(errors='replace'))
+        if self.kind == "websocket":
+            self.read_frames()
+
+    def handle_request(self, request):
+        lines = request.split("\r\n")
+        parts = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        path, _, query = parts[1].partition("?") if len(parts) > 1 else ("", "", "")
+        if parts[0] != "GET":
+            self.reply("405 Method Not Allowed")
+            return
+        if path != "/stream":
+            self.reply("404 Not Found")
+            return
+        try:
+            devices, mode, stride = parse_filter(query)
+        except ValueError as e:
+            self.reply("400 Bad Request", str(e))
+            return
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() == "websocket" and key:
+            accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+            self.transport.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                                 f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+            self.kind = "websocket"
+        else:
+            # HTTP/1.0: el cuerpo termina al cerrar la conexión
+            self.transport.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                                 b"Access-Control-Allow-Origin: *\r\n\r\n")
+            self.kind = "sse"
+        self.filter = (self.kind, devices, mode, stride)
+        self.stream.subscribers.add(self)
+        log.info("Suscriptor en vivo (%s) conectado: device=%s mode=%s stride=%d", self.kind,
+                 ",".join(sorted(devices)) if devices else "*", mode or "*", stride)
+
+    def reply(self, status, body=""):
+        body = body.encode()
+        self.transport.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                             f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        self.transport.close()
+
+    def read_frames(self):
+        # Del cliente solo importan close y ping; el resto se ignora
+        while len(self.buffer) >= 2:
+            first, second = self.buffer[0], self.buffer[1]
+            n = second & 0x7F
+            offset = 2
+            if n == 126:
+                if len(self.buffer) < 4:
+                    return
+                n = struct.unpack_from("!H", self.buffer, 2)[0]
+                offset = 4
+            elif n == 127:
+                if len(self.buffer) < 10:
+                    return
+                n = struct.unpack_from("!Q", self.buffer, 2)[0]
+                offset = 10
+            masked = second & 0x80
+            end = offset + (4 if masked else 0) + n
+            if len(self.buffer) < end:
+                return
+            payload = self.buffer[end - n:end]
+            if masked:
+                mask = self.buffer[offset:offset + 4]
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            self.buffer = self.buffer[end:]
+            opcode = first & 0x0F
+            if opcode == 0x8:
+                self.transport.write(websocket_frame(payload[:2], 0x8))
+                self.transport.close()
+                return
+            if opcode == 0x9:
+                self.transport.write(websocket_frame(payload, 0xA))
+
+    def send(self, message):
+        # Un cliente que no lee no debe retrasar a los demás ni hacer crecer la memoria
+        if self.transport.is_closing():
+            return
+        buffered = self.transport.get_write_buffer_size()
+        if buffered and buffered + len(message) > STREAM_BUFFER:
+            EVICTED.inc()
+            log.warning("Suscriptor en vivo lento (%s): se desconecta", self.kind)
+            self.stream.subscribers.discard(self)
+            self.transport.abort()
+            return
+        MESSAGES.inc()
+        self.transport.write(message)
+
+    def connection_lost(self, exc):
+        self.stream.subscribers.discard(self)
+
+
+# Servidor de lecturas en vivo, en su propio event loop
+class StreamServer(threading.Thread):
+    def __init__(self, host=STREAM_HOST, port=STREAM_PORT, interval=STREAM_INTERVAL_S):
+        threading.Thread.__init__(self, daemon=True)
+        self.host = host
+        self.port = port
+        self.interval = interval
+        # El socket se abre aquí para que un puerto ocupado falle en el hilo principal
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen()
+        self.server_socket.setblocking(False)
+        self.loop = asyncio.new_event_loop()
+        self.subscribers = set()
+        # Lotes recibidos desde el último reparto (los agrega el hilo de ingesta)
+        self.pending = collections.deque()
+        self.scheduled = False
+        # Lecturas recibidas por dispositivo, para stride
+        self.sequence = {}
+        metricas.REGISTRY.gauge("stream_subscribers", "Suscriptores en vivo conectados", lambda: len(self.subscribers))
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(
+                self.loop.create_server(lambda: StreamProtocol(self), sock=self.server_socket))
+            log.info("Lecturas en vivo en http://%s:%s/stream", self.host, self.port)
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def publish(self, batch):
+        # Se llama en el hilo de ingesta con cada ReadingBatch recibido; no bloquea
+        if not self.subscribers:
+            return
+        self.pending.append(batch)
+        if not self.scheduled:
+            self.scheduled = True
+            try:
+                self.loop.call_soon_threadsafe(self.loop.call_later, self.interval, self.flush)
+            except RuntimeError:
+                # El event loop ya está cerrado
+                pass
+
+    def flush(self):
+        # En el event loop: reparte los lotes pendientes, un mensaje por suscriptor
+        self.scheduled = False
+        batches = []
+        while self.pending:
+            batch = self.pending.popleft()
+            start = self.sequence.get(batch.device_id, 0)
+            self.sequence[batch.device_id] = start + len(batch)
+            batches.append((batch, start))
+        if not batches:
+            return
+        rows = {}       # lote -> tuplas de lectura, se arman una vez por lote
+        selected = {}   # (lote, modo, stride) -> lecturas en JSON sin los corchetes
+        messages = {}   # filtro -> mensaje listo para enviar, o None si no hay lecturas
+        for subscriber in list(self.subscribers):
+            key = subscriber.filter
+            if key not in messages:
+                messages[key] = self.message(batches, key, rows, selected)
+            if messages[key] is not None:
+                subscriber.send(messages[key])
+
+    def message(self, batches, key, rows, selected):
+        kind, devices, mode, stride = key
+        parts = []
+        for i, (batch, start) in enumerate(batches):
+            if devices is not None and batch.device_id not in devices:
+                continue
+            if (i, mode, stride) not in selected:
+                if i not in rows:
+                    rows[i] = batch.to_rows()
+                selected[i, mode, stride] = self.select(batch, rows[i], start, mode, stride)
+            if selected[i, mode, stride]:
+                parts.append(selected[i, mode, stride])
+        if not parts:
+            return None
+        payload = ("[" + ",".join(parts) + "]").encode()
+        if kind == "websocket":
+            return websocket_frame(payload)
+        return b"data: " + payload + b"\n\n"
+
+    def select(self, batch, rows, start, mode, stride):
+        # Lecturas del lote que pasan mode y stride, en JSON sin los corchetes
+        keep = None
+        if stride > 1:
+            keep = (np.arange(start, start + len(batch)) % stride) == 0
+        if mode is not None:
+            same = batch.data["mode"] == mode
+            keep = same if keep is None else keep & same
+        if keep is not None:
+            rows = [rows[i] for i in np.flatnonzero(keep)]
+        return json.dumps(rows, separators=(',', ':'))[1:-1]
+
+    def stop(self):
+        try:
+            self.loop.call_soon_threadsafe(self._shutdown)
+        except RuntimeError:
+            # El event loop ya está cerrado
+            pass
+
+    def _shutdown(self):
+        for subscriber in list(self.subscribers):
+            subscriber.transport.close()
+        self.loop.stop()
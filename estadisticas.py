@@ -0,0 +1,457 @@
+# Estadísticas móviles (promedio, desviación, mínimo y máximo) en O(1) amortizado
+#
+# RollingWindow mantiene una ventana de las últimas N muestras (por cantidad) o
+# de los últimos T segundos (por tiempo, como SET_WINDOW del ESP32). El promedio
+# y la varianza se actualizan con Welford al agregar y al quitar muestras; el
+# mínimo y el máximo con colas monótonas, así ninguna operación recorre la
+# ventana completa. Las muestras llegan y salen por lotes (arreglos de NumPy):
+# cada lote se combina de una vez con la fórmula de Chan y solo sus candidatos
+# a mínimo y máximo pasan a las colas. StatsEngine agrupa varias ventanas por dispositivo y no
+# depende de Qt, se puede usar desde el servidor o desde un script.
+# WindowAggregator calcula en el servidor las lecturas de modo 2 (promedio,
+# máximo y mínimo por ventana fija) a partir de las de modo 1.
+import collections
+import itertools
+import math
+import threading
+import time
+
+import numpy as np
+
+import lecturas
+from lecturas import NS, ReadingBatch
+
+# Ventanas por defecto de StatsEngine: nombre -> (cantidad, segundos)
+DEFAULT_WINDOWS = {
+    "ultimas": (100, None),   # Últimas 100 lecturas, como las listas internas de la interfaz
+    "firmware": (None, 5.0),  # Misma ventana que el ESP32 (SET_WINDOW, 5000 ms por defecto)
+}
+# Ventanas (segundos) de las lecturas de modo 2 que calcula WindowAggregator
+SERVER_WINDOWS = (5.0, 60.0)
+AGGREGATE_GRACE_S = 5.0   # Espera antes de cerrar la ventana de un dispositivo que dejó de mandar
+
+
+class RollingWindow:
+    def __init__(self, size=None, duration=None):
+        if size is None and duration is None:
+            raise ValueError("La ventana necesita una cantidad de muestras o una duración")
+        self.size = size
+        self.duration = duration
+        # Muestras por lotes: [secuencia de la primera, timestamps, valores, ya quitadas];
+        # las que llegan de a una con add() son lotes de una tupla
+        self.chunks = collections.deque()
+        self.count = 0
+        self.min_queue = collections.deque()  # (secuencia, valor) con valores crecientes
+        self.max_queue = collections.deque()  # (secuencia, valor) con valores decrecientes
+        self.seq = 0
+        self.newest = -math.inf
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.removed = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, timestamp, value):
+        if value is None or value != value:
+            # Lecturas faltantes (None o NaN) no entran a la ventana
+            return
+        self.seq += 1
+        self.chunks.append([self.seq, (timestamp,), (value,), 0])
+        if timestamp > self.newest:
+            self.newest = timestamp
+
+        # Welford: agregar la muestra
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        while self.min_queue and self.min_queue[-1][1] >= value:
+            self.min_queue.pop()
+        self.min_queue.append((self.seq, value))
+        while self.max_queue and self.max_queue[-1][1] <= value:
+            self.max_queue.pop()
+        self.max_queue.append((self.seq, value))
+
+        self.expire()
+
+    def extend(self, timestamps, values):
+        # Agrega un lote de muestras con operaciones sobre el arreglo completo
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        # Lecturas faltantes (NaN) no entran a la ventana
+        valid = ~np.isnan(values)
+        if not valid.all():
+            timestamps = timestamps[valid]
+            values = values[valid]
+        n = len(values)
+        if n <= 1:
+            if n:
+                self.add(float(timestamps[0]), float(values[0]))
+            return
+        self.newest = max(self.newest, float(timestamps.max()))
+        if self.size is not None and n > self.size:
+            # Las más viejas del lote saldrían enseguida de la ventana
+            self.seq += n - self.size
+            timestamps = timestamps[-self.size:]
+            values = values[-self.size:]
+            n = self.size
+
+        # Welford por lotes (Chan et al.): juntar la ventana con el lote
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        first = self.seq + 1
+        self.chunks.append([first, timestamps, values, 0])
+        self.seq += n
+
+        # Candidatos del lote para las colas monótonas: los estrictamente menores
+        # (mayores) que todos los que vienen después
+        suffix_min = np.minimum.accumulate(values[::-1])[::-1]
+        suffix_max = np.maximum.accumulate(values[::-1])[::-1]
+        low, high = suffix_min[0], suffix_max[0]
+        while self.min_queue and self.min_queue[-1][1] >= low:
+            self.min_queue.pop()
+        while self.max_queue and self.max_queue[-1][1] <= high:
+            self.max_queue.pop()
+        for i in np.flatnonzero(values[:-1] < suffix_min[1:]).tolist() + [n - 1]:
+            self.min_queue.append((first + i, float(values[i])))
+        for i in np.flatnonzero(values[:-1] > suffix_max[1:]).tolist() + [n - 1]:
+            self.max_queue.append((first + i, float(values[i])))
+
+        self.expire()
+
+    def expire(self, now=None):
+        # Quita las muestras que quedaron fuera de la ventana. En las ventanas por
+        # tiempo "now" es el timestamp más nuevo recibido, no la hora del sistema
+        limit = None
+        if self.duration is not None:
+            limit = (self.newest if now is None else now) - self.duration
+        while self.chunks:
+            chunk = self.chunks[0]
+            first, timestamps, values, start = chunk
+            length = len(values)
+            end = start
+            if self.size is not None and self.count > self.size:
+                end = min(start + self.count - self.size, length)
+            # Además de las que sobran, las siguientes que sean demasiado viejas
+            if limit is not None and end < length:
+                if length == 1:
+                    # Muestra agregada con add(): sin NumPy, como antes
+                    end = int(timestamps[0] <= limit)
+                else:
+                    newer = np.flatnonzero(timestamps[end:] > limit)
+                    end = end + int(newer[0]) if len(newer) else length
+            if end == start:
+                break
+            # El tramo sale de la ventana antes de actualizar los resúmenes
+            if end < length:
+                chunk[3] = end
+                self._remove(first + end - 1, values[start:end])
+                break
+            self.chunks.popleft()
+            self._remove(first + end - 1, values if start == 0 else values[start:])
+
+    def _remove(self, last_seq, values):
+        # Quita un tramo del frente de la ventana hasta la secuencia last_seq
+        k = len(values)
+        n = self.count - k
+        self.count = n
+        if n == 0:
+            self.reset_stats()
+        elif k == 1:
+            # Welford inverso: quitar la muestra
+            value = values[0]
+            delta = value - self.mean
+            self.mean -= delta / n
+            self.m2 -= delta * (value - self.mean)
+            self.removed += 1
+        else:
+            # Welford inverso por lotes
+            mean = float(values.mean())
+            m2 = float(((values - mean) ** 2).sum())
+            new_mean = (self.mean * (n + k) - mean * k) / n
+            self.m2 -= m2 + (mean - new_mean) ** 2 * k * n / (n + k)
+            self.mean = new_mean
+            self.removed += k
+        if 0 < n <= self.removed:
+            # Cada tanto se recalcula desde cero para no acumular error de
+            # redondeo; repartido entre n quitas sigue siendo O(1)
+            self._recompute()
+        while self.min_queue and self.min_queue[0][0] <= last_seq:
+            self.min_queue.popleft()
+        while self.max_queue and self.max_queue[0][0] <= last_seq:
+            self.max_queue.popleft()
+
+    def _recompute(self):
+        self.reset_stats()
+        values = np.fromiter(itertools.chain.from_iterable(chunk[2][chunk[3]:] for chunk in self.chunks),
+                             dtype=np.float64, count=self.count)
+        self.mean = float(values.mean())
+        self.m2 = float(((values - self.mean) ** 2).sum())
+
+    def resize(self, size=None, duration=None):
+        if size is None and duration is None:
+            raise ValueError("La ventana necesita una cantidad de muestras o una duración")
+        self.size = size
+        self.duration = duration
+        self.expire()
+
+    def clear(self):
+        self.chunks.clear()
+        self.count = 0
+        self.min_queue.clear()
+        self.max_queue.clear()
+        self.newest = -math.inf
+        self.reset_stats()
+
+    def variance(self):
+        # Varianza muestral (n - 1); con menos de dos muestras es 0
+        n = self.count
+        if n < 2:
+            return 0.0
+        return max(self.m2, 0.0) / (n - 1)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def min(self):
+        return self.min_queue[0][1] if self.min_queue else None
+
+    def max(self):
+        return self.max_queue[0][1] if self.max_queue else None
+
+    def summary(self):
+        # None si la ventana está vacía
+        if not self.count:
+            return None
+        return {"count": self.count, "avg": self.mean, "std": self.std(),
+                "min": self.min(), "max": self.max()}
+
+
+class StatsEngine:
+    # Ventanas de temperatura y humedad por dispositivo. La clave None acumula
+    # todos los dispositivos juntos (la opción "Todos" de la interfaz)
+    FIELDS = ("temperature", "humidity")
+
+    def __init__(self, windows=None):
+        self.windows = dict(DEFAULT_WINDOWS if windows is None else windows)
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def _device(self, device_id):
+        stats = self.devices.get(device_id)
+        if stats is None:
+            stats = self.devices[device_id] = {
+                name: {field: RollingWindow(size, duration) for field in self.FIELDS}
+                for name, (size, duration) in self.windows.items()
+            }
+        return stats
+
+    def add(self, batches):
+        # Recibe lotes de lectura (ReadingBatch); solo las de modo 1 (datos en bruto)
+        # entran, cada columna de una vez
+        with self.lock:
+            for batch in batches:
+                raw = batch.data["mode"] == 1
+                if not raw.any():
+                    continue
+                timestamps = batch.timestamps()[raw]
+                columns = {field: batch.values(field)[raw] for field in self.FIELDS}
+                targets = (None,) if batch.device_id is None else (None, batch.device_id)
+                for device_id in targets:
+                    for windows in self._device(device_id).values():
+                        for field, window in windows.items():
+                            window.extend(timestamps, columns[field])
+
+    def set_window(self, name, size=None, duration=None, device_id=None):
+        # Crea o cambia una ventana. Sin device_id se aplica a todos los dispositivos
+        # y a los que se conecten después
+        with self.lock:
+            if device_id is None:
+                self.windows[name] = (size, duration)
+                targets = list(self.devices)
+            else:
+                targets = [device_id]
+            for target in targets:
+                stats = self._device(target)
+                if name in stats:
+                    for window in stats[name].values():
+                        window.resize(size, duration)
+                else:
+                    stats[name] = {field: RollingWindow(size, duration) for field in self.FIELDS}
+
+    def summary(self, device_id=None, name="ultimas"):
+        # {"temperature": {...}, "humidity": {...}} con None en los campos vacíos
+        with self.lock:
+            stats = self.devices.get(device_id)
+            if stats is None or name not in stats:
+                return {field: None for field in self.FIELDS}
+            return {field: window.summary() for field, window in stats[name].items()}
+
+
+# Estado de una ventana de WindowAggregator, por índice de dispositivo
+class _WindowState:
+    def __init__(self, window_ms):
+        self.window_ns = window_ms * 1000000
+        self.window_ms = window_ms
+        self.open = np.zeros(0, dtype=np.int64)     # Tramo abierto (-1 si no hay)
+        self.closed = np.zeros(0, dtype=np.int64)   # Último tramo cerrado
+        # Acumulado del tramo abierto: peso, suma temp, máx, mín, suma hum, máx, mín
+        self.acc = np.zeros((0, 7))
+
+    def grow(self, n):
+        extra = n - len(self.open)
+        if extra > 0:
+            self.open = np.concatenate((self.open, np.full(extra, -1, dtype=np.int64)))
+            self.closed = np.concatenate((self.closed, np.full(extra, -1, dtype=np.int64)))
+            self.acc = np.concatenate((self.acc, np.zeros((extra, 7))))
+
+
+class WindowAggregator:
+    # Lecturas de modo 2 (promedio, máximo y mínimo) calculadas en el servidor a
+    # partir de las de modo 1, como el STATS del ESP32 pero para varias ventanas a
+    # la vez y sin que la placa deje de mandar los datos en bruto. Las ventanas
+    # son tramos fijos alineados a múltiplos de su duración desde 1970, por
+    # dispositivo. Un tramo se cierra cuando llega una lectura posterior del mismo
+    # dispositivo o, con expire(), cuando las lecturas de los demás ya van "grace"
+    # segundos después de su fin (el reloj es el de las lecturas, no el de
+    # pared: con la cola atrasada no se cierra nada antes de tiempo); una lectura
+    # atrasada entra en el tramo abierto. Las lecturas que resumió la cola
+    # (samples > 0) cuentan con su peso. Cada lote se procesa por columnas para
+    # todos los dispositivos a la vez
+    def __init__(self, windows=SERVER_WINDOWS, grace=AGGREGATE_GRACE_S):
+        self.states = [_WindowState(int(round(window * 1000))) for window in windows]
+        self.grace_ns = int(grace * NS)
+        self.codes = {}        # device_id -> índice en los arreglos de estado
+        self.device_ids = []
+        self.latest_ns = 0     # Lectura más nueva vista
+
+    def add(self, batches):
+        # Lotes recibidos -> lotes (uno por dispositivo) con los tramos que se cerraron
+        codes = []
+        for batch in batches:
+            code = self.codes.get(batch.device_id)
+            if code is None:
+                code = self.codes[batch.device_id] = len(self.device_ids)
+                self.device_ids.append(batch.device_id)
+            codes.append(code)
+        if not codes:
+            return []
+        data = lecturas.concatenate([batch.data for batch in batches])
+        device = np.repeat(codes, [len(batch.data) for batch in batches])
+        keep = (data["mode"] == 1) | (data["samples"] > 0)
+        if not keep.all():
+            data = data[keep]
+            device = device[keep]
+            if not len(data):
+                return []
+        self.latest_ns = max(self.latest_ns, int(data["timestamp"].max()))
+        weights, temp, temp_max, temp_min, hum, hum_max, hum_min = lecturas.summary_columns(data)
+        emitted = []
+        for state in self.states:
+            state.grow(len(self.device_ids))
+            # Tramo de cada lectura; las atrasadas van al tramo abierto
+            floor = np.maximum(state.open, state.closed + 1)
+            buckets = np.maximum(data["timestamp"] // state.window_ns, floor[device])
+            first = buckets.min()
+            span = buckets.max() - first + 1
+            keys, inverse = np.unique(device * span + (buckets - first), return_inverse=True)
+            group_device = keys // span
+            group_bucket = keys % span + first
+            order = np.argsort(inverse, kind="stable")
+            starts = np.searchsorted(inverse[order], np.arange(len(keys)))
+            acc = np.empty((len(keys), 7))
+            acc[:, 0] = np.bincount(inverse, weights=weights)
+            acc[:, 1] = np.bincount(inverse, weights=temp * weights)
+            acc[:, 2] = np.fmax.reduceat(temp_max[order], starts)
+            acc[:, 3] = np.fmin.reduceat(temp_min[order], starts)
+            acc[:, 4] = np.bincount(inverse, weights=hum * weights)
+            acc[:, 5] = np.fmax.reduceat(hum_max[order], starts)
+            acc[:, 6] = np.fmin.reduceat(hum_min[order], starts)
+
+            # Primer y último tramo de cada dispositivo en el lote (las claves están
+            # ordenadas por dispositivo y tramo)
+            change = group_device[1:] != group_device[:-1]
+            is_first = np.concatenate(([True], change))
+            is_last = np.concatenate((change, [True]))
+            # El tramo abierto continúa en el primer tramo del lote o ya terminó
+            devices = group_device[is_first]
+            open_buckets = state.open[devices]
+            merge = np.flatnonzero(is_first)[open_buckets == group_bucket[is_first]]
+            if len(merge):
+                previous = state.acc[group_device[merge]]
+                acc[merge, 0] += previous[:, 0]
+                acc[merge, 1] += previous[:, 1]
+                acc[merge, 2] = np.fmax(acc[merge, 2], previous[:, 2])
+                acc[merge, 3] = np.fmin(acc[merge, 3], previous[:, 3])
+                acc[merge, 4] += previous[:, 4]
+                acc[merge, 5] = np.fmax(acc[merge, 5], previous[:, 5])
+                acc[merge, 6] = np.fmin(acc[merge, 6], previous[:, 6])
+            ended = devices[(open_buckets >= 0) & (open_buckets < group_bucket[is_first])]
+            if len(ended):
+                emitted.append(self._readings(state, ended, state.open[ended], state.acc[ended]))
+            done = ~is_last
+            if done.any():
+                emitted.append(self._readings(state, group_device[done], group_bucket[done], acc[done]))
+            # El último tramo de cada dispositivo queda abierto
+            state.open[group_device[is_last]] = group_bucket[is_last]
+            state.acc[group_device[is_last]] = acc[is_last]
+        return self._batches(emitted)
+
+    def expire(self, now_ns=None, grace_ns=None):
+        # Cierra los tramos de los dispositivos que dejaron de mandar: los que
+        # terminaron más de grace (por defecto el del constructor) antes de now
+        # (por defecto la lectura más nueva vista)
+        now_ns = self.latest_ns if now_ns is None else now_ns
+        grace_ns = self.grace_ns if grace_ns is None else grace_ns
+        emitted = []
+        for state in self.states:
+            ended = np.flatnonzero((state.open >= 0) & ((state.open + 1) * state.window_ns + grace_ns <= now_ns))
+            if len(ended):
+                emitted.append(self._readings(state, ended, state.open[ended], state.acc[ended]))
+                state.closed[ended] = state.open[ended]
+                state.open[ended] = -1
+        return self._batches(emitted)
+
+    def flush(self, now_ns=None):
+        # Al terminar: los tramos ya vencidos, sin esperar; el que está en curso se
+        # pierde, como al detener el ESP32 a mitad de una ventana
+        return self.expire(time.time_ns() if now_ns is None else now_ns, 0)
+
+    def _readings(self, state, devices, buckets, acc):
+        # Tramos cerrados -> (índices de dispositivo, lecturas de modo 2)
+        data = ReadingBatch.empty(len(devices)).data
+        # Con el timestamp del fin del tramo, cuando el ESP32 mandaría su STATS
+        data["timestamp"] = (buckets + 1) * state.window_ns
+        data["temp_avg"] = acc[:, 1] / acc[:, 0]
+        data["temp_max"] = acc[:, 2]
+        data["temp_min"] = acc[:, 3]
+        data["hum_avg"] = acc[:, 4] / acc[:, 0]
+        data["hum_max"] = acc[:, 5]
+        data["hum_min"] = acc[:, 6]
+        data["mode"] = 2
+        data["window_ms"] = state.window_ms
+        return devices, data
+
+    def _batches(self, emitted):
+        # Un lote por dispositivo, en orden de tiempo
+        if not emitted:
+            return []
+        device = np.concatenate([devices for devices, _ in emitted])
+        data = lecturas.concatenate([data for _, data in emitted])
+        order = np.lexsort((data["timestamp"], device))
+        device = device[order]
+        data = data[order]
+        bounds = np.flatnonzero(np.concatenate(([True], device[1:] != device[:-1], [True])))
+        return [ReadingBatch(data[start:end], self.device_ids[device[start]])
+                for start, end in zip(bounds[:-1], bounds[1:])]
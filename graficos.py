@@ -0,0 +1,117 @@
+# Gráficos de temperatura y humedad que se actualizan sin redibujar todo
+#
+# Las líneas se crean una sola vez y en cada actualización solo cambian sus
+# datos. Los límites de los ejes se amplían con margen cuando un dato nuevo
+# queda fuera, así la mayoría de las actualizaciones no cambian los ejes y se
+# pueden hacer con blitting (solo se redibujan las líneas sobre un fondo
+# guardado). Cuando los ejes cambian se hace un draw_idle completo.
+#
+# Con más puntos que píxeles se dibuja solo el mínimo y el máximo de cada
+# par de columnas de píxeles: la línea se ve igual y Agg no recorre 100k vértices.
+import datetime
+
+import matplotlib.dates as mdates
+import numpy as np
+
+MARKER_MAX_POINTS = 200  # Con más puntos los marcadores no se distinguen y son costosos
+X_HEADROOM = 0.25        # Espacio libre a la derecha al ampliar el eje de tiempo
+Y_MARGIN = 0.10          # Margen vertical al ampliar el eje Y
+
+
+def epoch_to_num(epoch):
+    # Segundos desde 1970 a números de fecha de matplotlib (días desde 1970)
+    return np.asarray(epoch, dtype=float) / 86400.0
+
+
+def minmax_decimate(times, values, max_points):
+    # Reduce la serie a ~max_points puntos conservando el mínimo y el máximo de
+    # cada tramo, en orden temporal
+    n = len(times)
+    if n <= max_points:
+        return times, values
+    bucket = -(-n // max(max_points // 2, 1))
+    buckets = n // bucket
+    head = buckets * bucket
+    shaped = values[:head].reshape(buckets, bucket)
+    # Los NaN (lecturas faltantes) no deben ganar el mínimo ni el máximo
+    filled = np.where(np.isnan(shaped), np.nanmean(values) if np.isfinite(values).any() else 0.0, shaped)
+    offsets = np.arange(buckets) * bucket
+    lo = offsets + filled.argmin(axis=1)
+    hi = offsets + filled.argmax(axis=1)
+    index = np.sort(np.concatenate((lo, hi, np.arange(head, n))))
+    return times[index], values[index]
+
+
+class LivePlot:
+    def __init__(self, figure, axs):
+        self.figure = figure
+        self.canvas = figure.canvas
+        self.axs = axs
+        self.background = None
+        self.blit = getattr(self.canvas, "supports_blit", False)
+        # Las fechas se muestran en la hora local, igual que antes
+        tz = datetime.datetime.now().astimezone().tzinfo
+
+        self.lines = []
+        for ax, label, color in ((axs[0], 'Temperatura (C)', 'r'), (axs[1], 'Humedad (%)', 'b')):
+            line, = ax.plot([], [], label=label, color=color, marker='o', animated=self.blit)
+            ax.set_ylabel(label)
+            ax.legend(loc='upper left')
+            ax.grid(True)
+            self.lines.append(line)
+        self.axs[1].xaxis_date(tz)
+        self.axs[1].xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S', tz=tz))
+        self.figure.autofmt_xdate()
+        self.figure.tight_layout()
+
+        if self.blit:
+            # Cada redibujado completo (ejes nuevos, cambio de tamaño) renueva el fondo
+            self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for ax, line in zip(self.axs, self.lines):
+            ax.draw_artist(line)
+
+    def _expand_limits(self, times, series):
+        # Devuelve True si algún eje tuvo que cambiar
+        changed = False
+        x0, x1 = self.axs[1].get_xlim()
+        t_min, t_max = times[0], times[-1]
+        if t_min < x0 or t_max > x1 or (t_max - t_min) < (x1 - x0) * 0.5:
+            span = max(t_max - t_min, 1.0 / 86400)
+            self.axs[1].set_xlim(t_min, t_max + span * X_HEADROOM)
+            changed = True
+        for ax, values in zip(self.axs, series):
+            finite = values[np.isfinite(values)]
+            if not finite.size:
+                continue
+            y0, y1 = ax.get_ylim()
+            v_min, v_max = finite.min(), finite.max()
+            if v_min < y0 or v_max > y1 or (v_max - v_min) < (y1 - y0) * 0.25:
+                margin = max(v_max - v_min, 1.0) * Y_MARGIN
+                ax.set_ylim(v_min - margin, v_max + margin)
+                changed = True
+        return changed
+
+    def update(self, epochs, temperatures, humidities):
+        if len(epochs) == 0:
+            return
+        times = epoch_to_num(epochs)
+        temperatures = np.asarray(temperatures, dtype=float)
+        humidities = np.asarray(humidities, dtype=float)
+        marker = 'o' if len(times) <= MARKER_MAX_POINTS else ''
+        for ax, line, values in zip(self.axs, self.lines, (temperatures, humidities)):
+            line.set_data(*minmax_decimate(times, values, int(ax.bbox.width)))
+            line.set_marker(marker)
+
+        if self._expand_limits(times, (temperatures, humidities)) or not self.blit or self.background is None:
+            self.canvas.draw_idle()
+            return
+        # Los ejes no cambiaron: redibujar solo las líneas sobre el fondo guardado
+        self.canvas.restore_region(self.background)
+        self._draw_lines()
+        self.canvas.blit(self.figure.bbox)
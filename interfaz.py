@@ -0,0 +1,360 @@
+# Interfaz gráfica del monitor (PyQt5 + matplotlib)
+#
+# Puede correr en el mismo proceso que el daemon (python monitorpi.py --gui) o
+# como cliente aparte que se conecta a un daemon ya iniciado por el canal de
+# control (python interfaz.py). En ese caso el historial se lee directamente de
+# la base de datos, que en modo WAL admite lectores en otros procesos.
+import argparse
+import logging
+import queue
+import signal
+import sys
+import time
+
+import matplotlib
+matplotlib.use('Qt5Agg')
+import matplotlib.pyplot as plt
+
+import buffer_circular
+import control
+import estadisticas
+import graficos
+import metricas
+from basedatos import DataBase, DB_FILE, LOG_FORMAT, PLOT_POINTS
+
+from PyQt5 import QtWidgets, QtCore
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+
+UI_REFRESH_MS = 2000  # Cada cuánto se procesa la cola y se actualizan los gráficos
+# Rangos del gráfico (segundos); "En vivo" usa el caché en memoria
+PLOT_RANGES = (("En vivo", None), ("Última hora", 3600), ("Últimas 24 h", 86400),
+               ("Últimos 7 días", 7 * 86400), ("Últimos 30 días", 30 * 86400))
+
+log = logging.getLogger("interfaz")
+TICK_SECONDS = metricas.REGISTRY.histogram("gui_tick_seconds", "Tiempo de cada tick del timer de la interfaz")
+PLOT_SECONDS = metricas.REGISTRY.histogram("gui_plot_seconds", "Tiempo de actualizar los gráficos en un tick")
+
+# Clase principal de la interfaz gráfica
+class TemperatureHumidityMonitorApp(QtWidgets.QMainWindow):
+    def __init__(self, db, server, ui_queue, cache, stats, plot_points=PLOT_POINTS):
+        super().__init__()
+        self.db = db
+        self.server = server
+        self.ui_queue = ui_queue
+        self.cache = cache
+        self.stats = stats
+        self.plot_points = plot_points
+        self.setWindowTitle("Monitor de Temperatura y Humedad")
+        self.setGeometry(100, 100, 1000, 600)  # Aumentamos el ancho para acomodar nuevos elementos
+
+        # Widget principal
+        self.central_widget = QtWidgets.QWidget()
+        self.setCentralWidget(self.central_widget)
+
+        # Layout principal dividido en dos columnas
+        self.main_layout = QtWidgets.QHBoxLayout(self.central_widget)
+
+        # Layout izquierdo para los valores numéricos y controles
+        self.left_layout = QtWidgets.QVBoxLayout()
+
+        # Grupo para mostrar lecturas numéricas
+        self.sensorGroup = QtWidgets.QGroupBox("Lecturas de Temperatura y Humedad")
+        self.sensorLayout = QtWidgets.QGridLayout()  # Cambiamos a GridLayout para acomodar más elementos
+
+        # LCDs para mostrar valores de temperatura y humedad
+        self.n1Temperatura = QtWidgets.QLCDNumber()
+        self.n1Temperatura.setSegmentStyle(QtWidgets.QLCDNumber.Flat)
+        self.n2Humedad = QtWidgets.QLCDNumber()
+        self.n2Humedad.setSegmentStyle(QtWidgets.QLCDNumber.Flat)
+
+        # Etiquetas y LCDs para valores promedio, máximo y mínimo
+        self.temp_avg_label = QtWidgets.QLabel("Temp Promedio (C)")
+        self.temp_avg_display = QtWidgets.QLCDNumber()
+        self.temp_max_label = QtWidgets.QLabel("Temp Máxima (C)")
+        self.temp_max_display = QtWidgets.QLCDNumber()
+        self.temp_min_label = QtWidgets.QLabel("Temp Mínima (C)")
+        self.temp_min_display = QtWidgets.QLCDNumber()
+
+        self.hum_avg_label = QtWidgets.QLabel("Hum Promedio (%)")
+        self.hum_avg_display = QtWidgets.QLCDNumber()
+        self.hum_max_label = QtWidgets.QLabel("Hum Máxima (%)")
+        self.hum_max_display = QtWidgets.QLCDNumber()
+        self.hum_min_label = QtWidgets.QLabel("Hum Mínima (%)")
+        self.hum_min_display = QtWidgets.QLCDNumber()
+
+        # Añadir los LCDs y etiquetas al layout del grupo
+        self.sensorLayout.addWidget(QtWidgets.QLabel("Temperatura Actual (C)"), 0, 0)
+        self.sensorLayout.addWidget(self.n1Temperatura, 0, 1)
+        self.sensorLayout.addWidget(QtWidgets.QLabel("Humedad Actual (%)"), 1, 0)
+        self.sensorLayout.addWidget(self.n2Humedad, 1, 1)
+
+        self.sensorLayout.addWidget(self.temp_avg_label, 2, 0)
+        self.sensorLayout.addWidget(self.temp_avg_display, 2, 1)
+        self.sensorLayout.addWidget(self.temp_max_label, 3, 0)
+        self.sensorLayout.addWidget(self.temp_max_display, 3, 1)
+        self.sensorLayout.addWidget(self.temp_min_label, 4, 0)
+        self.sensorLayout.addWidget(self.temp_min_display, 4, 1)
+
+        self.sensorLayout.addWidget(self.hum_avg_label, 5, 0)
+        self.sensorLayout.addWidget(self.hum_avg_display, 5, 1)
+        self.sensorLayout.addWidget(self.hum_max_label, 6, 0)
+        self.sensorLayout.addWidget(self.hum_max_display, 6, 1)
+        self.sensorLayout.addWidget(self.hum_min_label, 7, 0)
+        self.sensorLayout.addWidget(self.hum_min_display, 7, 1)
+
+        self.sensorGroup.setLayout(self.sensorLayout)
+        self.left_layout.addWidget(self.sensorGroup)
+
+        # Añadir controles
+        self.controlGroup = QtWidgets.QGroupBox("Controles")
+        self.controlLayout = QtWidgets.QVBoxLayout()
+
+        self.deviceLabel = QtWidgets.QLabel("Dispositivo:")
+        self.deviceSelector = QtWidgets.QComboBox()
+        self.deviceSelector.addItem("Todos")
+
+        self.rangeLabel = QtWidgets.QLabel("Rango del Gráfico:")
+        self.rangeSelector = QtWidgets.QComboBox()
+        for name, seconds in PLOT_RANGES:
+            self.rangeSelector.addItem(name, seconds)
+        self.rangeSelector.currentIndexChanged.connect(self.graficar_datos)
+
+        self.startButton = QtWidgets.QPushButton("Iniciar Monitoreo")
+        self.startButton.clicked.connect(self.start_monitoring)
+        self.stopButton = QtWidgets.QPushButton("Detener Monitoreo")
+        self.stopButton.clicked.connect(self.stop_monitoring)
+
+        self.mode1Button = QtWidgets.QPushButton("Modo 1 (Datos en Bruto)")
+        self.mode1Button.clicked.connect(self.set_mode1)
+        self.mode2Button = QtWidgets.QPushButton("Modo 2 (Datos Procesados)")
+        self.mode2Button.clicked.connect(self.set_mode2)
+
+        self.freqLabel = QtWidgets.QLabel("Frecuencia de Muestreo (ms):")
+        self.freqInput = QtWidgets.QSpinBox()
+        self.freqInput.setRange(100, 10000)
+        self.freqInput.setValue(1000)
+        self.freqButton = QtWidgets.QPushButton("Establecer Frecuencia")
+        self.freqButton.clicked.connect(self.set_frequency)
+
+        self.windowLabel = QtWidgets.QLabel("Ventana de Tiempo (ms):")
+        self.windowInput = QtWidgets.QSpinBox()
+        self.windowInput.setRange(1000, 60000)
+        self.windowInput.setValue(5000)
+        self.windowButton = QtWidgets.QPushButton("Establecer Ventana")
+        self.windowButton.clicked.connect(self.set_window)
+
+        # Añadir controles al layout
+        self.controlLayout.addWidget(self.deviceLabel)
+        self.controlLayout.addWidget(self.deviceSelector)
+        self.controlLayout.addWidget(self.rangeLabel)
+        self.controlLayout.addWidget(self.rangeSelector)
+        self.controlLayout.addWidget(self.startButton)
+        self.controlLayout.addWidget(self.stopButton)
+        self.controlLayout.addWidget(self.mode1Button)
+        self.controlLayout.addWidget(self.mode2Button)
+        self.controlLayout.addWidget(self.freqLabel)
+        self.controlLayout.addWidget(self.freqInput)
+        self.controlLayout.addWidget(self.freqButton)
+        self.controlLayout.addWidget(self.windowLabel)
+        self.controlLayout.addWidget(self.windowInput)
+        self.controlLayout.addWidget(self.windowButton)
+
+        self.controlGroup.setLayout(self.controlLayout)
+        self.left_layout.addWidget(self.controlGroup)
+
+        # Añadir la sección de la izquierda al layout principal
+        self.main_layout.addLayout(self.left_layout)
+
+        # Área de gráficos en la sección derecha (dos gráficos: temperatura y humedad)
+        self.figure, self.axs = plt.subplots(2, 1, figsize=(8, 10), sharex=True)
+        self.canvas = FigureCanvas(self.figure)
+        self.main_layout.addWidget(self.canvas, stretch=3)
+        self.live_plot = graficos.LivePlot(self.figure, self.axs)
+        self.history = (None, 0, None)  # Última serie reducida pedida a SQLite
+
+        # Timer para procesar la cola y actualizar los datos automáticamente
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.process_data_queue)
+        self.timer.start(UI_REFRESH_MS)
+
+        # Actualizar los datos inicialmente al iniciar la aplicación
+        self.actualizar_datos()
+
+    def selected_device(self):
+        # None significa enviar el comando a todos los dispositivos
+        if self.deviceSelector.currentIndex() <= 0:
+            return None
+        return self.deviceSelector.currentText()
+
+    def actualizar_dispositivos(self):
+        devices = sorted(self.server.connected_devices())
+        current = [self.deviceSelector.itemText(i) for i in range(1, self.deviceSelector.count())]
+        if devices != current:
+            selected = self.deviceSelector.currentText()
+            self.deviceSelector.clear()
+            self.deviceSelector.addItem("Todos")
+            self.deviceSelector.addItems(devices)
+            index = self.deviceSelector.findText(selected)
+            self.deviceSelector.setCurrentIndex(max(index, 0))
+
+    def start_monitoring(self):
+        self.server.send_command("START", self.selected_device())
+
+    def stop_monitoring(self):
+        self.server.send_command("STOP", self.selected_device())
+
+    def set_mode1(self):
+        self.server.send_command("MODE1", self.selected_device())
+
+    def set_mode2(self):
+        self.server.send_command("MODE2", self.selected_device())
+
+    def set_frequency(self):
+        freq = self.freqInput.value()
+        self.server.send_command(f"SET_FREQ {freq}", self.selected_device())
+
+    def set_window(self):
+        window = self.windowInput.value()
+        self.server.send_command(f"SET_WINDOW {window}", self.selected_device())
+        # La ventana por tiempo local sigue a la del ESP32 para poder compararlas
+        self.stats.set_window("firmware", duration=window / 1000, device_id=self.selected_device())
+
+    def process_data_queue(self):
+        # Procesa los lotes que el hilo escritor ya guardó en la base de datos
+        # (listas de ReadingBatch); los displays solo muestran la última lectura de cada modo
+        t0 = time.perf_counter()
+        last = {}
+        while True:
+            try:
+                batches = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.stats.add(batches)
+            for batch in batches:
+                for mode in (1, 2):
+                    data = batch.last(mode)
+                    if data is not None:
+                        last[mode] = data
+        if 1 in last:
+            # Datos en bruto
+            data = last[1]
+            self.n1Temperatura.display(data[1])
+            self.n2Humedad.display(data[2])
+        if 2 in last:
+            # Datos procesados: mostrar los valores enviados por el ESP32
+            data = last[2]
+            self.temp_avg_display.display(data[3])
+            self.temp_max_display.display(data[4])
+            self.temp_min_display.display(data[5])
+            self.hum_avg_display.display(data[6])
+            self.hum_max_display.display(data[7])
+            self.hum_min_display.display(data[8])
+        # Después de procesar los datos, actualiza la interfaz
+        self.actualizar_dispositivos()
+        self.actualizar_datos()
+        TICK_SECONDS.record(time.perf_counter() - t0)
+
+    def actualizar_datos(self):
+        # Valores internos promedio, máximo y mínimo de las últimas lecturas; el
+        # tooltip muestra la misma ventana por tiempo que usa el ESP32
+        device_id = self.selected_device()
+        internal = self.stats.summary(device_id, "ultimas")
+        firmware = self.stats.summary(device_id, "firmware")
+        labels = (
+            ("temperature", "Temp", "(C)", self.temp_avg_label, self.temp_max_label, self.temp_min_label),
+            ("humidity", "Hum", "(%)", self.hum_avg_label, self.hum_max_label, self.hum_min_label),
+        )
+        for field, name, unit, avg_label, max_label, min_label in labels:
+            values = internal[field]
+            if values is None:
+                continue
+            avg_label.setText(f"{name} Promedio {unit} (Int: {values['avg']:.2f})")
+            max_label.setText(f"{name} Máxima {unit} (Int: {values['max']:.2f})")
+            min_label.setText(f"{name} Mínima {unit} (Int: {values['min']:.2f})")
+            window = firmware[field]
+            tooltip = "" if window is None else (
+                f"Ventana del ESP32 ({window['count']} lecturas): promedio {window['avg']:.2f}, "
+                f"máx {window['max']:.2f}, mín {window['min']:.2f}, desv. {window['std']:.2f}")
+            for label in (avg_label, max_label, min_label):
+                label.setToolTip(tooltip)
+
+        # Actualizar gráficos
+        self.graficar_datos()
+
+    def graficar_datos(self):
+        # En vivo los puntos salen del caché en memoria; SQLite solo se consulta si
+        # se piden más puntos de los que el caché conserva. Los rangos largos se
+        # piden ya reducidos a plot_points
+        seconds = self.rangeSelector.currentData()
+        device_id = self.selected_device()
+        if seconds is None:
+            epochs, temperaturas, humedades = self.cache.series(self.plot_points, device_id, self.db)
+        else:
+            # Cada punto cubre seconds / plot_points segundos: antes de eso la
+            # serie reducida no cambia y no vale la pena volver a consultarla
+            now = time.time()
+            key, queried_at, series = self.history
+            if key != (seconds, device_id) or now - queried_at >= seconds / self.plot_points:
+                series = self.db.fetch_downsampled(now - seconds, now, device_id, points=self.plot_points)
+                self.history = ((seconds, device_id), now, series)
+            epochs, temperaturas, humedades = series
+        with PLOT_SECONDS.time():
+            self.live_plot.update(epochs, temperaturas, humedades)
+
+    def closeEvent(self, event):
+        # Al cerrar la ventana, detener el servidor
+        self.server.stop()
+        event.accept()
+
+
+def run(db, server, ui_queue, cache, plot_points=PLOT_POINTS, qt_args=()):
+    # Abre la ventana y bloquea hasta que se cierre. "server" es el servidor TCP
+    # (mismo proceso) o un control.DaemonClient
+    app = QtWidgets.QApplication(sys.argv[:1] + list(qt_args))
+    main_window = TemperatureHumidityMonitorApp(db, server, ui_queue, cache, estadisticas.StatsEngine(),
+                                                plot_points=plot_points)
+    main_window.show()
+    # Se avisa cuando el event loop ya corre, es decir, con la ventana dibujada
+    QtCore.QTimer.singleShot(0, lambda: log.info("Interfaz lista"))
+
+    # Ctrl+C cierra la ventana (el timer de la interfaz deja correr a Python)
+    def signal_handler(sig, frame):
+        log.info("Interrupción recibida, cerrando la interfaz...")
+        app.quit()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    return app.exec_()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interfaz del monitor de temperatura y humedad")
+    parser.add_argument("--host", default=control.CONTROL_HOST, help="dirección del canal de control del daemon")
+    parser.add_argument("--control-port", type=int, default=control.CONTROL_PORT,
+                        help="puerto del canal de control del daemon")
+    parser.add_argument("--db", default=DB_FILE, help="base de datos del daemon (para el historial)")
+    parser.add_argument("--plot-points", type=int, default=PLOT_POINTS,
+                        help="cantidad de puntos visibles en los gráficos")
+    parser.add_argument("--cache-capacity", type=int, default=buffer_circular.CACHE_CAPACITY,
+                        help="lecturas recientes en memoria por dispositivo y modo")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="nivel de los mensajes en la salida")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="segundos entre resúmenes de las métricas de la interfaz en el log; 0 los desactiva")
+    args, qt_args = parser.parse_known_args()
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT, stream=sys.stdout)
+
+    db = DataBase(args.db)
+    cache = buffer_circular.HotCache(args.cache_capacity)
+    cache.load_rows(db.fetch_last_data(args.plot_points))
+    try:
+        client = control.DaemonClient(args.host, args.control_port, cache)
+    except OSError as e:
+        log.error("No se pudo conectar con el daemon en %s:%s (%s). Inícialo con: python monitorpi.py",
+                  args.host, args.control_port, e)
+        sys.exit(1)
+    client.start()
+    if args.stats_interval > 0:
+        metricas.StatsReporter(args.stats_interval).start()
+    try:
+        sys.exit(run(db, client, client.ui_queue, cache, args.plot_points, qt_args))
+    finally:
+        client.stop()
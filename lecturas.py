@@ -0,0 +1,176 @@
+# Lotes de lecturas como arreglos estructurados de NumPy
+#
+# Las lecturas viajaban como tuplas de 11 elementos, una por lectura, desde el
+# parser hasta SQLite y la interfaz. Un ReadingBatch guarda un lote completo de
+# un dispositivo en un solo arreglo (READING_DTYPE, 49 bytes por lectura):
+# timestamp entero en nanosegundos desde 1970 (UTC), valores en float32 y NaN
+# donde la tupla tenía None. El parser arma los lotes directamente, la cola los
+# mueve sin abrirlos y SQLite, el caché, las estadísticas y los gráficos operan
+# por columnas. Solo se vuelve a tuplas en los bordes: executemany de SQLite y
+# el JSON del canal de control (to_rows()).
+import numpy as np
+
+READING_DTYPE = np.dtype([
+    ("timestamp", np.int64),     # ns desde 1970 (UTC)
+    ("temperature", np.float32),
+    ("humidity", np.float32),
+    ("temp_avg", np.float32),
+    ("temp_max", np.float32),
+    ("temp_min", np.float32),
+    ("hum_avg", np.float32),
+    ("hum_max", np.float32),
+    ("hum_min", np.float32),
+    ("mode", np.int8),
+    ("samples", np.int32),       # Lecturas en bruto que resume una lectura armada por la cola; 0 si no
+    ("window_ms", np.int32),     # Ventana de una lectura de modo 2 calculada en el servidor; 0 si no
+])
+_RECORD = np.dtype((np.void, READING_DTYPE.itemsize))
+VALUE_FIELDS = READING_DTYPE.names[1:9]
+# Columnas de valores de cada modo, en el orden de la tupla de lectura
+MODE_FIELDS = {
+    1: ("temperature", "humidity"),
+    2: ("temp_avg", "temp_max", "temp_min", "hum_avg", "hum_max", "hum_min"),
+}
+DECIMALS = 2    # Resolución de los valores en el protocolo (%.2f / centésimas)
+NS = 1000000000
+
+# Una lectura vacía (valores en NaN) como bytes, para ReadingBatch.empty()
+_EMPTY = np.array([(0,) + (np.nan,) * len(VALUE_FIELDS) + (0, 0, 0)], dtype=READING_DTYPE).tobytes()
+
+
+class ReadingBatch:
+    __slots__ = ("data", "device_id")
+
+    def __init__(self, data, device_id=None):
+        self.data = data
+        self.device_id = device_id
+
+    @classmethod
+    def empty(cls, n, device_id=None):
+        # Lote de n lecturas con todos los valores en NaN, copiando los bytes de
+        # _EMPTY: asignar campo por campo cuesta más que el resto del parser
+        return cls(np.frombuffer(bytearray(_EMPTY * n), dtype=READING_DTYPE), device_id)
+
+    @classmethod
+    def raw(cls, timestamps_ns, temperatures, humidities, device_id=None):
+        # Lecturas de modo 1 a partir de columnas
+        batch = cls.empty(len(temperatures), device_id)
+        batch.data["timestamp"] = timestamps_ns
+        batch.data["temperature"] = temperatures
+        batch.data["humidity"] = humidities
+        batch.data["mode"] = 1
+        return batch
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Tuplas de lectura (timestamp en segundos, como fetch_last_data o el
+        # JSON del canal de control) -> un lote por dispositivo, en orden
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[10], []).append(row)
+        batches = []
+        for device_id, group in groups.items():
+            batch = cls.empty(len(group), device_id)
+            # None -> NaN al convertir a float
+            columns = np.array([row[:10] for row in group], dtype=np.float64).reshape(-1, 10)
+            batch.data["timestamp"] = np.round(columns[:, 0] * NS)
+            for i, name in enumerate(VALUE_FIELDS, 1):
+                batch.data[name] = columns[:, i]
+            batch.data["mode"] = columns[:, 9]
+            batches.append(batch)
+        return batches
+
+    @classmethod
+    def concat(cls, batches):
+        # Junta lotes de un mismo dispositivo
+        if len(batches) == 1:
+            return batches[0]
+        return cls(concatenate([batch.data for batch in batches]), batches[0].device_id)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        # Tramo o máscara del lote, del mismo dispositivo
+        return ReadingBatch(self.data[index], self.device_id)
+
+    def __repr__(self):
+        return f"ReadingBatch({len(self.data)} lecturas, device_id={self.device_id!r})"
+
+    def timestamps(self):
+        # Segundos desde 1970 como float64, como time.time()
+        return self.data["timestamp"] / NS
+
+    def values(self, name):
+        # Columna en float64 redondeada a la resolución del protocolo: float32
+        # guarda 21.37 como 21.3700008..., así vuelve a ser el mismo número
+        return np.round(self.data[name].astype(np.float64), DECIMALS)
+
+    def columns(self):
+        # Columnas de la tupla de lectura como listas de Python, con None en lugar de
+        # NaN: timestamp (s), 8 valores, modo y dispositivo
+        n = len(self.data)
+        columns = [self.timestamps().tolist()]
+        for name in VALUE_FIELDS:
+            values = self.values(name)
+            missing = np.isnan(values)
+            if missing.any():
+                values = values.astype(object)
+                values[missing] = None
+            columns.append(values.tolist())
+        columns.append(self.data["mode"].tolist())
+        columns.append([self.device_id] * n)
+        return columns
+
+    def last(self, mode=None):
+        # Tupla de la última lectura del lote (o del modo indicado); None si no hay
+        index = np.flatnonzero(self.data["mode"] == mode) if mode is not None else range(len(self.data))
+        if not len(index):
+            return None
+        record = self.data[index[-1]].item()
+        values = [None if v != v else round(v, DECIMALS) for v in record[1:9]]
+        return (record[0] / NS, *values, record[9], self.device_id)
+
+    def to_rows(self):
+        # Tuplas de lectura, para el JSON del canal de control y el código que
+        # todavía las espera
+        return list(zip(*self.columns()))
+
+
+def summary_columns(data):
+    # Lecturas de modo 1 y resumidas (modo 2) como columnas comparables: peso
+    # (lecturas en bruto que representa cada una) y valor, mínimo y máximo de
+    # temperatura y humedad. Una lectura de modo 1 es su propio mínimo y máximo
+    raw = data["mode"] == 1
+    temperature = data["temperature"]
+    humidity = data["humidity"]
+    if raw.all():
+        return (np.ones(len(data)), temperature.astype(np.float64), temperature, temperature,
+                humidity.astype(np.float64), humidity, humidity)
+    weights = np.where(raw, 1, data["samples"]).astype(np.float64)
+    return (weights,
+            np.where(raw, temperature, data["temp_avg"]).astype(np.float64),
+            np.where(raw, temperature, data["temp_max"]),
+            np.where(raw, temperature, data["temp_min"]),
+            np.where(raw, humidity, data["hum_avg"]).astype(np.float64),
+            np.where(raw, humidity, data["hum_max"]),
+            np.where(raw, humidity, data["hum_min"]))
+
+
+def concatenate(arrays):
+    # np.concatenate con arreglos estructurados compara los campos de cada uno
+    # (decenas de µs por arreglo); vistos como bytes opacos no
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.concatenate([a.view(_RECORD) for a in arrays]).view(READING_DTYPE)
+
+
+def count(batches):
+    return sum(len(batch.data) for batch in batches)
+
+
+def to_rows(batches):
+    rows = []
+    for batch in batches:
+        rows.extend(batch.to_rows())
+    return rows
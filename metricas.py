@@ -0,0 +1,297 @@
+# Métricas internas del monitor: contadores, valores instantáneos e histogramas
+# de latencia por etapa (recepción, decodificación, cola, SQLite, dibujo)
+#
+# Los histogramas son de tipo HDR: cubetas log-lineales (SUB_BUCKETS por cada
+# potencia de dos) desde MIN_VALUE segundos, así registrar un valor es O(1) y el
+# error relativo de los percentiles queda acotado (~1/SUB_BUCKETS) sin guardar
+# las muestras. Se exponen en formato de texto de Prometheus por HTTP local
+# (MetricsServer, GET /metrics) o como un resumen periódico en el log
+# (StatsReporter). No se usan locks al registrar: entre hilos, en el peor caso
+# se pierde algún incremento.
+import asyncio
+import logging
+import math
+import socket
+import threading
+import time
+
+METRICS_HOST = "127.0.0.1"  # Solo conexiones locales
+METRICS_PORT = 9108
+PREFIX = "monitorpi_"
+MIN_VALUE = 1e-6            # Valores menores van a la primera cubeta (1 µs)
+SUB_BUCKETS = 8             # Cubetas por cada potencia de dos
+OCTAVES = 32                # 1 µs * 2**32 ~ 70 minutos; lo más lento va a la última
+QUANTILES = (0.5, 0.9, 0.99)
+
+log = logging.getLogger(__name__)
+
+
+class Counter:
+    # Contador que solo crece, opcionalmente separado por una etiqueta (p. ej. device)
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, value=1, label_value=None):
+        self.values[label_value] = self.values.get(label_value, 0) + value
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        lines = [f"# HELP {PREFIX}{self.name} {self.help}", f"# TYPE {PREFIX}{self.name} counter"]
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            lines.append(f"{PREFIX}{self.name}{_labels(self.label, label_value)} {value}")
+        return lines
+
+
+class Gauge:
+    # Valor que se lee recién al exportar (profundidad de la cola, etc.). Con
+    # kind="counter" sirve para contadores que ya lleva otro objeto
+    def __init__(self, name, help, func, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.kind = kind
+
+    def render(self):
+        return [f"# HELP {PREFIX}{self.name} {self.help}", f"# TYPE {PREFIX}{self.name} {self.kind}",
+                f"{PREFIX}{self.name} {self.func()}"]
+
+
+class Histogram:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.counts = [0] * (OCTAVES * SUB_BUCKETS + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value, n=1):
+        # value en segundos, n veces. Es bucket_index() escrita en línea porque se
+        # llama en cada mensaje
+        self.count += n
+        self.sum += value * n
+        if value > self.max:
+            self.max = value
+        if value <= MIN_VALUE:
+            self.counts[0] += n
+            return
+        mantissa, exponent = math.frexp(value / MIN_VALUE)
+        if exponent > OCTAVES:
+            self.counts[-1] += n
+        else:
+            self.counts[(exponent - 1) * SUB_BUCKETS + 1 + int((mantissa * 2 - 1) * SUB_BUCKETS)] += n
+
+    def time(self):
+        # with histogram.time(): ...
+        return _Timer(self)
+
+    def quantile(self, q):
+        # Límite superior de la cubeta donde cae el percentil q (0 < q <= 1)
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def render(self):
+        # Prometheus solo recibe las potencias de dos como límites "le"; las
+        # subcubetas se usan para los percentiles del resumen
+        name = PREFIX + self.name
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} histogram"]
+        cumulative = self.counts[0]
+        lines.append(f'{name}_bucket{{le="{MIN_VALUE:g}"}} {cumulative}')
+        for octave in range(OCTAVES):
+            start = 1 + octave * SUB_BUCKETS
+            cumulative += sum(self.counts[start:start + SUB_BUCKETS])
+            lines.append(f'{name}_bucket{{le="{MIN_VALUE * 2 ** (octave + 1):g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+    def summary(self):
+        if not self.count:
+            return f"{self.name}: sin datos"
+        quantiles = " ".join(f"p{int(q * 100)}={_ms(self.quantile(q))}" for q in QUANTILES)
+        return (f"{self.name}: n={self.count} prom={_ms(self.sum / self.count)} {quantiles} "
+                f"máx={_ms(self.max)}")
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+def bucket_index(value):
+    if value <= MIN_VALUE:
+        return 0
+    # value / MIN_VALUE = mantisa * 2**exponente con 0.5 <= mantisa < 1
+    mantissa, exponent = math.frexp(value / MIN_VALUE)
+    octave = exponent - 1
+    if octave >= OCTAVES:
+        return OCTAVES * SUB_BUCKETS
+    return 1 + octave * SUB_BUCKETS + int((mantissa * 2 - 1) * SUB_BUCKETS)
+
+
+def bucket_upper(index):
+    if index == 0:
+        return MIN_VALUE
+    octave, sub = divmod(index - 1, SUB_BUCKETS)
+    return MIN_VALUE * 2 ** octave * (1 + (sub + 1) / SUB_BUCKETS)
+
+
+def _labels(label, value):
+    if label is None or value is None:
+        return ""
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'{{{label}="{escaped}"}}'
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.3g}ms"
+
+
+# Registro de métricas del proceso. Los módulos crean sus métricas una vez y
+# guardan la referencia para no buscarlas por nombre en cada mensaje
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name, factory):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help, label=None):
+        return self._get(name, lambda: Counter(name, help, label))
+
+    def histogram(self, name, help):
+        return self._get(name, lambda: Histogram(name, help))
+
+    def gauge(self, name, help, func, kind="gauge"):
+        # Si ya existía se reemplaza la función (p. ej. una cola nueva)
+        with self.lock:
+            gauge = self.metrics[name] = Gauge(name, help, func, kind)
+            return gauge
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                log.warning("No se pudo exportar la métrica %s: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                lines.append(metric.summary())
+            elif isinstance(metric, Counter):
+                lines.append(f"{metric.name}: {metric.total()}")
+            else:
+                lines.append(f"{metric.name}: {metric.func()}")
+        return lines
+
+
+REGISTRY = Registry()
+
+
+# Endpoint HTTP local con las métricas en formato de texto de Prometheus. Es un
+# servidor HTTP/1.0 mínimo sobre asyncio (un GET por conexión): http.server
+# agrega ~60 ms de imports al arranque del daemon
+class MetricsServer(threading.Thread):
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT):
+        threading.Thread.__init__(self, daemon=True)
+        self.registry = registry
+        self.host = host
+        self.port = port
+        # El socket se abre aquí para que un puerto ocupado falle en el hilo principal
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen()
+        self.server_socket.setblocking(False)
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(asyncio.start_server(self.handle, sock=self.server_socket))
+            log.info("Métricas en http://%s:%s/metrics", self.host, self.port)
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+            parts = request.split(b" ", 2)
+            path = parts[1].split(b"?")[0] if len(parts) > 1 else b""
+            if parts[0] != b"GET":
+                status, body = "405 Method Not Allowed", b""
+            elif path in (b"/", b"/metrics"):
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b""
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError:
+            # El event loop ya está cerrado
+            pass
+
+
+# Resumen de las métricas en el log cada interval segundos
+class StatsReporter(threading.Thread):
+    def __init__(self, interval, registry=REGISTRY):
+        threading.Thread.__init__(self, daemon=True)
+        self.interval = interval
+        self.registry = registry
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            log.info("Métricas:\n  %s", "\n  ".join(self.registry.summary_lines()))
+
+    def stop(self):
+        self.stop_event.set()
@@ -1,509 +1,685 @@
+import argparse
+import asyncio
+import collections
+import logging
 import socket
 import threading
 import sqlite3
-import datetime
 import sys
-import matplotlib
-matplotlib.use('Qt5Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import queue
 import signal
-
-from PyQt5 import QtWidgets, QtCore
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+import time
+
+import alertas
+import bitacora
+import buffer_circular
+import cola
+import comandos
+import control
+import difusion
+import estadisticas
+import lecturas
+import metricas
+import protocolo
+from basedatos import DB_FILE, DB_SYNCHRONOUS, LOG_FORMAT, PLOT_POINTS, DataBase
 
 # Configuraciones del Servidor TCP
 SERVER_IP = "0.0.0.0"  # Escuchar en todas las interfaces
 SERVER_PORT = 8888
-BUFFER_SIZE = 1024
-
-# Base de datos SQLite
-DB_FILE = "sensor_data.db"
-
-# Clase para manejar la base de datos
-class DataBase:
-    def __init__(self, db_file):
-        self.conn = sqlite3.connect(db_file)
-        self.create_table()
-
-    def create_table(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS SensorData (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                temperature REAL,
-                humidity REAL,
-                temp_avg REAL,
-                temp_max REAL,
-                temp_min REAL,
-                hum_avg REAL,
-                hum_max REAL,
-                hum_min REAL,
-                mode INTEGER NOT NULL
-            )
-        ''')
-        self.conn.commit()
-
-    def insert_data(self, timestamp, temperature, humidity, temp_avg=None, temp_max=None, temp_min=None,
-                    hum_avg=None, hum_max=None, hum_min=None, mode=1):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO SensorData (timestamp, temperature, humidity, temp_avg, temp_max, temp_min,
-                                    hum_avg, hum_max, hum_min, mode)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (timestamp, temperature, humidity, temp_avg, temp_max, temp_min, hum_avg, hum_max, hum_min, mode))
-        self.conn.commit()
-
-    def fetch_last_data(self, limit=20):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, temperature, humidity, temp_avg, temp_max, temp_min,
-                   hum_avg, hum_max, hum_min, mode FROM SensorData
-            ORDER BY id DESC LIMIT ?
-        ''', (limit,))
-        return cursor.fetchall()[::-1]  # Revertir para orden cronologico
+BACKLOG = 512  # Conexiones pendientes permitidas en listen()
+BINARY_PROTOCOL = True  # Ofrecer el protocolo binario a las placas que lo soporten
+# Etiqueta de las métricas por dispositivo de las conexiones que aún no enviaron
+# HELLO: su ip:puerto cambia en cada reconexión y sería una serie nueva cada vez
+UNKNOWN_DEVICE = "unknown"
+
+# Hilo escritor de la base de datos (el esquema y las consultas están en basedatos.py)
+DB_BATCH_SIZE = 500     # Filas por transacción en el hilo escritor
+DB_FLUSH_MS = 250       # Tiempo máximo que una lectura espera antes de escribirse
+
+# Log y métricas por etapa. El logger tiene nombre fijo porque al correr como
+# script __name__ es "__main__"
+log = logging.getLogger("monitorpi")
+_registry = metricas.REGISTRY
+RECEIVED_BYTES = _registry.counter("received_bytes_total", "Bytes recibidos de las placas", "device")
+READINGS_RECEIVED = _registry.counter("readings_total", "Lecturas DATA/STATS recibidas", "device")
+UNKNOWN_MESSAGES = _registry.counter("unknown_messages_total", "Líneas que no son DATA/STATS", "device")
+LOST_READINGS = _registry.counter("lost_readings_total", "Lecturas perdidas según la secuencia binaria", "device")
+DECODE_SECONDS = _registry.histogram("decode_seconds", "Tiempo de decodificar lo recibido en un recv")
+ENQUEUE_SECONDS = _registry.histogram("enqueue_seconds", "Tiempo de put (incluye la espera de la política block)")
+DB_INSERT_SECONDS = _registry.histogram("db_insert_seconds", "Tiempo de insert_many por lote, con resúmenes y commit")
+DB_ROWS = _registry.counter("db_rows_total", "Filas escritas por el hilo escritor")
+DERIVED_ROWS = _registry.counter("derived_rows_total", "Lecturas de modo 2 calculadas en el servidor")
+DB_ERRORS = _registry.counter("db_errors_total", "Lotes que fallaron al escribirse (se reintentan)")
+
+
+# Hilo que vacía la cola de datos y escribe en la base de datos por lotes
+class DataBaseWriter(threading.Thread):
+    def __init__(self, db_file, data_queue, ui_queue=None, batch_size=DB_BATCH_SIZE, flush_ms=DB_FLUSH_MS,
+                 synchronous=DB_SYNCHRONOUS, windows=estadisticas.SERVER_WINDOWS):
+        threading.Thread.__init__(self, daemon=True)
+        self.db_file = db_file
+        self.data_queue = data_queue
+        # Los lotes ya guardados se reenvían aquí para la interfaz
+        self.ui_queue = ui_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.synchronous = synchronous
+        self.rows_written = 0
+        self.batches_written = 0
+        # Lecturas de modo 2 calculadas aquí a partir de las de modo 1; se guardan
+        # con las demás pero no van a la interfaz ni cuentan en rows_written
+        self.aggregator = estadisticas.WindowAggregator(windows) if windows else None
+        self.derived_written = 0
+        # Alertas que llegan desde el hilo de ingesta (add_alerts), para la tabla Alerts
+        self.alerts = collections.deque()
+
+    def run(self):
+        # La conexión de SQLite debe crearse en el mismo hilo que la usa
+        db = DataBase(self.db_file, wal=True, synchronous=self.synchronous)
+        # Lotes (ReadingBatch) de la transacción en curso y cuántas lecturas suman
+        batch = []
+        pending = 0
+        derived = []
+        alerts = []
+        # Posición de la bitácora después de lo que hay en batch (None sin bitácora)
+        checkpoint = None
+        deadline = None
+        drained = False
+        while not drained or batch or derived or alerts:
+            timeout = self.flush_interval if deadline is None else max(deadline - time.monotonic(), 0)
+            # Se toma de una vez todo lo que quepa en el lote (nada si un lote lleno falló)
+            items = self.data_queue.get_batch(self.batch_size - pending, timeout) if pending < self.batch_size else []
+            self.data_queue.sync()
+            while self.alerts:
+                alerts.append(self.alerts.popleft())
+            if (items or alerts) and deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if items:
+                batch.extend(items)
+                pending += lecturas.count(items)
+                checkpoint = self.data_queue.position()
+                if self.aggregator is not None:
+                    derived.extend(self.aggregator.add(items))
+            # Cola cerrada por stop() y vacía: se escribe lo que quede y se termina
+            drained = self.data_queue.drained()
+            if self.aggregator is not None and (drained or batch):
+                # Ventanas de dispositivos que dejaron de mandar; al terminar, todas
+                # las vencidas según el reloj
+                derived.extend(self.aggregator.flush() if drained else self.aggregator.expire())
+            if (batch or derived or alerts) and (drained or pending >= self.batch_size or
+                                                 time.monotonic() >= deadline):
+                try:
+                    t0 = time.perf_counter()
+                    db.insert_many(batch + derived, alerts, checkpoint)
+                    DB_INSERT_SECONDS.record(time.perf_counter() - t0)
+                except sqlite3.Error as e:
+                    # Se reintenta en la siguiente vuelta con el mismo lote; con
+                    # bitácora, si se está cerrando, queda para el próximo arranque
+                    DB_ERRORS.inc()
+                    log.error("Error al escribir en la base de datos: %s", e)
+                    if drained:
+                        break
+                    time.sleep(self.flush_interval)
+                    continue
+                if checkpoint is not None:
+                    self.data_queue.checkpoint(checkpoint)
+                    checkpoint = None
+                self.rows_written += pending
+                self.batches_written += 1
+                DB_ROWS.inc(pending)
+                if derived:
+                    n = lecturas.count(derived)
+                    self.derived_written += n
+                    DERIVED_ROWS.inc(n)
+                if self.ui_queue is not None and batch:
+                    self.ui_queue.put(batch)
+                for alert in alerts:
+                    if alert["active"]:
+                        log.warning("Alerta %s en %s: %s=%s (%s %s)", alert["rule"], alert["device_id"],
+                                    alert["field"], alert["value"], alert["kind"], alert["threshold"])
+                    else:
+                        log.info("Alerta %s en %s resuelta", alert["rule"], alert["device_id"])
+                batch = []
+                pending = 0
+                derived = []
+                alerts = []
+                deadline = None
+        db.conn.close()
+
+    def add_alerts(self, alerts):
+        # Suscriptor de AlertEngine: solo encola, la escritura es en este hilo
+        self.alerts.extend(alerts)
+
+    def stop(self):
+        # Detiene el hilo después de escribir lo que quede pendiente en la cola
+        self.data_queue.close()
 
 # Clase para el servidor TCP
 class TCPServer(threading.Thread):
-    def __init__(self, data_queue):
+    loop = None     # Event loop del servidor (AsyncTCPServer); sin él los comandos usan uno propio
+
+    def __init__(self, data_queue, host=SERVER_IP, port=SERVER_PORT, binary_protocol=BINARY_PROTOCOL, cache=None,
+                 alerts=None, stream=None):
         threading.Thread.__init__(self)
         self.data_queue = data_queue
+        self.cache = cache
+        self.alerts = alerts
+        self.stream = stream
+        self.host = host
+        self.port = port
+        self.binary_protocol = binary_protocol
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Permitir reutilización de la dirección
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((SERVER_IP, SERVER_PORT))
-        self.server_socket.listen(1)
+        self.server_socket.bind((host, port))
+        # Con una flota que se conecta toda junta (al arrancar o tras un corte) una
+        # cola de listen() corta hace que las placas esperen segundos al reintento de SYN
+        self.server_socket.listen(BACKLOG)
         self.running = True
-        self.client_socket = None
+        # Sockets de las placas conectadas (servidor con hilos), para cerrarlos en stop()
+        self.client_sockets = set()
         self.client_lock = threading.Lock()
+        # Ids anunciados con HELLO: los únicos que son etiquetas de las métricas
+        self.identified = set()
+        # Los comandos se escriben desde el event loop del despachador, no desde quien los pide
+        self.commands = comandos.CommandDispatcher(self.loop)
 
     def run(self):
-        print(f"Servidor TCP escuchando en {SERVER_IP}:{SERVER_PORT}")
+        log.info("Servidor TCP escuchando en %s:%s", self.host, self.port)
         while self.running:
             try:
                 client_socket, client_address = self.server_socket.accept()
-                print(f"Conexión aceptada de {client_address}")
+                log.info("Conexión aceptada de %s", client_address)
                 with self.client_lock:
-                    self.client_socket = client_socket
-                threading.Thread(target=self.handle_client, args=(client_socket,)).start()
+                    self.client_sockets.add(client_socket)
+                threading.Thread(target=self.handle_client, args=(client_socket, client_address)).start()
             except Exception as e:
                 if self.running:
-                    print(f"Error en accept(): {e}")
+                    log.error("Error en accept(): %s", e)
                 break
 
-    def handle_client(self, client_socket):
-        buffer = ""
+    def handle_client(self, client_socket, client_address):
+        device_id = f"{client_address[0]}:{client_address[1]}"
+        framer = protocolo.LineFramer()
+        decoder = protocolo.BinaryDecoder()
+        # Los comandos y las respuestas al HELLO se escriben sin bloquear desde el loop del despachador
+        writer = comandos.SocketWriter(client_socket, self.commands.loop)
+        self.commands.attach(device_id, writer.write)
         while self.running:
             try:
-                data = client_socket.recv(BUFFER_SIZE)
-                if not data:
+                nbytes = framer.recv_into(client_socket)
+                if not nbytes:
                     break
-                buffer += data.decode()
-                while '\n' in buffer:
-                    message, buffer = buffer.split('\n', 1)
-                    message = message.strip()
-                    if message:
-                        self.process_message(message)
+                RECEIVED_BYTES.inc(nbytes, self.metric_label(device_id))
+                lines, frames = framer.messages()
+                while lines and lines[0].startswith(b"HELLO"):
+                    hello = lines.pop(0)
+                    self.commands.detach(device_id, writer.write)
+                    device_id = self.identify_client(hello, device_id)
+                    # La respuesta va antes que un comando pendiente que se reenvíe al conectarse
+                    reply = self.negotiate(hello)
+                    if reply:
+                        writer.send(reply)
+                    self.commands.attach(device_id, writer.write, self.supports_acks(hello))
+                if lines:
+                    self.process_lines(lines, device_id)
+                if frames:
+                    self.process_frames(frames, decoder, device_id)
             except Exception as e:
                 if self.running:
-                    print(f"Error al manejar datos del cliente: {e}")
+                    log.error("Error al manejar datos del cliente: %s", e)
                 break
-        client_socket.close()
+        self.commands.detach(device_id, writer.write)
+        writer.close()
         with self.client_lock:
-            if self.client_socket == client_socket:
-                self.client_socket = None
+            self.client_sockets.discard(client_socket)
+
+    def identify_client(self, line, device_id):
+        # El firmware se presenta con "HELLO <id>" al conectarse
+        parts = line.split()
+        if len(parts) >= 2:
+            new_id = parts[1].decode(errors='replace')
+            log.info("Dispositivo %s identificado como %s", device_id, new_id)
+            self.identified.add(new_id)
+            return new_id
+        return device_id
+
+    def metric_label(self, device_id):
+        # El id de la placa, o UNKNOWN_DEVICE si todavía no se presentó
+        return device_id if device_id in self.identified else UNKNOWN_DEVICE
+
+    def negotiate(self, line):
+        # "HELLO <id> BIN1": la placa soporta el protocolo binario
+        if self.binary_protocol and protocolo.BINARY_VERSION in line.split()[2:]:
+            return b"PROTO " + protocolo.BINARY_VERSION + b"\n"
+        return None
+
+    def supports_acks(self, line):
+        # "HELLO <id> ... ACK1": la placa confirma los comandos (comandos.py)
+        return protocolo.ACK_VERSION in line.split()[2:]
+
+    def process_lines(self, lines, device_id=None):
+        # Procesar un lote de líneas DATA/STATS recibidas juntas (mismo timestamp)
+        t0 = time.perf_counter()
+        readings, others = protocolo.parse_lines(lines, time.time_ns(), device_id)
+        DECODE_SECONDS.record(time.perf_counter() - t0)
+        self.queue_readings(readings, device_id)
+        unknown = []
+        for message in others:
+            if message.startswith("ACK "):
+                self.commands.acknowledge(device_id, message)
+            else:
+                unknown.append(message)
+        if unknown:
+            UNKNOWN_MESSAGES.inc(len(unknown), self.metric_label(device_id))
+        for message in unknown:
+            log.warning("Mensaje desconocido: %s", message)
+
+    def process_frames(self, frames, decoder, device_id=None):
+        # Procesar tramas del protocolo binario
+        lost = decoder.lost
+        t0 = time.perf_counter()
+        readings = decoder.decode(frames, time.time_ns(), device_id)
+        DECODE_SECONDS.record(time.perf_counter() - t0)
+        if decoder.lost != lost:
+            LOST_READINGS.inc(decoder.lost - lost, self.metric_label(device_id))
+            log.warning("Se perdieron %d lectura(s) de %s", decoder.lost - lost, device_id)
+        self.queue_readings(readings, device_id)
+
+    def queue_readings(self, readings, device_id):
+        # readings es un ReadingBatch; pasa entero por el caché y la cola
+        if not len(readings):
+            return
+        READINGS_RECEIVED.inc(len(readings), self.metric_label(device_id))
+        # Las alertas se evalúan antes de que la cola pueda frenar o descartar lecturas
+        if self.alerts is not None:
+            self.alerts.evaluate(readings)
+        # El caché en memoria se actualiza antes de que las lecturas lleguen a SQLite
+        if self.cache is not None:
+            self.cache.add(readings)
+        # Los suscriptores en vivo las reciben sin esperar a la cola ni a SQLite
+        if self.stream is not None:
+            self.stream.publish(readings)
+        # Con la política "block" (o la bitácora) llena el servidor con hilos espera aquí al
+        # escritor; el event loop no espera (block=False): pausa la lectura de los sockets
+        t0 = time.perf_counter()
+        if not self.data_queue.put(readings, block=self.loop is None):
+            self.pause_reading()
+        ENQUEUE_SECONDS.record(time.perf_counter() - t0)
+        # Una línea por lote solo con --log-level DEBUG: formatearla en cada mensaje
+        # cuesta más que procesarlo
+        if log.isEnabledFor(logging.DEBUG):
+            last = readings.last()
+            if last[9] == 1:
+                log.debug("Datos recibidos de %s (%d): Temperatura=%sC, Humedad=%s%%",
+                          device_id, len(readings), last[1], last[2])
+            else:
+                log.debug("Datos procesados recibidos de %s (%d): Temp Promedio=%sC, Temp Max=%sC, "
+                          "Temp Min=%sC, Hum Promedio=%s%%, Hum Max=%s%%, Hum Min=%s%%",
+                          device_id, len(readings), *last[3:9])
 
-    def process_message(self, message):
-        # Procesar el mensaje basado en su tipo (DATA o STATS)
-        if message.startswith("DATA"):
-            try:
-                _, temp_str, hum_str = message.split()
-                temperature = float(temp_str)
-                humidity = float(hum_str)
-                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                # Ponemos los datos en la cola, mode=1 para datos en bruto
-                self.data_queue.put((timestamp, temperature, humidity, None, None, None, None, None, None, 1))
-                print(f"Datos recibidos: Temperatura={temperature}C, Humedad={humidity}%")
-            except Exception as e:
-                print(f"Error al procesar DATA: {e}")
-        elif message.startswith("STATS"):
-            try:
-                parts = message.split()
-                if len(parts) == 7:
-                    _, temp_avg, temp_max, temp_min, hum_avg, hum_max, hum_min = parts
-                    temp_avg = float(temp_avg)
-                    temp_max = float(temp_max)
-                    temp_min = float(temp_min)
-                    hum_avg = float(hum_avg)
-                    hum_max = float(hum_max)
-                    hum_min = float(hum_min)
-                    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    # Ponemos los datos en la cola, mode=2 para datos procesados
-                    self.data_queue.put((timestamp, None, None, temp_avg, temp_max, temp_min, hum_avg, hum_max, hum_min, 2))
-                    print(f"Datos procesados recibidos:")
-                    print(f"  Temp Promedio={temp_avg}C, Temp Max={temp_max}C, Temp Min={temp_min}C")
-                    print(f"  Hum Promedio={hum_avg}%, Hum Max={hum_max}%, Hum Min={hum_min}%")
-                else:
-                    print("Mensaje STATS con formato incorrecto")
-            except Exception as e:
-                print(f"Error al procesar STATS: {e}")
-        else:
-            print(f"Mensaje desconocido: {message}")
+    def pause_reading(self):
+        # Solo el servidor asyncio: put() nunca pide pausa al servidor con hilos
+        pass
 
-    def send_command(self, command):
-        with self.client_lock:
-            if self.client_socket:
-                try:
-                    self.client_socket.sendall(command.encode() + b'\n')
-                    print(f"Comando enviado: {command}")
-                except Exception as e:
-                    print(f"Error al enviar comando: {e}")
-            else:
-                print("No hay cliente conectado para enviar comandos.")
+    def process_message(self, message, device_id=None):
+        # Procesar un único mensaje de texto (DATA o STATS)
+        self.process_lines([message.encode()], device_id)
+
+    def connected_devices(self):
+        # La misma lista a la que se envían los comandos
+        return self.commands.connected_devices()
+
+    def send_command(self, command, device_id=None, callback=None):
+        # Se puede llamar desde cualquier hilo y no bloquea. device_id es un id, una
+        # lista de ids o None (todos); devuelve un comandos.CommandRequest con el
+        # resultado de cada dispositivo y callback(request) se llama al terminar
+        return self.commands.submit(command, device_id, callback)
 
     def stop(self):
         self.running = False
+        self.commands.stop()
         with self.client_lock:
-            if self.client_socket:
-                try:
-                    self.client_socket.shutdown(socket.SHUT_RDWR)
-                    self.client_socket.close()
-                except Exception as e:
-                    print(f"Error al cerrar el socket del cliente: {e}")
-                self.client_socket = None
+            client_sockets = list(self.client_sockets)
+            self.client_sockets.clear()
+        for client_socket in client_sockets:
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+                client_socket.close()
+            except Exception as e:
+                log.warning("Error al cerrar el socket del cliente: %s", e)
         try:
             self.server_socket.shutdown(socket.SHUT_RDWR)
         except Exception as e:
-            print(f"Error al cerrar el socket del servidor: {e}")
+            log.warning("Error al cerrar el socket del servidor: %s", e)
         self.server_socket.close()
 
-# Clase principal de la interfaz gráfica
-class TemperatureHumidityMonitorApp(QtWidgets.QMainWindow):
-    def __init__(self, db, server, data_queue):
-        super().__init__()
-        self.db = db
+# Protocolo asyncio para cada conexión de un sensor. Al ser un BufferedProtocol
+# el event loop escribe directamente en el buffer del LineFramer (recv_into)
+class SensorProtocol(asyncio.BufferedProtocol):
+    def __init__(self, server):
         self.server = server
-        self.data_queue = data_queue
-        self.setWindowTitle("Monitor de Temperatura y Humedad")
-        self.setGeometry(100, 100, 1000, 600)  # Aumentamos el ancho para acomodar nuevos elementos
-
-        # Widget principal
-        self.central_widget = QtWidgets.QWidget()
-        self.setCentralWidget(self.central_widget)
-
-        # Layout principal dividido en dos columnas
-        self.main_layout = QtWidgets.QHBoxLayout(self.central_widget)
-
-        # Layout izquierdo para los valores numéricos y controles
-        self.left_layout = QtWidgets.QVBoxLayout()
-
-        # Grupo para mostrar lecturas numéricas
-        self.sensorGroup = QtWidgets.QGroupBox("Lecturas de Temperatura y Humedad")
-        self.sensorLayout = QtWidgets.QGridLayout()  # Cambiamos a GridLayout para acomodar más elementos
-
-        # LCDs para mostrar valores de temperatura y humedad
-        self.n1Temperatura = QtWidgets.QLCDNumber()
-        self.n1Temperatura.setSegmentStyle(QtWidgets.QLCDNumber.Flat)
-        self.n2Humedad = QtWidgets.QLCDNumber()
-        self.n2Humedad.setSegmentStyle(QtWidgets.QLCDNumber.Flat)
-
-        # Etiquetas y LCDs para valores promedio, máximo y mínimo
-        self.temp_avg_label = QtWidgets.QLabel("Temp Promedio (C)")
-        self.temp_avg_display = QtWidgets.QLCDNumber()
-        self.temp_max_label = QtWidgets.QLabel("Temp Máxima (C)")
-        self.temp_max_display = QtWidgets.QLCDNumber()
-        self.temp_min_label = QtWidgets.QLabel("Temp Mínima (C)")
-        self.temp_min_display = QtWidgets.QLCDNumber()
-
-        self.hum_avg_label = QtWidgets.QLabel("Hum Promedio (%)")
-        self.hum_avg_display = QtWidgets.QLCDNumber()
-        self.hum_max_label = QtWidgets.QLabel("Hum Máxima (%)")
-        self.hum_max_display = QtWidgets.QLCDNumber()
-        self.hum_min_label = QtWidgets.QLabel("Hum Mínima (%)")
-        self.hum_min_display = QtWidgets.QLCDNumber()
-
-        # Añadir los LCDs y etiquetas al layout del grupo
-        self.sensorLayout.addWidget(QtWidgets.QLabel("Temperatura Actual (C)"), 0, 0)
-        self.sensorLayout.addWidget(self.n1Temperatura, 0, 1)
-        self.sensorLayout.addWidget(QtWidgets.QLabel("Humedad Actual (%)"), 1, 0)
-        self.sensorLayout.addWidget(self.n2Humedad, 1, 1)
-
-        self.sensorLayout.addWidget(self.temp_avg_label, 2, 0)
-        self.sensorLayout.addWidget(self.temp_avg_display, 2, 1)
-        self.sensorLayout.addWidget(self.temp_max_label, 3, 0)
-        self.sensorLayout.addWidget(self.temp_max_display, 3, 1)
-        self.sensorLayout.addWidget(self.temp_min_label, 4, 0)
-        self.sensorLayout.addWidget(self.temp_min_display, 4, 1)
-
-        self.sensorLayout.addWidget(self.hum_avg_label, 5, 0)
-        self.sensorLayout.addWidget(self.hum_avg_display, 5, 1)
-        self.sensorLayout.addWidget(self.hum_max_label, 6, 0)
-        self.sensorLayout.addWidget(self.hum_max_display, 6, 1)
-        self.sensorLayout.addWidget(self.hum_min_label, 7, 0)
-        self.sensorLayout.addWidget(self.hum_min_display, 7, 1)
-
-        self.sensorGroup.setLayout(self.sensorLayout)
-        self.left_layout.addWidget(self.sensorGroup)
-
-        # Añadir controles
-        self.controlGroup = QtWidgets.QGroupBox("Controles")
-        self.controlLayout = QtWidgets.QVBoxLayout()
-
-        self.startButton = QtWidgets.QPushButton("Iniciar Monitoreo")
-        self.startButton.clicked.connect(self.start_monitoring)
-        self.stopButton = QtWidgets.QPushButton("Detener Monitoreo")
-        self.stopButton.clicked.connect(self.stop_monitoring)
-
-        self.mode1Button = QtWidgets.QPushButton("Modo 1 (Datos en Bruto)")
-        self.mode1Button.clicked.connect(self.set_mode1)
-        self.mode2Button = QtWidgets.QPushButton("Modo 2 (Datos Procesados)")
-        self.mode2Button.clicked.connect(self.set_mode2)
-
-        self.freqLabel = QtWidgets.QLabel("Frecuencia de Muestreo (ms):")
-        self.freqInput = QtWidgets.QSpinBox()
-        self.freqInput.setRange(100, 10000)
-        self.freqInput.setValue(1000)
-        self.freqButton = QtWidgets.QPushButton("Establecer Frecuencia")
-        self.freqButton.clicked.connect(self.set_frequency)
-
-        self.windowLabel = QtWidgets.QLabel("Ventana de Tiempo (ms):")
-        self.windowInput = QtWidgets.QSpinBox()
-        self.windowInput.setRange(1000, 60000)
-        self.windowInput.setValue(5000)
-        self.windowButton = QtWidgets.QPushButton("Establecer Ventana")
-        self.windowButton.clicked.connect(self.set_window)
-
-        # Añadir controles al layout
-        self.controlLayout.addWidget(self.startButton)
-        self.controlLayout.addWidget(self.stopButton)
-        self.controlLayout.addWidget(self.mode1Button)
-        self.controlLayout.addWidget(self.mode2Button)
-        self.controlLayout.addWidget(self.freqLabel)
-        self.controlLayout.addWidget(self.freqInput)
-        self.controlLayout.addWidget(self.freqButton)
-        self.controlLayout.addWidget(self.windowLabel)
-        self.controlLayout.addWidget(self.windowInput)
-        self.controlLayout.addWidget(self.windowButton)
-
-        self.controlGroup.setLayout(self.controlLayout)
-        self.left_layout.addWidget(self.controlGroup)
-
-        # Añadir la sección de la izquierda al layout principal
-        self.main_layout.addLayout(self.left_layout)
-
-        # Área de gráficos en la sección derecha (dos gráficos: temperatura y humedad)
-        self.figure, self.axs = plt.subplots(2, 1, figsize=(8, 10), sharex=True)
-        self.canvas = FigureCanvas(self.figure)
-        self.main_layout.addWidget(self.canvas, stretch=3)
-
-        # Timer para procesar la cola y actualizar los datos automáticamente cada 2 segundos
-        self.timer = QtCore.QTimer(self)
-        self.timer.timeout.connect(self.process_data_queue)
-        self.timer.start(2000)  # Actualizar cada 2 segundos
-
-        # Actualizar los datos inicialmente al iniciar la aplicación
-        self.actualizar_datos()
-
-        # Variables para almacenar los valores internos
-        self.internal_temps = []
-        self.internal_hums = []
-
-    def start_monitoring(self):
-        self.server.send_command("START")
-
-    def stop_monitoring(self):
-        self.server.send_command("STOP")
-
-    def set_mode1(self):
-        self.server.send_command("MODE1")
-
-    def set_mode2(self):
-        self.server.send_command("MODE2")
-
-    def set_frequency(self):
-        freq = self.freqInput.value()
-        self.server.send_command(f"SET_FREQ {freq}")
-
-    def set_window(self):
-        window = self.windowInput.value()
-        self.server.send_command(f"SET_WINDOW {window}")
-
-    def process_data_queue(self):
-        # Procesa todos los elementos en la cola
-        while not self.data_queue.empty():
-            try:
-                data = self.data_queue.get_nowait()
-                timestamp = data[0]
-                mode = data[-1]
-                if mode == 1:
-                    # Datos en bruto
-                    temperature = data[1]
-                    humidity = data[2]
-                    # Añadir a las listas internas
-                    self.internal_temps.append(temperature)
-                    self.internal_hums.append(humidity)
-                    # Limitar el tamaño de las listas internas
-                    if len(self.internal_temps) > 100:
-                        self.internal_temps.pop(0)
-                    if len(self.internal_hums) > 100:
-                        self.internal_hums.pop(0)
-                    # Insertar en la base de datos
-                    self.db.insert_data(timestamp, temperature, humidity, mode=1)
-                elif mode == 2:
-                    # Datos procesados
-                    temp_avg = data[3]
-                    temp_max = data[4]
-                    temp_min = data[5]
-                    hum_avg = data[6]
-                    hum_max = data[7]
-                    hum_min = data[8]
-                    # Insertar en la base de datos
-                    self.db.insert_data(timestamp, None, None, temp_avg, temp_max, temp_min,
-                                        hum_avg, hum_max, hum_min, mode=2)
-                    # Mostrar los valores enviados por el ESP32
-                    self.temp_avg_display.display(temp_avg)
-                    self.temp_max_display.display(temp_max)
-                    self.temp_min_display.display(temp_min)
-                    self.hum_avg_display.display(hum_avg)
-                    self.hum_max_display.display(hum_max)
-                    self.hum_min_display.display(hum_min)
-            except queue.Empty:
-                break
-        # Después de procesar los datos, actualiza la interfaz
-        self.actualizar_datos()
-
-    def actualizar_datos(self):
-        # Obtener los datos de la base de datos
-        data_list = self.db.fetch_last_data(20)  # Obtener los últimos 20 datos
-
-        # Actualizar los valores de los LCDs
-        if data_list:
-            for data in data_list:
-                mode = data[-1]
-                if mode == 1:
-                    # Datos en bruto
-                    self.n1Temperatura.display(data[1])
-                    self.n2Humedad.display(data[2])
-                elif mode == 2:
-                    # Datos procesados (ya mostrados en process_data_queue)
-                    pass
-
-            # Calcular valores internos promedio, máximo y mínimo
-            if self.internal_temps:
-                internal_temp_avg = sum(self.internal_temps) / len(self.internal_temps)
-                internal_temp_max = max(self.internal_temps)
-                internal_temp_min = min(self.internal_temps)
-
-                self.temp_avg_label.setText(f"Temp Promedio (C) (Int: {internal_temp_avg:.2f})")
-                self.temp_max_label.setText(f"Temp Máxima (C) (Int: {internal_temp_max:.2f})")
-                self.temp_min_label.setText(f"Temp Mínima (C) (Int: {internal_temp_min:.2f})")
-
-            if self.internal_hums:
-                internal_hum_avg = sum(self.internal_hums) / len(self.internal_hums)
-                internal_hum_max = max(self.internal_hums)
-                internal_hum_min = min(self.internal_hums)
-
-                self.hum_avg_label.setText(f"Hum Promedio (%) (Int: {internal_hum_avg:.2f})")
-                self.hum_max_label.setText(f"Hum Máxima (%) (Int: {internal_hum_max:.2f})")
-                self.hum_min_label.setText(f"Hum Mínima (%) (Int: {internal_hum_min:.2f})")
-
-            # Actualizar gráficos
-            self.graficar_datos(data_list)
-
-    def graficar_datos(self, data_list):
-        # Limpiar los ejes antes de volver a dibujar
-        for ax in self.axs:
-            ax.clear()
-
-        if not data_list:
-            print("No hay datos disponibles para graficar.")
-            self.canvas.draw()
+        self.transport = None
+        self.device_id = None
+        self.framer = protocolo.LineFramer()
+        self.decoder = protocolo.BinaryDecoder()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info('peername')
+        # Hasta recibir HELLO identificamos al cliente por su dirección
+        self.device_id = f"{peer[0]}:{peer[1]}"
+        self.server.register_client(self.device_id, self)
+
+    def get_buffer(self, sizehint):
+        return self.framer.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.framer.commit(nbytes)
+        RECEIVED_BYTES.inc(nbytes, self.server.metric_label(self.device_id))
+        lines, frames = self.framer.messages()
+        while lines and lines[0].startswith(b"HELLO"):
+            hello = lines.pop(0)
+            self.server.unregister_client(self.device_id, self)
+            self.device_id = self.server.identify_client(hello, self.device_id)
+            self.server.register_client(self.device_id, self, self.server.supports_acks(hello))
+            reply = self.server.negotiate(hello)
+            if reply:
+                self.transport.write(reply)
+        if lines:
+            self.server.process_lines(lines, self.device_id)
+        if frames:
+            self.server.process_frames(frames, self.decoder, self.device_id)
+
+    def connection_lost(self, exc):
+        self.server.unregister_client(self.device_id, self)
+
+# Servidor TCP basado en asyncio: todas las conexiones en un solo event loop
+class AsyncTCPServer(TCPServer):
+    def __init__(self, data_queue, host=SERVER_IP, port=SERVER_PORT, binary_protocol=BINARY_PROTOCOL, cache=None,
+                 alerts=None, stream=None):
+        # El loop se crea antes: TCPServer.__init__ se lo pasa al despachador de comandos
+        self.loop = asyncio.new_event_loop()
+        TCPServer.__init__(self, data_queue, host, port, binary_protocol, cache, alerts, stream)
+        self.daemon = True
+        self.server_socket.setblocking(False)
+        self.server = None
+        # Clientes conectados indexados por device_id
+        self.clients = {}
+        # Con la cola llena (política block) no se lee de ninguna placa hasta que el
+        # escritor la vacíe hasta la marca inferior; el loop sigue con los comandos
+        self.reading_paused = False
+        self.reading_pauses = 0
+        self.data_queue.on_resume = lambda: self._call(self.resume_reading)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                self.loop.create_server(lambda: SensorProtocol(self), sock=self.server_socket))
+            log.info("Servidor TCP (asyncio) escuchando en %s:%s", self.host, self.port)
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _call(self, callback):
+        try:
+            self.loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # El event loop ya está cerrado
+            pass
+
+    def pause_reading(self):
+        # En el event loop, cuando put() avisa que la cola está llena
+        if self.reading_paused:
             return
+        self.reading_paused = True
+        self.reading_pauses += 1
+        # Mientras el escritor se pone al día se pausa y reanuda seguido: solo se avisa la primera vez
+        log.log(logging.WARNING if self.reading_pauses == 1 else logging.DEBUG,
+                "Cola de ingesta llena: se deja de leer de las placas hasta que el escritor se ponga al día")
+        with self.client_lock:
+            protocols = list(self.clients.values())
+        for protocol in protocols:
+            protocol.transport.pause_reading()
 
-        # Preparar datos para graficar (temperatura y humedad)
-        timestamps = []
-        temperaturas = []
-        humedades = []
-
-        for entry in data_list:
-            timestamp = datetime.datetime.strptime(entry[0], "%Y-%m-%d %H:%M:%S")
-            mode = entry[-1]
-            if mode == 1:
-                # Datos en bruto
-                temp = entry[1]
-                hum = entry[2]
-            elif mode == 2:
-                # Datos procesados (usamos el promedio)
-                temp = entry[3]
-                hum = entry[6]
-            else:
-                continue
-            timestamps.append(timestamp)
-            temperaturas.append(temp)
-            humedades.append(hum)
-
-        # Crear subplots
-        self.axs[0].plot(timestamps, temperaturas, label='Temperatura (C)', color='r', marker='o')
-        self.axs[0].set_ylabel('Temperatura (C)')
-        self.axs[0].legend()
-        self.axs[0].grid(True)
-
-        self.axs[1].plot(timestamps, humedades, label='Humedad (%)', color='b', marker='o')
-        self.axs[1].set_ylabel('Humedad (%)')
-        self.axs[1].legend()
-        self.axs[1].grid(True)
-
-        # Formato de fechas en el eje x
-        self.axs[1].xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
-        self.figure.autofmt_xdate()
-
-        self.figure.tight_layout()
-        self.canvas.draw()
-
-    def closeEvent(self, event):
-        # Al cerrar la ventana, detener el servidor
-        self.server.stop()
-        event.accept()
+    def resume_reading(self):
+        if not self.reading_paused or not self.running:
+            return
+        self.reading_paused = False
+        log.debug("Cola de ingesta con espacio: se vuelve a leer de las placas")
+        with self.client_lock:
+            protocols = list(self.clients.values())
+        for protocol in protocols:
+            protocol.transport.resume_reading()
+
+    def register_client(self, device_id, protocol, acks=False):
+        with self.client_lock:
+            self.clients[device_id] = protocol
+        if self.reading_paused:
+            protocol.transport.pause_reading()
+        self.commands.attach(device_id, protocol.transport.write, acks)
+        log.info("Cliente conectado: %s (%d activos)", device_id, len(self.clients))
+
+    def unregister_client(self, device_id, protocol):
+        with self.client_lock:
+            # Un dispositivo reconectado puede haber reemplazado ya esta conexión
+            if self.clients.get(device_id) is protocol:
+                del self.clients[device_id]
+        self.commands.detach(device_id, protocol.transport.write)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.commands.stop()
+        self._call(self._shutdown)
+
+    def _shutdown(self):
+        if self.server:
+            self.server.close()
+        else:
+            self.server_socket.close()
+        with self.client_lock:
+            protocols = list(self.clients.values())
+            self.clients.clear()
+        for protocol in protocols:
+            protocol.transport.close()
+        self.loop.stop()
 
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Monitor de temperatura y humedad (daemon de adquisición)")
+    parser.add_argument("--gui", action="store_true",
+                        help="abrir también la interfaz gráfica en este proceso")
+    parser.add_argument("--db", default=DB_FILE, help="archivo de la base de datos SQLite")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="puerto TCP para las placas")
+    parser.add_argument("--control-port", type=int, default=control.CONTROL_PORT,
+                        help="puerto local del canal de control para la interfaz")
+    parser.add_argument("--threaded", action="store_true",
+                        help="usar el servidor con un hilo por conexión en vez de asyncio")
+    parser.add_argument("--text-only", action="store_true",
+                        help="no ofrecer el protocolo binario a las placas")
+    parser.add_argument("--plot-points", type=int, default=PLOT_POINTS,
+                        help="cantidad de puntos visibles en los gráficos")
+    parser.add_argument("--cache-capacity", type=int, default=buffer_circular.CACHE_CAPACITY,
+                        help="lecturas recientes en memoria por dispositivo y modo")
+    parser.add_argument("--batch-size", type=int, default=DB_BATCH_SIZE,
+                        help="filas por transacción al escribir en la base de datos")
+    parser.add_argument("--flush-ms", type=int, default=DB_FLUSH_MS,
+                        help="tiempo máximo (ms) antes de escribir un lote incompleto")
+    parser.add_argument("--queue-size", type=int, default=cola.QUEUE_SIZE,
+                        help="lecturas pendientes de escribir como máximo")
+    parser.add_argument("--queue-policy", choices=cola.POLICIES, default=cola.QUEUE_POLICY,
+                        help="qué hacer con la cola llena: frenar a las placas, descartar lo más "
+                             "antiguo o resumir lecturas en bruto como STATS")
+    parser.add_argument("--spool-dir",
+                        help="guardar las lecturas recibidas en una bitácora en este directorio antes de "
+                             "escribirlas en SQLite; reemplaza a la cola en memoria y lo que no se llegó a "
+                             "escribir se recupera al volver a arrancar")
+    parser.add_argument("--spool-size", type=int, default=bitacora.SPOOL_SIZE,
+                        help="lecturas pendientes como máximo en la bitácora antes de frenar a las placas")
+    parser.add_argument("--synchronous", choices=["OFF", "NORMAL", "FULL"], default=DB_SYNCHRONOUS,
+                        help="nivel de PRAGMA synchronous de SQLite")
+    parser.add_argument("--windows", type=float, nargs="*", default=list(estadisticas.SERVER_WINDOWS),
+                        metavar="SEGUNDOS",
+                        help="ventanas de las lecturas de modo 2 que se calculan en el servidor a partir de "
+                             "las de modo 1; sin valores se desactiva")
+    parser.add_argument("--alert-rules", metavar="ARCHIVO",
+                        help="reglas de alerta en JSON (lista de objetos con los argumentos de "
+                             "alertas.AlertRule) en lugar de las de alertas.DEFAULT_RULES")
+    parser.add_argument("--no-alerts", action="store_true", help="no evaluar alertas")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="DEBUG muestra una línea por cada lote de lecturas recibido")
+    parser.add_argument("--metrics-port", type=int, default=metricas.METRICS_PORT,
+                        help="puerto local del endpoint de métricas (formato Prometheus); 0 lo desactiva")
+    parser.add_argument("--stream-port", type=int, default=difusion.STREAM_PORT,
+                        help="puerto local de las lecturas en vivo (SSE y WebSocket en /stream); 0 lo desactiva")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="segundos entre resúmenes de las métricas en el log; 0 los desactiva")
+    parser.add_argument("--archive-dir",
+                        help="archivar periódicamente las lecturas antiguas en Parquet en este directorio "
+                             "(necesita pyarrow)")
+    parser.add_argument("--archive-days", type=float, default=30,
+                        help="días que las lecturas quedan solo en SQLite antes de archivarse")
+    parser.add_argument("--archive-prune", action="store_true",
+                        help="borrar de SQLite las lecturas ya archivadas")
+    args, qt_args = parser.parse_known_args()
+    if qt_args and not args.gui:
+        parser.error(f"argumentos no reconocidos: {' '.join(qt_args)}")
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT, stream=sys.stdout)
 
     # Verificar si el puerto está en uso
     def is_port_in_use(port):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             return s.connect_ex(('localhost', port)) == 0
 
-    if is_port_in_use(SERVER_PORT):
-        print(f"El puerto {SERVER_PORT} ya está en uso. Por favor, cierra otras instancias del programa.")
-        sys.exit(1)
+    for port in (args.port, args.control_port):
+        if is_port_in_use(port):
+            log.error("El puerto %s ya está en uso. Por favor, cierra otras instancias del programa.", port)
+            sys.exit(1)
 
-    # Inicializar la base de datos
-    db = DataBase(DB_FILE)
+    # pyarrow solo se importa si se pide el archivo en Parquet
+    if args.archive_dir:
+        try:
+            import archivo
+        except ImportError as e:
+            log.error("No se puede archivar sin pyarrow (pip install pyarrow): %s", e)
+            sys.exit(1)
+
+    alert_engine = None
+    if not args.no_alerts:
+        try:
+            alert_engine = alertas.AlertEngine(alertas.load_rules(args.alert_rules) if args.alert_rules else None)
+        except (OSError, ValueError, TypeError) as e:
+            log.error("No se pudieron cargar las reglas de alerta de %s: %s", args.alert_rules, e)
+            sys.exit(1)
+
+    # Inicializar la base de datos (crea o migra las tablas antes de iniciar los hilos)
+    db = DataBase(args.db, synchronous=args.synchronous)
 
-    # Crear la cola para los datos
-    data_queue = queue.Queue()
+    # Caché en memoria de las lecturas recientes, con lo último guardado como punto de partida
+    cache = buffer_circular.HotCache(args.cache_capacity)
+    cache.load_rows(db.fetch_last_data(args.plot_points))
+
+    # Crear las colas: lecturas del servidor (acotada, en memoria o en la bitácora) y lotes ya
+    # guardados para los clientes
+    if args.spool_dir:
+        try:
+            data_queue = bitacora.SpoolQueue(args.spool_dir, db.fetch_spool_checkpoint(), args.spool_size)
+        except (OSError, ValueError) as e:
+            log.error("No se pudo abrir la bitácora en %s: %s", args.spool_dir, e)
+            sys.exit(1)
+    else:
+        data_queue = cola.IngestQueue(args.queue_size, args.queue_policy)
+    ui_queue = queue.Queue()
+
+    # Iniciar el hilo que escribe en la base de datos por lotes
+    writer = DataBaseWriter(args.db, data_queue, ui_queue, batch_size=args.batch_size,
+                            flush_ms=args.flush_ms, synchronous=args.synchronous, windows=args.windows)
+    writer.start()
+    if alert_engine is not None:
+        alert_engine.subscribe(writer.add_alerts)
+
+    # Lecturas en vivo para tableros, directamente desde el servidor TCP
+    stream_server = None
+    if args.stream_port:
+        try:
+            stream_server = difusion.StreamServer(port=args.stream_port)
+            stream_server.start()
+        except OSError as e:
+            log.warning("No se pudo abrir el endpoint de lecturas en vivo en el puerto %s: %s", args.stream_port, e)
 
     # Iniciar el servidor TCP en un hilo separado
-    server = TCPServer(data_queue)
+    server_class = TCPServer if args.threaded else AsyncTCPServer
+    server = server_class(data_queue, port=args.port, binary_protocol=not args.text_only, cache=cache,
+                          alerts=alert_engine, stream=stream_server)
     server.start()
 
-    # Crear e iniciar la aplicación gráfica
-    main_window = TemperatureHumidityMonitorApp(db, server, data_queue)
-    main_window.show()
+    # Canal de control: reparte los lotes guardados y recibe comandos de la interfaz
+    control_server = control.ControlServer(server, ui_queue, port=args.control_port, data_queue=data_queue,
+                                           alerts=alert_engine)
+    control_server.start()
 
-    # Manejar el cierre del programa con señales
-    def signal_handler(sig, frame):
-        print("Interrupción recibida, cerrando el servidor...")
+    # Métricas: endpoint HTTP local y/o resumen periódico en el log
+    metrics_server = None
+    if args.metrics_port:
+        try:
+            metrics_server = metricas.MetricsServer(port=args.metrics_port)
+            metrics_server.start()
+        except OSError as e:
+            log.warning("No se pudo abrir el endpoint de métricas en el puerto %s: %s", args.metrics_port, e)
+    reporter = None
+    if args.stats_interval > 0:
+        reporter = metricas.StatsReporter(args.stats_interval)
+        reporter.start()
+
+    # Archivo en Parquet de lo antiguo
+    archiver = None
+    if args.archive_dir:
+        archiver = archivo.ArchiveThread(args.db, args.archive_dir, args.archive_days, args.archive_prune)
+        archiver.start()
+
+    def shutdown():
         server.stop()
+        # Escribir las lecturas que aún estén en la cola antes de salir
+        writer.stop()
+        writer.join()
+        if args.spool_dir:
+            data_queue.close_segments()
+        control_server.stop()
+        if stream_server is not None:
+            stream_server.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if reporter is not None:
+            reporter.stop()
+        if archiver is not None:
+            archiver.stop()
+        stats = data_queue.stats()
+        log.info("Cola de ingesta (%s): %d lecturas escritas, máximo %d/%d en cola, %d descartadas, "
+                 "%d resumidas, latencia promedio %.1f ms", stats['policy'], stats['got'], stats['max_depth'],
+                 stats['capacity'], stats['dropped'], stats['coalesced'], stats['latency_avg_ms'])
+
+    if args.gui:
+        # La interfaz se importa solo si se pide, así el daemon no carga Qt ni matplotlib
+        import interfaz
+        try:
+            interfaz.run(db, server, control_server.subscribe_queue(), cache, args.plot_points, qt_args)
+        finally:
+            log.info("Cerrando aplicación...")
+            shutdown()
         sys.exit(0)
 
-    signal.signal(signal.SIGINT, signal_handler)
+    # Sin interfaz: esperar hasta Ctrl+C o SIGTERM
+    stop_event = threading.Event()
 
-    try:
-        sys.exit(app.exec_())
-    except SystemExit:
-        print("Cerrando aplicación...")
-    finally:
-        server.stop()
+    def signal_handler(sig, frame):
+        log.info("Interrupción recibida, cerrando el servidor...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    log.info("Monitor en ejecución sin interfaz. Para verlo: python interfaz.py --db %s", args.db)
+    while not stop_event.wait(1.0):
+        pass
+    shutdown()
@@ -0,0 +1,270 @@
+# Separación y lectura de mensajes del protocolo DATA/STATS (texto y binario)
+#
+# Los bytes recibidos se acumulan en un bytearray reutilizable (recv_into) y las
+# líneas se buscan sin decodificar: '\n' nunca forma parte de un carácter UTF-8
+# multibyte, así que cortar por bytes es seguro aunque un carácter llegue
+# partido entre dos recv. Solo se decodifican las líneas completas que no son
+# DATA/STATS.
+#
+# Protocolo binario (negociado con "HELLO <id> BIN1" -> "PROTO BIN1"):
+# cada trama empieza con el byte BINARY_MAGIC, que nunca puede iniciar una
+# línea de texto, seguido del tipo y la cantidad de registros:
+#
+#   cabecera  <BBH   magic, tipo (1=DATA, 2=STATS), cantidad
+#   DATA      <IIhH  secuencia, ms del dispositivo, temp*100, hum*100
+#   STATS     <II6h  secuencia, ms del dispositivo, 6 valores*100
+#
+# Los valores van en centésimas, la misma precisión que "%.2f" del texto.
+#
+# Una placa que además anuncia ACK1 en el HELLO confirma los comandos: recibe
+# "CMD <n> <comando>" y responde con la línea de texto "ACK <n> OK|ERR"
+# (comandos.py).
+import functools
+import logging
+import struct
+import time
+
+import numpy as np
+
+import lecturas
+from lecturas import MODE_FIELDS, ReadingBatch
+
+RECV_BUFFER_SIZE = 8 * 1024  # Crece solo si llega una línea más larga
+MAX_LINE_SIZE = 1024 * 1024  # Una línea más larga que esto se descarta
+
+log = logging.getLogger(__name__)
+
+BINARY_VERSION = b"BIN1"
+ACK_VERSION = b"ACK1"
+BINARY_MAGIC = 0xB5
+KIND_DATA = 1
+KIND_STATS = 2
+FRAME_HEADER = struct.Struct('<BBH')
+DATA_RECORD = struct.Struct('<IIhH')
+STATS_RECORD = struct.Struct('<II6h')
+RECORD_SIZES = {KIND_DATA: DATA_RECORD.size, KIND_STATS: STATS_RECORD.size}
+# Los mismos registros para np.frombuffer
+RECORD_DTYPES = {
+    KIND_DATA: np.dtype([("seq", "<u4"), ("device_ms", "<u4"), ("temp", "<i2"), ("hum", "<u2")]),
+    KIND_STATS: np.dtype([("seq", "<u4"), ("device_ms", "<u4"), ("temp_avg", "<i2"), ("temp_max", "<i2"),
+                          ("temp_min", "<i2"), ("hum_avg", "<i2"), ("hum_max", "<i2"), ("hum_min", "<i2")]),
+}
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # Formato de fecha en texto (bases de datos antiguas)
+
+
+# Buffer de recepción que entrega las líneas completas por lotes
+class LineFramer:
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.start = 0  # Inicio de los datos aún no procesados
+        self.end = 0    # Fin de los datos válidos
+        self.dropped = 0
+
+    def get_buffer(self):
+        # Devuelve un memoryview escribible al final de los datos pendientes
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if self.start > 0:
+                # Mover la línea incompleta al inicio (mismo tamaño, no redimensiona)
+                self.buffer[0:pending] = self.buffer[self.start:self.end]
+            elif pending < MAX_LINE_SIZE:
+                # Línea más larga que el buffer: usar uno nuevo del doble de tamaño
+                new_buffer = bytearray(len(self.buffer) * 2)
+                new_buffer[0:pending] = self.buffer[0:pending]
+                self.buffer = new_buffer
+            else:
+                self.dropped += 1
+                pending = 0
+            self.start = 0
+            self.end = pending
+        return memoryview(self.buffer)[self.end:]
+
+    def commit(self, nbytes):
+        self.end += nbytes
+
+    def recv_into(self, sock):
+        nbytes = sock.recv_into(self.get_buffer())
+        self.commit(nbytes)
+        return nbytes
+
+    def feed(self, data):
+        # Para fuentes que entregan bytes en vez de escribir en nuestro buffer
+        while data:
+            view = self.get_buffer()
+            n = min(len(view), len(data))
+            view[:n] = data[:n]
+            self.commit(n)
+            data = data[n:]
+
+    def messages(self):
+        # Todos los mensajes completos recibidos hasta ahora: (líneas, tramas binarias).
+        # Las líneas van sin el '\n'; las tramas son tuplas (tipo, cantidad, registros).
+        buffer = self.buffer
+        pos = self.start
+        end = self.end
+        lines = []
+        frames = []
+        while pos < end:
+            if buffer[pos] == BINARY_MAGIC:
+                if end - pos < FRAME_HEADER.size:
+                    break
+                _, kind, count = FRAME_HEADER.unpack_from(buffer, pos)
+                record_size = RECORD_SIZES.get(kind)
+                if record_size is None:
+                    # Tipo desconocido: descartar el byte y seguir buscando
+                    self.dropped += 1
+                    pos += 1
+                    continue
+                size = FRAME_HEADER.size + count * record_size
+                if end - pos < size:
+                    break
+                frames.append((kind, count, bytes(buffer[pos + FRAME_HEADER.size:pos + size])))
+                pos += size
+                continue
+            # Bloque de texto: todas las líneas completas antes de la próxima trama
+            magic = buffer.find(BINARY_MAGIC, pos, end)
+            newline = buffer.rfind(b'\n', pos, end if magic < 0 else magic)
+            if newline < 0:
+                # El byte mágico está dentro de una línea de texto (p. ej. "µ" en UTF-8)
+                newline = buffer.find(b'\n', pos, end)
+                if newline < 0:
+                    break
+            lines.extend(bytes(buffer[pos:newline]).split(b'\n'))
+            pos = newline + 1
+        self.start = pos
+        if self.start == self.end:
+            self.start = self.end = 0
+        return lines, frames
+
+
+def to_epoch_ms(timestamp):
+    # Las lecturas llevan segundos desde 1970 (time.time()); SQLite guarda
+    # milisegundos enteros. También acepta el texto de las bases de datos antiguas
+    if isinstance(timestamp, str):
+        timestamp = parse_timestamp(timestamp)
+    return int(round(timestamp * 1000))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(text):
+    return time.mktime(time.strptime(text, TIMESTAMP_FORMAT))
+
+
+def parse_lines(lines, timestamp_ns, device_id=None):
+    # Convierte un lote de líneas en un ReadingBatch para la cola de datos; todas
+    # las lecturas llevan la hora de recepción (ns). Devuelve (lote, otros) donde
+    # otros son las líneas que no son DATA/STATS.
+    # Entre línea y línea va un token ";": con cada línea de 3 tokens quedan en
+    # las posiciones 4k+3, y una línea con más o menos tokens corre un ";" a una
+    # posición de DATA o de un valor, donde falla la verificación o float()
+    tokens = b' ; '.join(lines).split()
+    count = len(lines)
+    # Caso común: el lote solo trae líneas DATA bien formadas
+    if (len(tokens) == 4 * count - 1 and tokens[0::4].count(b'DATA') == count
+            and tokens[3::4].count(b';') == count - 1):
+        try:
+            return ReadingBatch.raw(timestamp_ns, np.array(tokens[1::4], dtype=np.float32),
+                                    np.array(tokens[2::4], dtype=np.float32), device_id), []
+        except ValueError:
+            pass
+
+    data_values = []
+    stats_values = []
+    modes = []
+    others = []
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        kind = parts[0]
+        if kind == b'DATA':
+            try:
+                _, temp, hum = parts
+                data_values.append((float(temp), float(hum)))
+                modes.append(1)
+            except ValueError as e:
+                log.warning("Error al procesar DATA: %s", e)
+        elif kind == b'STATS':
+            if len(parts) != 7:
+                log.warning("Mensaje STATS con formato incorrecto")
+                continue
+            try:
+                stats_values.append(tuple(map(float, parts[1:])))
+                modes.append(2)
+            except ValueError as e:
+                log.warning("Error al procesar STATS: %s", e)
+        else:
+            others.append(line.decode(errors='replace').strip())
+    batch = ReadingBatch.empty(len(modes), device_id)
+    if modes:
+        modes = np.array(modes, dtype=np.int8)
+        batch.data["timestamp"] = timestamp_ns
+        batch.data["mode"] = modes
+        for mode, values in ((1, data_values), (2, stats_values)):
+            if values:
+                rows = batch.data[modes == mode]
+                for name, column in zip(MODE_FIELDS[mode], zip(*values)):
+                    rows[name] = column
+                batch.data[modes == mode] = rows
+    return batch, others
+
+
+# Decodificador de tramas binarias de una conexión; lleva la secuencia esperada
+# para contar las lecturas perdidas
+class BinaryDecoder:
+    def __init__(self):
+        self.next_seq = None
+        self.lost = 0
+
+    def _check_seq(self, seqs):
+        first_seq = int(seqs[0])
+        last_seq = int(seqs[-1])
+        if self.next_seq is not None:
+            self.lost += (first_seq - self.next_seq) & 0xFFFFFFFF
+        # Huecos dentro del mismo lote
+        self.lost += ((last_seq - first_seq) & 0xFFFFFFFF) + 1 - len(seqs)
+        self.next_seq = (last_seq + 1) & 0xFFFFFFFF
+
+    def _timestamps_for(self, records, now_ns):
+        # El reloj del dispositivo (ms desde el arranque) solo se usa para ubicar
+        # cada registro respecto del último del lote, que se asume recibido en "now"
+        device_ms = records["device_ms"].astype(np.int64)
+        return now_ns + (device_ms - device_ms[-1]) * 1000000
+
+    def decode(self, frames, now_ns, device_id=None):
+        # Tramas (tipo, cantidad, registros) -> un ReadingBatch; los registros se
+        # leen directamente de los bytes con np.frombuffer
+        parts = []
+        i = 0
+        while i < len(frames):
+            # Las tramas consecutivas del mismo tipo se decodifican juntas
+            kind = frames[i][0]
+            j = i + 1
+            while j < len(frames) and frames[j][0] == kind:
+                j += 1
+            payload = b''.join(frame[2] for frame in frames[i:j])
+            i = j
+            if not payload or kind not in RECORD_DTYPES:
+                continue
+            records = np.frombuffer(payload, dtype=RECORD_DTYPES[kind])
+            self._check_seq(records["seq"])
+            batch = ReadingBatch.empty(len(records))
+            batch.data["timestamp"] = self._timestamps_for(records, now_ns)
+            batch.data["mode"] = kind
+            if kind == KIND_DATA:
+                batch.data["temperature"] = records["temp"] / 100.0
+                batch.data["humidity"] = records["hum"] / 100.0
+            else:
+                for name in MODE_FIELDS[2]:
+                    batch.data[name] = records[name] / 100.0
+            parts.append(batch.data)
+        if not parts:
+            return ReadingBatch.empty(0, device_id)
+        return ReadingBatch(lecturas.concatenate(parts), device_id)
+
+
+def encode_frame(kind, records):
+    # Arma una trama binaria; se usa en benchmarks y simuladores (el firmware la arma en C)
+    record_struct = DATA_RECORD if kind == KIND_DATA else STATS_RECORD
+    return FRAME_HEADER.pack(BINARY_MAGIC, kind, len(records)) + b''.join(
+        record_struct.pack(*record) for record in records)
@@ -0,0 +1,91 @@
+# Reglas de alerta sobre el camino de ingesta
+import numpy as np
+import pytest
+
+from alertas import SCALAR_BATCH, AlertEngine, AlertRule
+from lecturas import NS, ReadingBatch
+
+START = 1700000000
+
+
+def stats_batch(averages, maxima, minima, device_id="a"):
+    # Lecturas de modo 2 (STATS) con temperatura promedio, máxima y mínima; una por segundo
+    batch = ReadingBatch.empty(len(averages), device_id)
+    batch.data["timestamp"] = (START + np.arange(len(averages))) * NS
+    batch.data["temp_avg"] = averages
+    batch.data["temp_max"] = maxima
+    batch.data["temp_min"] = minima
+    batch.data["hum_avg"] = batch.data["hum_max"] = batch.data["hum_min"] = 50
+    batch.data["mode"] = 2
+    return batch
+
+
+@pytest.mark.parametrize("n", [1, SCALAR_BATCH])
+def test_stats_alert_records_the_extreme(n):
+    # El promedio no pasa ningún umbral; el máximo y el mínimo de la ventana sí
+    engine = AlertEngine([AlertRule("alta", "temperature", "max", 40.0),
+                          AlertRule("baja", "temperature", "min", 0.0)])
+    alerts = engine.evaluate(stats_batch([20.0] * n, [41.5] * n, [-2.25] * n))
+    assert {alert["rule"]: alert["value"] for alert in alerts} == {"alta": 41.5, "baja": -2.25}
+    assert all(alert["active"] for alert in alerts)
+
+
+def raw_batch(temperatures, first=0, device_id="a"):
+    n = len(temperatures)
+    return ReadingBatch.raw((START + first + np.arange(n)) * NS, np.array(temperatures, dtype=np.float32),
+                            np.full(n, 50, dtype=np.float32), device_id)
+
+
+def evaluate(engine, chunks, columnar):
+    # Tramos de lecturas consecutivas, de a una lectura (camino sin NumPy) o cada
+    # tramo en un lote (por columnas)
+    alerts = []
+    first = 0
+    for temperatures in chunks:
+        if columnar:
+            alerts.extend(engine.evaluate(raw_batch(temperatures, first)))
+        else:
+            for i, t in enumerate(temperatures):
+                alerts.extend(engine.evaluate(raw_batch([t], first + i)))
+        first += len(temperatures)
+    return alerts
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_hysteresis(columnar):
+    engine = AlertEngine([AlertRule("alta", "temperature", "max", 40.0, hysteresis=1.0)])
+    # Sube, oscila sobre el umbral sin bajar 1 grado, baja, y vuelve a subir
+    temperatures = [39.0, 40.5, 39.5, 40.25, 39.25, 38.75, 39.5, 40.5, 20.0, 20.0, 20.0]
+    alerts = evaluate(engine, [temperatures], columnar)
+    assert [(alert["active"], alert["value"]) for alert in alerts] == [(True, 40.5), (False, 38.75), (True, 40.5),
+                                                                       (False, 20.0)]
+    assert [alert["timestamp"] for alert in alerts] == [START + 1, START + 5, START + 7, START + 8]
+    assert engine.active_alerts() == []
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_zscore(columnar):
+    engine = AlertEngine([AlertRule("anomala", "temperature", "zscore", 5.0, hysteresis=2.0, window=100,
+                                    min_samples=30)])
+    # 20 ± 0.5 (desviación ~0.35), un salto a 30 y de vuelta a lo normal. Por
+    # columnas el promedio y la desviación son los del principio de cada lote
+    normal = (20 + 0.5 * np.sin(np.arange(100))).round(2).tolist()
+    alerts = evaluate(engine, [normal, [30.0, 30.0] + normal[:20]], columnar)
+    assert (alerts[0]["active"], alerts[0]["value"], alerts[0]["timestamp"]) == (True, 30.0, START + 100)
+    assert alerts[0]["score"] > 5
+    assert alerts[-1]["active"] is False
+    assert alerts[-1]["timestamp"] > START + 101
+
+
+def test_zscore_needs_min_samples():
+    engine = AlertEngine([AlertRule("anomala", "temperature", "zscore", 5.0, min_samples=30)])
+    assert engine.evaluate(raw_batch([20.0] * 29 + [35.0])) == []
+
+
+def test_rules_are_per_device():
+    engine = AlertEngine([AlertRule("alta", "temperature", "max", 40.0, hysteresis=1.0)])
+    engine.evaluate(raw_batch([41.0], device_id="a"))
+    # La regla de "b" tiene su propio estado
+    assert engine.evaluate(raw_batch([39.5], device_id="b")) == []
+    assert engine.evaluate(raw_batch([41.0], device_id="b"))[0]["device_id"] == "b"
+    assert sorted(engine.active_alerts()) == [("a", "alta"), ("b", "alta")]
@@ -0,0 +1,95 @@
+# Bitácora en disco: lo que se recupera después de que el proceso muere
+import os
+
+import numpy as np
+
+from bitacora import RECORD, SEGMENT_SUFFIX, SpoolQueue
+from lecturas import READING_DTYPE, ReadingBatch
+
+
+def batch(first, count, device_id="a"):
+    # Lecturas con temperatura first, first + 1, ... para reconocerlas al releerlas
+    values = np.arange(first, first + count, dtype=np.float32)
+    return ReadingBatch.raw(np.arange(count, dtype=np.int64), values, values, device_id)
+
+
+def temperatures(batches):
+    return [v for b in batches for v in b.values("temperature").tolist()]
+
+
+def drain(queue):
+    batches = []
+    while queue.depth:
+        batches.extend(queue.get_batch(1000))
+    return batches
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def test_replay_after_crash_from_checkpoint(tmp_path):
+    spool = SpoolQueue(str(tmp_path))
+    spool.put(batch(0, 3))
+    spool.put(batch(10, 2, "b"))
+    # El escritor guardó el primer lote y su checkpoint en la misma transacción
+    assert temperatures(spool.get_batch(3)) == [0, 1, 2]
+    checkpoint = spool.position()
+    spool.put(batch(20, 4))
+    # El proceso muere sin cerrar nada: lo escrito en el mmap está en el archivo
+    replayed = SpoolQueue(str(tmp_path), checkpoint)
+    assert replayed.recovered == 6
+    batches = drain(replayed)
+    assert temperatures(batches) == [10, 11, 20, 21, 22, 23]
+    assert [b.device_id for b in batches] == ["b", "a"]
+    # Lo nuevo va a un segmento nuevo, después de lo recuperado
+    replayed.put(batch(30, 1))
+    assert temperatures(drain(replayed)) == [30]
+    replayed.close_segments()
+
+
+def test_crash_mid_record_keeps_the_complete_records(tmp_path):
+    spool = SpoolQueue(str(tmp_path))
+    spool.put(batch(0, 2))
+    spool.put(batch(10, 2))
+    # Un registro a medio escribir: los datos están pero la cabecera, que se
+    # escribe al final, no
+    offset = spool.write_offset
+    spool.put(batch(20, 2))
+    spool.segments[spool.write_index][offset:offset + RECORD.size] = bytes(RECORD.size)
+    replayed = SpoolQueue(str(tmp_path))
+    assert temperatures(drain(replayed)) == [0, 1, 10, 11]
+    replayed.close_segments()
+
+
+def test_corrupt_record_discards_the_rest_of_its_segment(tmp_path):
+    spool = SpoolQueue(str(tmp_path))
+    spool.put(batch(0, 2))
+    offset = spool.write_offset
+    spool.put(batch(10, 2))
+    spool.put(batch(20, 2))
+    # Un byte cambiado en las lecturas del segundo registro: el crc no coincide
+    position = offset + RECORD.size + 1 + READING_DTYPE.itemsize
+    mm = spool.segments[spool.write_index]
+    mm[position] = mm[position] ^ 0xFF
+    replayed = SpoolQueue(str(tmp_path))
+    assert temperatures(drain(replayed)) == [0, 1]
+    replayed.close_segments()
+
+
+def test_checkpoint_deletes_segments_and_replay_spans_them(tmp_path):
+    # Segmentos chicos: cada lote de 10 lecturas va en uno propio
+    size = RECORD.size + 1 + 10 * READING_DTYPE.itemsize
+    spool = SpoolQueue(str(tmp_path), segment_size=size)
+    for i in range(4):
+        spool.put(batch(10 * i, 10))
+    assert len(segments(tmp_path)) == 4
+    spool.get_batch(10)
+    spool.get_batch(10)
+    checkpoint = spool.position()
+    spool.checkpoint(checkpoint)
+    # Los segmentos ya entregados y confirmados se borran
+    assert len(segments(tmp_path)) == 3
+    replayed = SpoolQueue(str(tmp_path), checkpoint)
+    assert temperatures(drain(replayed)) == list(range(20, 40))
+    replayed.close_segments()
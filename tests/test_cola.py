@@ -0,0 +1,59 @@
+# Cola de ingesta: contrapresión sin bloquear al productor
+import numpy as np
+
+from bitacora import SpoolQueue
+from cola import IngestQueue, coalesce_batches
+from lecturas import NS, ReadingBatch
+
+
+def batch(count):
+    return ReadingBatch.raw(np.arange(count, dtype=np.int64), np.full(count, 20, dtype=np.float32),
+                            np.full(count, 50, dtype=np.float32), "a")
+
+
+def test_put_without_block_pauses_and_resumes():
+    queue = IngestQueue(10, "block")
+    resumed = []
+    queue.on_resume = lambda: resumed.append(True)
+    assert queue.put(batch(8), block=False)
+    # Llena: el lote entra completo por encima de la capacidad y pide pausa
+    assert not queue.put(batch(8), block=False)
+    assert queue.depth == 16
+    assert not queue.put(batch(2), block=False)
+    # Por encima de la marca inferior sigue pausado
+    queue.get_batch(8)
+    assert resumed == []
+    queue.get_batch(5)
+    assert resumed == [True]
+    assert not queue.paused
+    assert queue.put(batch(1), block=False)
+
+
+def test_spool_put_without_block_pauses_and_resumes(tmp_path):
+    queue = SpoolQueue(str(tmp_path), maxsize=10)
+    assert queue.policy == "spool"
+    resumed = []
+    queue.on_resume = lambda: resumed.append(True)
+    assert queue.put(batch(10), block=False)
+    assert not queue.put(batch(4), block=False)
+    assert queue.depth == 14
+    # Se entregan registros enteros: el primero deja 4 lecturas, por debajo de la marca
+    assert len(queue.get_batch(1)[0]) == 10
+    assert resumed == [True]
+    assert queue.put(batch(1), block=False)
+    queue.close_segments()
+
+
+def test_coalesce_keeps_time_order():
+    # Lecturas en bruto cada segundo durante 20 s y un STATS de la placa a los 7 s:
+    # los resúmenes de 5 s quedan antes y después del STATS, no todos detrás
+    raw = ReadingBatch.raw(np.arange(20, dtype=np.int64) * NS, np.full(20, 20, dtype=np.float32),
+                           np.full(20, 50, dtype=np.float32), "a")
+    stats = ReadingBatch.empty(1, "a")
+    stats.data["timestamp"] = 7 * NS
+    stats.data["mode"] = 2
+    merged = coalesce_batches([stats, raw, batch(3)], window=5.0)
+    assert [b.device_id for b in merged] == ["a"]
+    timestamps = merged[0].data["timestamp"]
+    assert np.all(np.diff(timestamps) >= 0)
+    assert merged[0].data["mode"].tolist().count(2) == len(merged[0])
@@ -0,0 +1,150 @@
+# Envío de comandos a las placas: despachador con ACK y escritura sin bloquear
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+import comandos
+
+
+@pytest.fixture
+def loop():
+    # Event loop en un hilo aparte, como el del despachador del servidor con hilos
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def in_loop(loop, callback, *args):
+    async def call():
+        return callback(*args)
+    return asyncio.run_coroutine_threadsafe(call(), loop).result(5)
+
+
+def receive(sock, size):
+    data = bytearray()
+    sock.settimeout(5)
+    while len(data) < size:
+        data += sock.recv(65536)
+    return bytes(data)
+
+
+def test_socket_writer_does_not_block_on_a_full_socket(loop):
+    server, board = socket.socketpair()
+    writer = comandos.SocketWriter(server, loop, limit=10 * 1024 * 1024)
+    messages = [b"CMD %d SET_FREQ 1000\n" % i for i in range(30000)]
+    t0 = time.monotonic()
+    for message in messages:
+        in_loop(loop, writer.write, message)
+    writer.send(b"PROTO BIN1\n")
+    # El socket no aceptó todo, pero write() volvió enseguida
+    assert in_loop(loop, len, writer.buffer) > 0
+    assert time.monotonic() - t0 < 30
+    expected = b"".join(messages) + b"PROTO BIN1\n"
+    assert receive(board, len(expected)) == expected
+    writer.close()
+    board.close()
+
+
+def test_socket_writer_closes_a_board_that_does_not_read(loop):
+    server, board = socket.socketpair()
+    writer = comandos.SocketWriter(server, loop, limit=64 * 1024)
+    message = b"x" * 1024
+    with pytest.raises(OSError):
+        # Pasado el límite se cierra la conexión y los envíos siguientes fallan
+        for _ in range(10000):
+            in_loop(loop, writer.write, message)
+    # El hilo de la conexión ve el fin de la conexión en su recv()
+    assert server.recv(1) == b""
+    writer.close()
+    board.close()
+
+
+class FakeBoard:
+    # write() de una placa: guarda lo que le llega (en el loop del despachador)
+    def __init__(self):
+        self.lines = []
+        self.arrived = threading.Condition()
+
+    def write(self, data):
+        with self.arrived:
+            self.lines.append(data.decode())
+            self.arrived.notify_all()
+
+    def wait_lines(self, count, timeout=5):
+        with self.arrived:
+            assert self.arrived.wait_for(lambda: len(self.lines) >= count, timeout), self.lines
+            return list(self.lines)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = comandos.CommandDispatcher(timeout=0.05, retries=2)
+    yield dispatcher
+    dispatcher.stop()
+
+
+def test_ack_completes_the_command(dispatcher):
+    board = FakeBoard()
+    dispatcher.attach("a", board.write, acks=True)
+    request = dispatcher.submit("START", "a")
+    assert board.wait_lines(1) == ["CMD 1 START\n"]
+    dispatcher.acknowledge("a", "ACK 1 OK")
+    assert request.wait(5) == {"a": "ok"}
+
+
+def test_command_is_resent_until_it_expires(dispatcher):
+    board = FakeBoard()
+    dispatcher.attach("a", board.write, acks=True)
+    request = dispatcher.submit("STOP", "a")
+    # Un envío y COMMAND_RETRIES reenvíos, siempre con el mismo número
+    assert request.wait(5) == {"a": "timeout"}
+    assert board.lines == ["CMD 1 STOP\n"] * 3
+    # Un ACK tardío ya no cambia nada
+    dispatcher.acknowledge("a", "ACK 1 OK")
+    assert request.results == {"a": "timeout"}
+
+
+def test_ack_to_a_retry_and_queued_commands_in_order(dispatcher):
+    board = FakeBoard()
+    dispatcher.attach("a", board.write, acks=True)
+    first = dispatcher.submit("MODE2", "a")
+    second = dispatcher.submit("SET_WINDOW 5000", "a")
+    # El segundo espera a que se confirme el primero, aunque haya reintentos
+    assert board.wait_lines(2) == ["CMD 1 MODE2\n"] * 2
+    dispatcher.acknowledge("a", "ACK 1 ERR")
+    assert first.wait(5) == {"a": "error"}
+    assert board.wait_lines(3)[2] == "CMD 2 SET_WINDOW 5000\n"
+    dispatcher.acknowledge("a", "ACK 2 OK")
+    assert second.wait(5) == {"a": "ok"}
+
+
+def test_pending_command_follows_a_reconnect():
+    old, new = FakeBoard(), FakeBoard()
+    dispatcher = comandos.CommandDispatcher(timeout=1.0, retries=2)
+    try:
+        dispatcher.attach("a", old.write, acks=True)
+        request = dispatcher.submit("START", "a")
+        old.wait_lines(1)
+        dispatcher.detach("a", old.write)
+        dispatcher.attach("a", new.write, acks=True)
+        # Se reenvía enseguida por la conexión nueva, sin esperar el timeout
+        assert new.wait_lines(1, timeout=0.5) == ["CMD 1 START\n"]
+        dispatcher.acknowledge("a", "ACK 1 OK")
+        assert request.wait(5) == {"a": "ok"}
+    finally:
+        dispatcher.stop()
+
+
+def test_boards_without_acks_and_offline_boards(dispatcher):
+    board = FakeBoard()
+    dispatcher.attach("viejo", board.write)
+    request = dispatcher.submit("START", ["viejo", "ausente"])
+    assert request.wait(5) == {"viejo": "sent", "ausente": "offline"}
+    assert board.lines == ["START\n"]
@@ -0,0 +1,86 @@
+# Consultas de DataBase sobre los agregados por minuto, hora y día
+import numpy as np
+
+from basedatos import DataBase
+from cola import coalesce_batches
+from lecturas import NS, ReadingBatch
+
+DAY = 86400
+START = 1700006400  # Múltiplo de un día (UTC)
+
+
+def per_minute_db(path, days):
+    # Una lectura por minuto: temperatura 20 ± 3 con una onda de 7 minutos, así
+    # cada hora tiene su mínimo y su máximo lejos del promedio
+    db = DataBase(str(path / "t.db"))
+    minutes = np.arange(days * 1440)
+    temperatures = 20 + 3 * np.sin(2 * np.pi * minutes / 7)
+    db.insert_rows([(START + 60 * i, round(t, 2), 50.0, None, None, None, None, None, None, 1, "a")
+                    for i, t in zip(minutes.tolist(), temperatures.tolist())])
+    return db, temperatures
+
+
+def test_downsampled_rollup_keeps_both_extremes(tmp_path):
+    # Con points=96 en dos días cada tramo del gráfico es un solo tramo del
+    # agregado por hora: se grafican su mínimo y su máximo
+    db, temperatures = per_minute_db(tmp_path, 2)
+    timestamps, plotted, _ = db.fetch_downsampled(START, START + 2 * DAY, points=96)
+    assert len(plotted) == 96
+    hours = np.round(temperatures, 2).reshape(48, 60)
+    assert np.allclose(plotted[0::2], hours.min(axis=1))
+    assert np.allclose(plotted[1::2], hours.max(axis=1))
+    assert np.all(np.diff(timestamps) > 0)
+    assert abs(np.mean(plotted) - 20) < 0.2
+
+
+def test_downsampled_month_is_not_biased(tmp_path):
+    db, temperatures = per_minute_db(tmp_path, 30)
+    _, plotted, _ = db.fetch_downsampled(START, START + 30 * DAY, points=1000)
+    assert len(plotted) >= 990
+    assert plotted.max() == round(temperatures.max(), 2)
+    assert abs(np.mean(plotted) - 20) < 0.2
+
+
+def test_stats_after_prune_use_minute_rollup(tmp_path):
+    # Con las lecturas en bruto borradas (archivo.py --prune) los bordes del
+    # rango que no son minutos enteros salen del agregado por minuto
+    db, temperatures = per_minute_db(tmp_path, 1)
+    start, end = START + 90, START + 3600 + 30
+    before = db.fetch_stats(start, end)
+    db.conn.execute("DELETE FROM SensorData")
+    db.conn.commit()
+    after = db.fetch_stats(start, end)
+    # El minuto donde empieza el rango se cuenta entero: suma su lectura, de antes de start
+    assert before["count"] == 59
+    assert after["count"] == 60
+    expected = np.round(temperatures[1:61], 2)
+    assert after["temp_max"] == expected.max()
+    assert after["temp_min"] == expected.min()
+    assert abs(after["temp_avg"] - expected.mean()) < 1e-6
+
+
+def coalesced_db(path, coalesce):
+    # 10 minutos de lecturas cada 0.5 s; con coalesce=True pasan antes por
+    # cola.coalesce_batches (una lectura de modo 2 cada 5 s con sus samples)
+    db = DataBase(str(path / ("c.db" if coalesce else "r.db")))
+    timestamps = (START + 0.5 * np.arange(1200)) * NS
+    temperatures = (20 + 3 * np.sin(np.arange(1200) / 9)).astype(np.float32)
+    batches = [ReadingBatch.raw(timestamps.astype(np.int64), temperatures, np.full(1200, 50, np.float32), "a")]
+    db.insert_many(coalesce_batches(batches) if coalesce else batches)
+    return db
+
+
+def test_coalesced_readings_weigh_their_samples(tmp_path):
+    raw = coalesced_db(tmp_path, False)
+    db = coalesced_db(tmp_path, True)
+    query = "SELECT bucket, count, temp_sum FROM SensorRollup1m WHERE mode = ? ORDER BY bucket"
+    expected = raw.conn.execute(query, (1,)).fetchall()
+    assert [row[:2] for row in db.conn.execute(query, (2,))] == [row[:2] for row in expected]
+    # Los promedios de modo 2 se guardan redondeados
+    assert np.allclose([row[2] for row in db.conn.execute(query, (2,))], [row[2] for row in expected], rtol=1e-3)
+    # Los bordes del rango se leen de SensorData: también pesan sus samples
+    stats = db.fetch_stats(START + 30, START + 570)
+    assert stats["count"] == raw.fetch_stats(START + 30, START + 570)["count"]
+    # Y al recalcular los agregados desde SensorData
+    db.rebuild_rollups()
+    assert [row[:2] for row in db.conn.execute(query, (2,))] == [row[:2] for row in expected]
@@ -0,0 +1,117 @@
+# Estadísticas móviles y lecturas de modo 2 calculadas en el servidor
+import numpy as np
+import pytest
+
+from estadisticas import RollingWindow, WindowAggregator
+from lecturas import NS, ReadingBatch
+
+
+def check(window, values):
+    assert len(window) == len(values)
+    assert window.mean == pytest.approx(values.mean(), abs=1e-9)
+    # Con una sola muestra la desviación es 0
+    assert window.std() == pytest.approx(values.std(ddof=1) if len(values) > 1 else 0.0, abs=1e-9)
+    assert window.min() == values.min()
+    assert window.max() == values.max()
+
+
+def test_rolling_window_by_size_matches_numpy():
+    # Lotes de tamaño variable (uno, varios, más que la ventana) mezclados
+    rng = np.random.default_rng(1)
+    window = RollingWindow(size=50)
+    values = np.empty(0)
+    for n in rng.choice([1, 1, 3, 17, 49, 120], size=300).tolist():
+        chunk = rng.normal(20, 5, n).round(2)
+        if n == 1:
+            window.add(float(len(values)), float(chunk[0]))
+        else:
+            window.extend(np.arange(len(values), len(values) + n), chunk)
+        values = np.concatenate((values, chunk))
+        check(window, values[-50:])
+
+
+def test_rolling_window_by_duration_matches_numpy():
+    rng = np.random.default_rng(2)
+    window = RollingWindow(duration=5.0)
+    timestamps = np.cumsum(rng.uniform(0.01, 0.5, 3000))
+    values = rng.normal(20, 5, 3000).round(2)
+    position = 0
+    for n in rng.choice([1, 4, 30], size=200).tolist():
+        end = min(position + n, len(values))
+        window.extend(timestamps[position:end], values[position:end])
+        position = end
+        inside = timestamps[:end] > timestamps[end - 1] - 5.0
+        check(window, values[:end][inside])
+
+
+def test_rolling_window_skips_missing_readings():
+    window = RollingWindow(size=3)
+    window.extend([0, 1, 2, 3], [1.0, np.nan, 3.0, 5.0])
+    window.add(4, None)
+    window.add(5, 7.0)
+    check(window, np.array([3.0, 5.0, 7.0]))
+
+
+def raw_batch(seconds, temperatures, device_id="a"):
+    seconds = np.asarray(seconds, dtype=np.float64)
+    temperatures = np.asarray(temperatures, dtype=np.float32)
+    return ReadingBatch.raw((seconds * NS).astype(np.int64), temperatures, temperatures + 30, device_id)
+
+
+def windows(batches):
+    # (dispositivo, fin del tramo en s, promedio, máximo, mínimo) de las lecturas emitidas
+    return [(b.device_id, int(t) // NS, round(float(avg), 4), float(high), float(low))
+            for b in batches for t, avg, high, low in zip(b.data["timestamp"], b.data["temp_avg"],
+                                                           b.data["temp_max"], b.data["temp_min"])]
+
+
+def expected_windows(seconds, temperatures, size, device_id="a"):
+    seconds = np.asarray(seconds)
+    temperatures = np.asarray(temperatures, dtype=np.float32)
+    buckets = seconds // size
+    return [(device_id, int(bucket + 1) * size, round(float(temperatures[buckets == bucket].mean()), 4),
+             float(temperatures[buckets == bucket].max()), float(temperatures[buckets == bucket].min()))
+            for bucket in np.unique(buckets)]
+
+
+def test_window_aggregator_merges_the_open_window_across_batches():
+    rng = np.random.default_rng(3)
+    seconds = np.arange(0, 60, 0.5)
+    temperatures = rng.normal(20, 3, len(seconds)).round(2)
+    one = WindowAggregator(windows=(5.0,))
+    split = WindowAggregator(windows=(5.0,))
+    emitted_one = one.add([raw_batch(seconds, temperatures)]) + one.flush(10 ** 20)
+    emitted_split = []
+    # Cortes a mitad de tramo: el tramo abierto sigue en el lote siguiente
+    for start, end in ((0, 7), (7, 8), (8, 33), (33, 120)):
+        emitted_split += split.add([raw_batch(seconds[start:end], temperatures[start:end])])
+    emitted_split += split.flush(10 ** 20)
+    assert windows(emitted_one) == windows(emitted_split) == expected_windows(seconds, temperatures, 5)
+    assert all(b.data["window_ms"].tolist() == [5000] * len(b) for b in emitted_split)
+
+
+def test_window_aggregator_devices_late_readings_and_expire():
+    aggregator = WindowAggregator(windows=(5.0,), grace=5.0)
+    assert aggregator.add([raw_batch([0, 1], [10, 20], "a"), raw_batch([2], [30], "b")]) == []
+    # Una lectura de "a" en el tramo siguiente cierra el suyo; "b" sigue abierto
+    assert windows(aggregator.add([raw_batch([6], [40], "a")])) == [("a", 5, 15.0, 20.0, 10.0)]
+    # Una lectura atrasada de "a" entra en el tramo abierto
+    assert aggregator.add([raw_batch([3], [50], "a")]) == []
+    # Cuando las lecturas van grace segundos después del fin del tramo de "b", se cierra
+    assert windows(aggregator.add([raw_batch([10.5], [0], "c")]) + aggregator.expire()) == [("b", 5, 30.0, 30.0, 30.0)]
+    assert windows(aggregator.add([raw_batch([11], [0], "a")])) == [("a", 10, 45.0, 50.0, 40.0)]
+
+
+def test_window_aggregator_weights_coalesced_readings():
+    # Una lectura resumida por la cola (4 lecturas, promedio 10) y una en bruto (20)
+    coalesced = ReadingBatch.empty(1, "a")
+    coalesced.data["timestamp"] = 1 * NS
+    coalesced.data["temp_avg"] = 10
+    coalesced.data["temp_max"] = 12
+    coalesced.data["temp_min"] = 8
+    coalesced.data["hum_avg"] = coalesced.data["hum_max"] = coalesced.data["hum_min"] = 50
+    coalesced.data["mode"] = 2
+    coalesced.data["samples"] = 4
+    aggregator = WindowAggregator(windows=(5.0,))
+    aggregator.add([coalesced, raw_batch([2], [20])])
+    assert windows(aggregator.flush(10 ** 20)) == [("a", 5, 12.0, 20.0, 8.0)]
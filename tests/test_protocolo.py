@@ -0,0 +1,81 @@
+# Parser de líneas de texto y tramas binarias de las placas
+import numpy as np
+
+from protocolo import KIND_DATA, KIND_STATS, BinaryDecoder, LineFramer, encode_frame, parse_lines
+
+NOW = 1700000000 * 1000000000
+
+
+def test_parse_lines_data():
+    batch, others = parse_lines([b"DATA 21.50 40.25", b"DATA 22 41\r"], NOW, "a")
+    assert others == []
+    assert batch.device_id == "a"
+    assert batch.values("temperature").tolist() == [21.5, 22.0]
+    assert batch.values("humidity").tolist() == [40.25, 41.0]
+    assert np.all(batch.data["timestamp"] == NOW)
+
+
+def test_parse_lines_data_token_across_lines():
+    # Los tokens suman 3 por línea y hay un DATA cada 3, pero ninguna línea es
+    # válida: no son dos lecturas (1, 2) y (5, 6)
+    batch, others = parse_lines([b"DATA 1 2 DATA", b"5 6"], NOW)
+    assert len(batch) == 0
+    assert others == ["5 6"]
+
+
+def test_parse_lines_mixed():
+    batch, others = parse_lines([b"DATA 1 2", b"", b"STATS 1 2 3 4 5 6", b"HELLO x", b"DATA 1"], NOW)
+    assert batch.data["mode"].tolist() == [1, 2]
+    assert batch.values("temp_avg")[1] == 1.0
+    assert others == ["HELLO x"]
+
+
+def data_frame(seqs, start_ms=0):
+    return encode_frame(KIND_DATA, [(seq, start_ms + 100 * i, 2000 + seq % 100, 5000) for i, seq in enumerate(seqs)])
+
+
+def test_frames_split_across_recv():
+    stream = (b"HELLO a BIN1\n" + data_frame(range(3)) + b"DATA 1 2\n"
+              + encode_frame(KIND_STATS, [(3, 300, 1, 2, 3, 4, 5, 6)]) + data_frame(range(4, 8)))
+    framer = LineFramer(size=16)
+    lines, frames = [], []
+    # Un byte por recv: la cabecera y los registros llegan partidos en cualquier punto
+    for i in range(len(stream)):
+        framer.feed(stream[i:i + 1])
+        more_lines, more_frames = framer.messages()
+        lines += more_lines
+        frames += more_frames
+    assert lines == [b"HELLO a BIN1", b"DATA 1 2"]
+    assert [(kind, count) for kind, count, _ in frames] == [(KIND_DATA, 3), (KIND_STATS, 1), (KIND_DATA, 4)]
+    assert framer.start == framer.end == 0
+    decoder = BinaryDecoder()
+    batch = decoder.decode(frames, NOW, "a")
+    assert batch.data["mode"].tolist() == [1, 1, 1, 2, 1, 1, 1, 1]
+    assert batch.values("temperature")[[0, 2, 7]].tolist() == [20.0, 20.02, 20.07]
+    assert batch.values("hum_min")[3] == 0.06
+    assert decoder.lost == 0
+
+
+def test_partial_frame_waits_for_the_rest():
+    frame = data_frame(range(5))
+    framer = LineFramer()
+    framer.feed(frame[:-3])
+    assert framer.messages() == ([], [])
+    framer.feed(frame[-3:] + frame[:2])
+    lines, frames = framer.messages()
+    assert lines == [] and len(frames) == 1
+    # Solo queda pendiente la cabecera incompleta de la trama siguiente
+    assert framer.end - framer.start == 2
+
+
+def test_binary_decoder_counts_lost_readings():
+    decoder = BinaryDecoder()
+    decoder.decode([(KIND_DATA, 3, data_frame([0, 1, 2])[4:])], NOW)
+    # Hueco entre lotes (3, 4) y dentro del lote (6)
+    decoder.decode([(KIND_DATA, 2, data_frame([5, 7])[4:])], NOW)
+    assert decoder.lost == 3
+    # La secuencia de 32 bits da la vuelta sin contar pérdidas
+    decoder = BinaryDecoder()
+    decoder.decode([(KIND_DATA, 2, data_frame([0xFFFFFFFE, 0xFFFFFFFF])[4:])], NOW)
+    decoder.decode([(KIND_DATA, 2, data_frame([0, 1])[4:])], NOW)
+    assert decoder.lost == 0
@@ -0,0 +1,24 @@
+# Servidor TCP: lo que hace con los mensajes de cada conexión
+import pytest
+
+import cola
+import monitorpi
+
+
+@pytest.fixture
+def server():
+    server = monitorpi.TCPServer(cola.IngestQueue(1000), host="127.0.0.1", port=0)
+    yield server
+    server.stop()
+
+
+def test_metrics_before_hello_use_a_single_label(server):
+    before = monitorpi.READINGS_RECEIVED.values.get(monitorpi.UNKNOWN_DEVICE, 0)
+    # Dos conexiones sin HELLO (o la misma placa reconectada): una sola serie
+    server.process_lines([b"DATA 21 50"], "10.0.0.5:40001")
+    server.process_lines([b"DATA 21 50"], "10.0.0.5:40002")
+    assert monitorpi.READINGS_RECEIVED.values[monitorpi.UNKNOWN_DEVICE] == before + 2
+    assert "10.0.0.5:40001" not in monitorpi.READINGS_RECEIVED.values
+    device_id = server.identify_client(b"HELLO esp32-test", "10.0.0.5:40003")
+    server.process_lines([b"DATA 21 50"], device_id)
+    assert monitorpi.READINGS_RECEIVED.values["esp32-test"] == 1